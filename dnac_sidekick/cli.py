@@ -14,38 +14,91 @@ Feel free to open a PR or fork the project to modify to your needs.
 """
 
 import click
-import requests
-from requests.auth import HTTPBasicAuth
 import os
-from dotenv import load_dotenv
+from functools import partial
 
-from dnac_sidekick.inventory import commands as inventory_cmds
-from dnac_sidekick.health import commands as health_cmds
-from dnac_sidekick.device_commands import commands as device_commands_cmds
-from dnac_sidekick.licenses import commands as license_cmds
-from dnac_sidekick.generate import commands as generate_cmds
+from dnac_sidekick.helpers import decode
+from dnac_sidekick.helpers.cache import DEFAULT_MAX_SYNC_AGE, DEFAULT_TTL
+from dnac_sidekick.helpers.lazy import LazyGroup
 
+# Command modules (and the API client, which pulls in requests) are only imported when a command that
+# needs them runs, so 'dnac-sidekick --help' and other quick commands start fast.
+# Format: {command name: "package.module.command_function"}
+ROOT_COMMANDS = {
+    "command-runner": "dnac_sidekick.device_commands.commands.command_runner",
+}
+# Short help for the root's lazy commands, so 'dnac-sidekick --help' doesn't need to import them
+ROOT_COMMANDS_HELP = {
+    "command-runner": "Run 'show' commands on network devices in DNAC.",
+}
+GET_COMMANDS = {
+    "licenses": "dnac_sidekick.licenses.commands.licenses",
+}
+INVENTORY_COMMANDS = {
+    "devices": "dnac_sidekick.inventory.commands.devices",
+}
+HEALTH_COMMANDS = {
+    "devices": "dnac_sidekick.health.commands.devices",
+    "clients": "dnac_sidekick.health.commands.clients",
+    "record": "dnac_sidekick.health.commands.record",
+    "watch": "dnac_sidekick.health.commands.watch",
+    "trends": "dnac_sidekick.health.commands.trends",
+}
+GENERATE_COMMANDS = {
+    "pyats-testbed": "dnac_sidekick.generate.commands.pyats_testbed",
+    "ansible-inventory": "dnac_sidekick.generate.commands.ansible_inventory",
+}
+# Commands that only read local data (ex. the health history), so no DNAC client is set up for them and
+# they don't need DNAC credentials
+# Format: {group name: {command names}}
+LOCAL_COMMANDS = {"health": {"trends"}}
+# Key of the 'get' group's client options in the Click context's metadata, for groups that set up the client
+# once the command is known
+CLIENT_OPTIONS_KEY = "dnac_sidekick.client_options"
 dotenv_file = "../.env"
-load_dotenv(dotenv_file)
-requests.packages.urllib3.disable_warnings()
 
 
-class DnacUser(object):
-    def __init__(self, dnac_url=None, username=None, password=None, token=None):
-        self.dnac_url = dnac_url
-        self.dnac_user = username
-        self.dnac_pass = password
-        self.token = token
-
-
-@click.group()
+@click.group(
+    cls=LazyGroup, lazy_subcommands=ROOT_COMMANDS, lazy_help=ROOT_COMMANDS_HELP
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Print request counts, latencies and local processing time once the command finishes.",
+)
+@click.option(
+    "--profile-output",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Save the profiling report to a file (implies --profile).",
+)
+@click.option(
+    "--profile-format",
+    type=click.Choice(["json", "prometheus"], case_sensitive=False),
+    default="json",
+    show_default=True,
+    help="Format of the file saved with --profile-output.",
+)
 @click.pass_context
-def dnac_cli(ctx):
+def dnac_cli(ctx, profile, profile_output, profile_format):
     """
     Extract sensitive info from environment variables that will be used to connect to DNA Center and add to Click Context.
     By adding to Click Context, these values can be used across all commands.
     """
-    pass
+    # Loaded here rather than at import time, so it's only done when a command actually runs
+    from dotenv import load_dotenv
+
+    load_dotenv(dotenv_file)
+    # JSON library used to decode responses and write cache/NDJSON files (defaults to orjson when installed)
+    decode.set_backend(os.environ.get("DNAC_JSON_DECODER"))
+    if profile or profile_output:
+        # Shared with every subcommand through the context's metadata. The report is printed once the
+        # whole command (including any subcommand cleanup) has finished.
+        from dnac_sidekick.helpers.profiling import PROFILER_KEY, Profiler
+
+        profiler = ctx.meta[PROFILER_KEY] = Profiler()
+        if profile_output:
+            ctx.call_on_close(lambda: profiler.dump(profile_output, profile_format))
+        ctx.call_on_close(profiler.report)
 
 
 @dnac_cli.command
@@ -58,29 +111,29 @@ def login():
     # Confirm set env var values are not None
     if None in (dnac_url, username, password):
         raise click.ClickException("A necessary environment variable has not been set.")
-    # Since value is being read from env var, and not context, need to add extra logic
-    if dnac_url[-1] == "/":
-        dnac_url = dnac_url.rstrip(dnac_url[-1])
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-    }
-    dnac_token_url = f"{dnac_url}/dna/system/api/v1/auth/token"
-    click.echo("Attempting to login to DNAC...")
-    token = requests.post(
-        url=dnac_token_url,
-        headers=headers,
-        auth=HTTPBasicAuth(username=username, password=password),
-        verify=False,
+    from dnac_sidekick.helpers.client import DnacClient
+    from dnac_sidekick.helpers.profiling import current_profiler
+    from dnac_sidekick.helpers.tokens import TokenCache
+
+    token_cache = TokenCache()
+    client = DnacClient(
+        dnac_url=dnac_url,
+        username=username,
+        password=password,
+        profiler=current_profiler(),
+        token_cache=token_cache,
     )
+    click.echo("Attempting to login to DNAC...")
+    token = client.login()
+    client.close()
     if token.status_code == 200:
-        actual_token = token.json()["Token"]
         click.echo("Token generated successfully!")
-        # Set new token as env var and update .env file
+        # Token is cached, so other commands will use it until it expires (DNAC_TOKEN doesn't need to be set)
         click.echo(
-            "Copy token below and set as environment variable for future requests:"
+            f"Token cached at {token_cache.path} and will be reused until it expires."
         )
-        click.echo(actual_token)
+        click.echo("Copy token below to set as environment variable for other tools:")
+        click.echo(client.token)
 
     elif token.status_code == 401:
         click.echo(
@@ -91,73 +144,211 @@ def login():
         click.echo(f"Status code: {token.status_code}. Error message: {token.text}.")
 
 
-@dnac_cli.group()
-@click.pass_context
-def get(ctx):
-    """Action for read-only tasks and gathering information."""
-    click.echo("Getting information...")
+def cache_options(f):
+    """Options to control the local cache of inventory and topology data"""
+    f = click.option(
+        "--max-sync-age",
+        type=click.IntRange(min=0),
+        default=DEFAULT_MAX_SYNC_AGE,
+        show_default=True,
+        envvar="DNAC_MAX_SYNC_AGE",
+        help="Seconds since the last full inventory pull after which a synced inventory is no longer used, "
+        "even while fresh, and the full inventory is pulled again.",
+    )(f)
+    f = click.option(
+        "--incremental",
+        is_flag=True,
+        help="Refresh stale cached inventory by only pulling devices that were added or whose hostname, IP, "
+        "software version, platform or role changed. Other fields (ex. reachability, uptime) are only "
+        "refreshed by full pulls (see --max-sync-age).",
+    )(f)
+    f = click.option(
+        "--offline",
+        is_flag=True,
+        help="Only use cached data, even if it is stale. Fails if nothing is cached.",
+    )(f)
+    f = click.option(
+        "--refresh",
+        is_flag=True,
+        help="Ignore cached data and pull fresh data from DNAC.",
+    )(f)
+    f = click.option(
+        "--cache-ttl",
+        type=click.IntRange(min=0),
+        default=DEFAULT_TTL,
+        show_default=True,
+        envvar="DNAC_CACHE_TTL",
+        help="Seconds that cached inventory and topology data is reused. Use 0 to disable.",
+    )(f)
+    return f
 
-    # Confirm all the necessary env vars are set
-    dnac_url = os.environ.get("DNAC_URL")
-    dnac_user = os.environ.get("DNAC_USER")
-    dnac_pass = os.environ.get("DNAC_PASS")
-    dnac_token = os.environ.get("DNAC_TOKEN")
-    # Add values to context for read-only actions to use
-    if None not in (dnac_url, dnac_user, dnac_pass, dnac_token):
-        ctx.obj = DnacUser(
-            dnac_url=dnac_url,
-            username=dnac_user,
-            password=dnac_pass,
-            token=dnac_token,
+
+def controller_options(f):
+    """Option to run a command against several DNAC clusters (named controller profiles) at once"""
+    return click.option(
+        "--controllers",
+        multiple=True,
+        envvar="DNAC_CONTROLLERS",
+        help="Query these controller profiles (ex. emea,amer) concurrently and merge their results. "
+        "A profile named 'emea' is set up with DNAC_EMEA_URL, DNAC_EMEA_USER, DNAC_EMEA_PASS and/or DNAC_EMEA_TOKEN.",
+    )(f)
+
+
+def parse_rate_limit(ctx: click.Context, param: click.Parameter, value: str):
+    """Parse --rate-limit while options are parsed, so a bad value fails before DNAC is contacted"""
+    if value is None:
+        return None
+    from dnac_sidekick.helpers.ratelimit import parse_rate_limit
+
+    try:
+        return parse_rate_limit(value)
+    except click.ClickException as e:
+        raise click.BadParameter(e.message)
+
+
+def rate_limit_option(f):
+    """Option to change how many requests per second are sent to DNAC's intent API"""
+    return click.option(
+        "--rate-limit",
+        envvar="DNAC_RATE_LIMIT",
+        callback=parse_rate_limit,
+        help="Requests per second (and burst size, ex. 50/100) sent to DNAC's intent API. This caps how much "
+        "--workers can speed commands up. Defaults to 20/40, or the intent limit in DNAC_RATE_LIMITS.",
+    )(f)
+
+
+def setup_client(
+    ctx,
+    cache_ttl,
+    refresh,
+    offline,
+    incremental,
+    max_sync_age,
+    controllers=(),
+    rate_limit=None,
+):
+    """
+    Confirm all the necessary env vars are set and add a shared DNAC client to context for actions to use.
+    The client's HTTP session is closed (and cache usage reported) once the command finishes.
+
+    With --controllers, a client is created for every controller profile (each with its own session, token
+    and cache) and kept in the context's metadata for commands to fan out to. The first one is also
+    used as the context's client.
+
+    A rate limit (rate, burst) overrides the intent API limit of every client.
+    """
+    if refresh and offline:
+        raise click.UsageError("--refresh and --offline can't be used together.")
+    from dnac_sidekick.helpers.cache import ResponseCache
+    from dnac_sidekick.helpers.client import client_from_env
+    from dnac_sidekick.helpers.controllers import CONTROLLERS_KEY, parse_controllers
+
+    names = parse_controllers(controllers)
+    # Format: {profile name: DnacClient}
+    clients = {name: client_from_env(name, rate_limit) for name in names}
+    # Two profiles for the same DNAC would list every record twice (and share one cache file per endpoint)
+    # Format: {DNAC URL: profile name}
+    urls = {}
+    for name, client in clients.items():
+        if client.dnac_url in urls:
+            raise click.UsageError(
+                f"Controllers '{urls[client.dnac_url]}' and '{name}' both point at {client.dnac_url}."
+            )
+        urls[client.dnac_url] = name
+    ctx.obj = (
+        next(iter(clients.values())) if clients else client_from_env(None, rate_limit)
+    )
+    if clients:
+        ctx.meta[CONTROLLERS_KEY] = clients
+    for name, client in clients.items() if clients else [(None, ctx.obj)]:
+        client.cache = ResponseCache(
+            client.dnac_url,
+            ttl=cache_ttl,
+            refresh=refresh,
+            offline=offline,
+            incremental=incremental,
+            max_sync_age=max_sync_age,
         )
-    else:
-        raise click.ClickException("A necessary environment variable has not been set.")
+        ctx.call_on_close(client.close)
+        ctx.call_on_close(partial(client.cache.report, name))
+        ctx.call_on_close(partial(client.scheduler.report, name))
+
+
+@dnac_cli.group(cls=LazyGroup, lazy_subcommands=GET_COMMANDS)
+@cache_options
+@controller_options
+@rate_limit_option
+@click.pass_context
+def get(
+    ctx,
+    cache_ttl,
+    refresh,
+    offline,
+    incremental,
+    max_sync_age,
+    controllers,
+    rate_limit,
+):
+    """Action for read-only tasks and gathering information."""
+    # Status messages go to stderr, so stdout only holds command output (ex. CSV)
+    click.echo("Getting information...", err=True)
+    ctx.meta[CLIENT_OPTIONS_KEY] = dict(
+        cache_ttl=cache_ttl,
+        refresh=refresh,
+        offline=offline,
+        incremental=incremental,
+        max_sync_age=max_sync_age,
+        controllers=controllers,
+        rate_limit=rate_limit,
+    )
+    # Groups with local commands set up the client themselves
+    if ctx.invoked_subcommand not in LOCAL_COMMANDS:
+        setup_client(ctx, **ctx.meta[CLIENT_OPTIONS_KEY])
 
 
-@get.group()
+@get.group(cls=LazyGroup, lazy_subcommands=INVENTORY_COMMANDS)
 @click.pass_context
 def inventory(ctx):
     """Gathers information related to device inventory in DNAC"""
     pass
 
 
-@get.group()
+@get.group(cls=LazyGroup, lazy_subcommands=HEALTH_COMMANDS)
 @click.pass_context
 def health(ctx):
     """Gathers health information for network devices and clients in DNAC"""
-    pass
+    if ctx.invoked_subcommand not in LOCAL_COMMANDS["health"]:
+        setup_client(ctx, **ctx.meta[CLIENT_OPTIONS_KEY])
 
 
-@dnac_cli.group()
+@dnac_cli.group(cls=LazyGroup, lazy_subcommands=GENERATE_COMMANDS)
+@cache_options
+@controller_options
+@rate_limit_option
 @click.pass_context
-def generate(ctx):
+def generate(
+    ctx,
+    cache_ttl,
+    refresh,
+    offline,
+    incremental,
+    max_sync_age,
+    controllers,
+    rate_limit,
+):
     """Action to generate testbeds and inventory files."""
     click.echo("Generating...")
+    setup_client(
+        ctx,
+        cache_ttl,
+        refresh,
+        offline,
+        incremental,
+        max_sync_age,
+        controllers,
+        rate_limit,
+    )
 
-    # Confirm all the necessary env vars are set
-    dnac_url = os.environ.get("DNAC_URL")
-    dnac_user = os.environ.get("DNAC_USER")
-    dnac_pass = os.environ.get("DNAC_PASS")
-    dnac_token = os.environ.get("DNAC_TOKEN")
-    # Add values to context for read-only actions to use
-    if None not in (dnac_url, dnac_user, dnac_pass, dnac_token):
-        ctx.obj = DnacUser(
-            dnac_url=dnac_url,
-            username=dnac_user,
-            password=dnac_pass,
-            token=dnac_token,
-        )
-    else:
-        raise click.ClickException("A necessary environment variable has not been set.")
-
-
-inventory.add_command(inventory_cmds.devices)
-health.add_command(health_cmds.devices)
-health.add_command(health_cmds.clients)
-dnac_cli.add_command(device_commands_cmds.command_runner)
-get.add_command(license_cmds.licenses)
-generate.add_command(generate_cmds.pyats_testbed)
-generate.add_command(generate_cmds.ansible_inventory)
 
 if __name__ == "__main__":
     dnac_cli()
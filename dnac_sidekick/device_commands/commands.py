@@ -1,82 +1,310 @@
 """ Commands to run CLI commands on network devices in DNAC inventory and view the output. """
 
 import click
-import requests
 import json
-import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Pattern, Tuple, Union
+from dnac_sidekick.cli import (
+    cache_options,
+    controller_options,
+    rate_limit_option,
+    setup_client,
+)
+from dnac_sidekick.helpers.client import DnacClient
+from dnac_sidekick.helpers.controllers import controller_clients, per_controller
+from dnac_sidekick.helpers.tasks import DEFAULT_TIMEOUT, wait_for_tasks
+from dnac_sidekick.helpers.topology import get_assigned_devices, get_site_hierarchy
+from dnac_sidekick.inventory.commands import iter_devices
+from dnac_sidekick.inventory.index import resolve_controller_devices
 
+# DNAC limits on a single command runner (cli/read-request) call
+MAX_COMMANDS_PER_REQUEST = 5
+MAX_DEVICES_PER_REQUEST = 100
+# Number of command runner requests, task checks and file downloads sent to DNAC at the same time
+DEFAULT_WORKERS = 8
 
-@click.command
-@click.option(
-    "--device", required=True, help="Specify a device's hostname to run commands."
-)
-@click.option(
-    "--command", required=True, help="Specify a command to run on the specified device."
-)
-def command_runner(device, command):
-    """Run 'show' commands on network devices in DNAC."""
-    # Confirm all the necessary env vars are set
-    dnac_url = os.environ.get("DNAC_URL")
-    dnac_user = os.environ.get("DNAC_USER")
-    dnac_pass = os.environ.get("DNAC_PASS")
-    dnac_token = os.environ.get("DNAC_TOKEN")
-    # Add values to context for read-only actions to use
-    if None in (dnac_url, dnac_user, dnac_pass, dnac_token):
-        raise click.ClickException("A necessary environment variable has not been set.")
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "X-Auth-Token": dnac_token,
+
+def chunks(items: list, size: int) -> List[list]:
+    return [items[idx : idx + size] for idx in range(0, len(items), size)]
+
+
+def get_devices_by_regex(
+    client: DnacClient, pattern: Union[str, Pattern]
+) -> Dict[str, str]:
+    """Find every device in inventory with a hostname matching the regex"""
+    try:
+        hostname_re = re.compile(pattern)
+    except re.error as e:
+        raise click.BadParameter(
+            f"'{pattern}' is not a valid regex: {e}", param_hint="'--device-regex'"
+        )
+    return {
+        dev["hostname"]: dev["id"]
+        for dev in iter_devices(client)
+        if dev.get("hostname") and hostname_re.search(dev["hostname"])
     }
-    dnac_devices_url = f"{dnac_url}/dna/intent/api/v1/network-device?hostname={device}"
-    net_devices_resp = requests.get(url=dnac_devices_url, headers=headers, verify=False)
-    if net_devices_resp.status_code == 200:
-        dev_id = net_devices_resp.json()["response"][0].get("id")
-        if not dev_id:
-            raise click.ClickException("Device hostname not found in inventory.")
-    dnac_command_run = (
-        f"{dnac_url}/dna/intent/api/v1/network-device-poller/cli/read-request"
-    )
+
+
+def get_devices_by_site(client: DnacClient, site: str) -> Dict[str, str]:
+    """
+    Find every device assigned to a site, or any of its child sites.
+
+    The site can be given as its full hierarchy (ex. Global/San Jose/SJC-20) or just its name (ex. SJC-20).
+    """
+    sites = get_site_hierarchy(client)
+    site_name = site.replace(" ", "_").replace("-", "_").lower()
+    matched = [
+        dets.hierarchy
+        for dets in sites.values()
+        if site in (dets.hierarchy, dets.name) or site_name == dets.name
+    ]
+    if not matched:
+        raise click.ClickException(f"Site '{site}' not found in DNAC.")
+    site_ids = {
+        site_id
+        for site_id, dets in sites.items()
+        for hier in matched
+        if dets.hierarchy == hier or dets.hierarchy.startswith(f"{hier}/")
+    }
+    return {
+        dev.hostname: dev_id
+        for dev_id, dev in get_assigned_devices(client).items()
+        if dev.site_id in site_ids
+    }
+
+
+def start_read_request(
+    client: DnacClient, commands: List[str], dev_ids: List[str]
+) -> str:
+    """Run commands on a batch of devices, which kicks off a task in DNAC. Returns the task ID."""
     payload = {
         "timeout": 5,
         "description": "Just a simple command ran by DNAC sidekick",
         "name": "DNAC sidekick command run",
-        "commands": [command],
-        "deviceUuids": [dev_id],
+        "commands": commands,
+        "deviceUuids": dev_ids,
     }
-    # Run command, which kicks off a task in DNAC
-    comm_run_resp = requests.post(
-        url=dnac_command_run, headers=headers, json=payload, verify=False
+    comm_run_resp = client.post(
+        "/dna/intent/api/v1/network-device-poller/cli/read-request", json=payload
     )
     if comm_run_resp.status_code == 202:
         task_id = comm_run_resp.json()["response"].get("taskId")
         if not task_id:
             raise click.ClickException("Task ID not found.")
+        return task_id
     else:
-        print("Could not get task ID.")
-        print(f"Status code: {comm_run_resp.status_code}")
-        print(f"Error: {comm_run_resp.text}")
-    # Get task by ID
-    task_check = f"{dnac_url}/api/v1/task/{task_id}"
-    task_check_resp = requests.get(url=task_check, headers=headers, verify=False)
-    if task_check_resp.status_code == 200:
-        tasks_found = task_check_resp.json()["response"]
-        task_end = tasks_found.get("endTime")
-        while task_end is None:
-            task_checkup = requests.get(url=task_check, headers=headers, verify=False)
-            resp = task_checkup.json()["response"]
-            end_time = resp.get("endTime")
-            if end_time is not None:
-                raw_file_id = json.loads(resp.get("progress"))
-                file_id = raw_file_id.get("fileId")
-                task_end = 0
-    else:
-        print(f"Status code: {task_check_resp.status_code}")
-        print(f"Error! Error message: {task_check_resp.text}")
-        raise click.ClickException("File ID not found.")
-    # Get file by ID
-    dnac_get_file = f"{dnac_url}/dna/intent/api/v1/file/{file_id}"
-    file_resp = requests.get(url=dnac_get_file, headers=headers, verify=False)
-    if net_devices_resp.status_code == 200:
-        command_output = file_resp.json()[0]["commandResponses"]["SUCCESS"][command]
-        print(command_output)
+        raise click.ClickException(
+            f"Could not get task ID. Status code: {comm_run_resp.status_code}. Error: {comm_run_resp.text}"
+        )
+
+
+def get_task_file_id(task: dict) -> Union[str, None]:
+    """Get the ID of the file holding a finished command runner task's output (None if the task failed)"""
+    if task.get("isError"):
+        return None
+    return json.loads(task.get("progress")).get("fileId")
+
+
+def get_command_file(client: DnacClient, file_id: str) -> list:
+    """Download the command output for every device in a finished task"""
+    file_resp = client.get(f"/dna/intent/api/v1/file/{file_id}")
+    if file_resp.status_code != 200:
+        raise click.ClickException(
+            f"Could not download command output. Status code: {file_resp.status_code}. Error message: {file_resp.text}"
+        )
+    return file_resp.json()
+
+
+def validate_regex(ctx: click.Context, param: click.Parameter, value: str):
+    """Compile --device-regex while options are parsed, so an invalid pattern fails before DNAC is contacted"""
+    if value is None:
+        return None
+    try:
+        return re.compile(value)
+    except re.error as e:
+        raise click.BadParameter(f"'{value}' is not a valid regex: {e}")
+
+
+def run_commands(
+    client: DnacClient,
+    commands: List[str],
+    dev_ids: List[str],
+    workers: int,
+    timeout: float,
+) -> Dict[Tuple[str, str], Tuple[str, str]]:
+    """
+    Run commands on devices with DNAC's command runner and collect the output.
+
+    Returns a map of (device ID, command) -> (status, output), where status is SUCCESS, FAILURE or BLACKLISTED.
+    """
+    if not dev_ids:
+        return {}
+    # Batch devices and commands to stay under DNAC's per-request limits. Each batch runs as its own task.
+    batches = [
+        (cmd_batch, dev_batch)
+        for dev_batch in chunks(dev_ids, MAX_DEVICES_PER_REQUEST)
+        for cmd_batch in chunks(commands, MAX_COMMANDS_PER_REQUEST)
+    ]
+    client.set_pool_size(workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        task_ids = list(
+            executor.map(lambda batch: start_read_request(client, *batch), batches)
+        )
+        # Wait on all tasks at once, backing off between checks
+        tasks = wait_for_tasks(client, task_ids, timeout=timeout, workers=workers)
+        # Map of task ID -> file ID (None for tasks that failed)
+        file_ids = {task_id: get_task_file_id(task) for task_id, task in tasks.items()}
+        # Map of (device ID, command) -> output
+        results = {}
+        # A failed task only fails its own batch, so every other batch's output is still shown
+        for task_id, (cmd_batch, dev_batch) in zip(task_ids, batches):
+            if file_ids[task_id] is None:
+                task = tasks[task_id]
+                reason = task.get("failureReason", task.get("progress"))
+                for dev_id in dev_batch:
+                    for cmd in cmd_batch:
+                        results[(dev_id, cmd)] = ("FAILURE", reason)
+        # Download the output of every successful task in parallel
+        files = executor.map(
+            lambda task_id: get_command_file(client, file_ids[task_id]),
+            [task_id for task_id in task_ids if file_ids[task_id] is not None],
+        )
+        for file_data in files:
+            for dev_output in file_data:
+                responses = dev_output.get("commandResponses", {})
+                for status in ("SUCCESS", "FAILURE", "BLACKLISTED"):
+                    for cmd, output in responses.get(status, {}).items():
+                        results[(dev_output["deviceUuid"], cmd)] = (status, output)
+    return results
+
+
+@click.command
+@click.option(
+    "--device",
+    multiple=True,
+    help="Specify a device's hostname, management IP or serial number to run commands. Can be used multiple times.",
+)
+@click.option(
+    "--device-regex",
+    callback=validate_regex,
+    help="Run commands on every device with a hostname matching this regex.",
+)
+@click.option(
+    "--site",
+    help="Run commands on every device assigned to this site (ex. 'Global/San Jose') or its child sites.",
+)
+@click.option(
+    "--command",
+    required=True,
+    multiple=True,
+    help="Specify a command to run on the specified device(s). Can be used multiple times.",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=DEFAULT_WORKERS,
+    show_default=True,
+    help="Number of requests to send to DNAC concurrently. Requests are still rate limited: 1/sec for command "
+    "runner requests and 5/sec for task checks and file downloads (see DNAC_RATE_LIMITS), and 20/sec (burst 40) "
+    "for inventory lookups (see --rate-limit).",
+)
+@click.option(
+    "--timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    default=DEFAULT_TIMEOUT,
+    show_default=True,
+    help="Seconds to wait for all commands to finish running.",
+)
+@cache_options
+@controller_options
+@rate_limit_option
+@click.pass_context
+def command_runner(
+    ctx,
+    device,
+    device_regex,
+    site,
+    command,
+    workers,
+    timeout,
+    cache_ttl,
+    refresh,
+    offline,
+    incremental,
+    max_sync_age,
+    controllers,
+    rate_limit,
+):
+    """Run 'show' commands on network devices in DNAC."""
+    if not (device or device_regex or site):
+        raise click.UsageError(
+            "Specify devices using --device, --device-regex and/or --site."
+        )
+    # Devices are resolved from the cached inventory when a fresh copy is available
+    setup_client(
+        ctx,
+        cache_ttl,
+        refresh,
+        offline,
+        incremental,
+        max_sync_age,
+        controllers,
+        rate_limit,
+    )
+    # Map of controller name -> {hostname: device ID} for every selected device (keeps the order devices were
+    # selected in). The controller name is None without --controllers.
+    selected = {}
+    if device:
+        for controller, dev in resolve_controller_devices(ctx, device):
+            selected.setdefault(controller, {})[dev["hostname"]] = dev["id"]
+    if device_regex:
+        for controller, matches in per_controller(
+            ctx, lambda client: get_devices_by_regex(client, device_regex)
+        ).items():
+            selected.setdefault(controller, {}).update(matches)
+    if site:
+        for controller, matches in per_controller(
+            ctx, lambda client: get_devices_by_site(client, site)
+        ).items():
+            selected.setdefault(controller, {}).update(matches)
+    if not any(selected.values()):
+        raise click.ClickException("No devices found in inventory.")
+    commands = list(command)
+
+    # Each controller runs the commands on its own devices, concurrently with the other controllers
+    names = {
+        client: name
+        for name, client in (controller_clients(ctx) or {None: ctx.obj}).items()
+    }
+    results = per_controller(
+        ctx,
+        lambda client: run_commands(
+            client,
+            commands,
+            list(selected.get(names[client], {}).values()),
+            workers,
+            timeout,
+        ),
+    )
+
+    single = (
+        sum(len(devices) for devices in selected.values()) == 1 and len(commands) == 1
+    )
+    for controller in names.values():
+        if controller not in results:
+            # The controller failed, which per_controller already reported
+            continue
+        for hostname, dev_id in selected.get(controller, {}).items():
+            if controller is not None:
+                hostname = f"{controller}/{hostname}"
+            for cmd in commands:
+                status, output = results[controller].get(
+                    (dev_id, cmd), ("FAILURE", "No output returned.")
+                )
+                if not single:
+                    click.echo(f"===== {hostname}: {cmd} =====")
+                if status == "SUCCESS":
+                    click.echo(output)
+                else:
+                    click.echo(f"{status}: {output}")
@@ -1,18 +1,171 @@
 """ Commands to generate testbeds and other inventory files sourcing from DNAC inventory """
 
-import json
 import click
+from dnac_sidekick.helpers import decode
+from dnac_sidekick.helpers.controllers import (
+    controller_clients,
+    iter_controllers,
+    per_controller,
+    with_controller,
+)
+from dnac_sidekick.helpers.profiling import profile_phase
+from dnac_sidekick.helpers.records import Device, Site, TopologyNode
 from dnac_sidekick.helpers.topology import (
+    build_site_index,
+    fetch_topology,
     get_assigned_devices,
     get_site_hierarchy,
-    get_site_name_by_id,
 )
-from dnac_sidekick.inventory.commands import devices
-from jinja2 import Environment, FileSystemLoader
+from dnac_sidekick.inventory.commands import iter_devices
 import os
+import re
+import tempfile
 from rich import print
-import requests
-import yaml
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator
+
+if TYPE_CHECKING:
+    from jinja2 import Template
+
+# Name of the shard used for devices that aren't assigned to a site
+UNASSIGNED_SHARD = "unassigned"
+
+
+def shard_name(name: str) -> str:
+    """Turn a site or device family name into something that's safe to use in a file name"""
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_") or UNASSIGNED_SHARD
+
+
+def site_shard_keys(client) -> Callable[[Device], str]:
+    """
+    Build a function that maps a device to the top-level site (area) it's assigned to.
+
+    Sharding by top-level site keeps the number of testbeds manageable, even when there are thousands
+    of buildings and floors.
+    """
+    site_topo, assigned = fetch_topology(
+        client, get_site_hierarchy, get_assigned_devices
+    )
+    # Map of device ID -> top-level site name
+    device_sites = {}
+    for dev_id, dev in assigned.items():
+        site = site_topo.get(dev.site_id)
+        if site:
+            hierarchy = site.hierarchy.split("/")
+            device_sites[dev_id] = hierarchy[1] if len(hierarchy) > 1 else hierarchy[0]
+    return lambda device: device_sites.get(device.id, UNASSIGNED_SHARD)
+
+
+def get_cli_users(client) -> list:
+    """Usernames of the CLI device credentials stored in DNAC"""
+    response = client.get("/dna/intent/api/v1/device-credential")
+    if response.status_code == 200:
+        return [cred["username"] for cred in response.json()["cli"]]
+    elif response.status_code == 401:
+        raise click.ClickException("Unauthorized. Please verify your token is valid.")
+    else:
+        raise click.ClickException("Could not retrieve device credentials from DNAC.")
+
+
+def spool_shards(
+    device_list: Iterable[Device], shard_key: Callable[[Device], str], directory: str
+) -> Dict[str, str]:
+    """
+    Split devices into one NDJSON file per shard, so each testbed can be rendered without
+    holding the inventory in memory. Returns a map of shard name -> spool file.
+    """
+    spools = {}
+    files = {}
+    try:
+        for device in device_list:
+            shard = shard_name(shard_key(device) or UNASSIGNED_SHARD)
+            if shard not in files:
+                spools[shard] = os.path.join(directory, f"{shard}.ndjson")
+                files[shard] = open(spools[shard], "w")
+            files[shard].write(f"{decode.dumps(device.to_json())}\n")
+    finally:
+        for spool in files.values():
+            spool.close()
+    return spools
+
+
+def read_spool(path: str) -> Iterator[Device]:
+    with open(path) as infile:
+        for line in infile:
+            yield Device.from_json(decode.loads(line))
+
+
+def add_site_groups(
+    parent_group: dict,
+    parent_name: str,
+    site_topo: Dict[str, Site],
+    devices: Dict[str, TopologyNode],
+    max_depth: int,
+    group_names: set,
+):
+    """
+    Add a group for every site in a DNAC site hierarchy under parent_group (nested under its parent site),
+    then add every device to its site's group. group_names holds the Ansible group names already used,
+    so names stay unique across controllers.
+    """
+    site_index, root_ids = build_site_index(site_topo)
+    # Map of site ID -> Ansible group that the site's devices are added to
+    site_groups = {}
+    # Create site hierarchy by walking the site index top-down. Uses a stack instead of recursion,
+    # so there's no limit on how deep the hierarchy can be.
+    # Format: (site ID, parent group, parent group name, depth)
+    stack = [(site_id, parent_group, parent_name, 1) for site_id in reversed(root_ids)]
+    while stack:
+        site_id, group_parent, group_parent_name, depth = stack.pop()
+        site = site_index[site_id]
+        if max_depth and depth > max_depth:
+            # Roll site up into its ancestor's group
+            group, group_name = group_parent, group_parent_name
+        else:
+            group_name = site.name
+            if group_name in group_names:
+                group_name = f"{group_parent_name}_{group_name}".lstrip("_")
+                # The prefixed name can be taken too (ex. floor_1 of bld_1 and a site named bld_1_floor_1),
+                # so number it until it's unique
+                base_name, suffix = group_name, 2
+                while group_name in group_names:
+                    group_name = f"{base_name}_{suffix}"
+                    suffix += 1
+            group_names.add(group_name)
+            group = {"hosts": {}}
+            group_parent.setdefault("children", {})[group_name] = group
+        site_groups[site_id] = group
+        for child_id in reversed(site.children):
+            stack.append((child_id, group, group_name, depth + 1))
+
+    # Add devices to site hierarchy. Devices that are 'unassigned' in DNAC (or assigned to an unknown site)
+    # are added to the parent group.
+    for dev in devices.values():
+        group = site_groups.get(dev.site_id, parent_group)
+        group["hosts"][dev.hostname] = {"ansible_host": dev.ip}
+
+
+def render_testbed(
+    tb_template: "Template", table_data: dict, device_list: Iterable[Device], path: str
+):
+    """
+    Render a testbed straight to disk as the template is evaluated, one device at a time.
+
+    The testbed is rendered to a temporary file next to 'path' that only replaces it once rendering finishes,
+    so a failed run (ex. DNAC dropping the connection halfway) never leaves a partial testbed behind.
+    The file is only readable by its owner (mkstemp's default), since it holds device credentials.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix=os.path.basename(path),
+        suffix=".tmp",
+    )
+    try:
+        with os.fdopen(fd, "w") as outfile:
+            tb_template.stream(**table_data, device_data=device_list).dump(outfile)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 @click.command()
@@ -23,68 +176,88 @@ import yaml
     show_default=True,
     help="Specify an output format",
 )
+@click.option(
+    "--shard-by",
+    type=click.Choice(["site", "family", "controller"], case_sensitive=False),
+    default=None,
+    help="Split the testbed into one file per top-level site, device family or controller (ex. testbed_routers.yaml), so pyATS jobs can run in parallel.",
+)
 @click.pass_context
-def pyats_testbed(ctx, output):
-    """Generate pyATS testbed of all devices in DNAC inventory and assign global credentails pulled from DNAC."""
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "X-Auth-Token": ctx.obj.token,
-    }
-    # Get available CLI device credentials stored in DNAC
-    dnac_device_creds = f"{ctx.obj.dnac_url}/dna/intent/api/v1/device-credential"
-    response = requests.get(url=dnac_device_creds, headers=headers, verify=False)
-    if response.status_code == 200:
-        cli_creds = response.json()["cli"]
-        users = []
-        for cred in cli_creds:
-            users.append(cred["username"])
-        if os.environ.get("DNAC_CLI_USER"):
-            selected_user = os.environ.get("DNAC_CLI_USER")
-        else:
-            selected_user = click.prompt(
-                f"Which username would you like to use {users}"
-            )
-        if os.environ.get("DNAC_CLI_PASS"):
-            selected_pass = os.environ.get("DNAC_CLI_PASS")
-        else:
-            selected_pass = click.prompt(
-                f"What's the CLI password for {selected_user}?"
-            )
-        if click.confirm("Is enable password the same as previous password?"):
-            enable_pass = selected_pass
-        else:
-            enable_pass = click.prompt(
-                f"What's the enable password for {selected_user}?"
-            )
-    elif response.status_code == 401:
-        click.echo("Unauthorized. Please verify your token is valid.")
+def pyats_testbed(ctx, output, shard_by):
+    """
+    Generate pyATS testbed of all devices in DNAC inventory and assign global credentails pulled from DNAC.
+
+    With --controllers, one testbed is generated with the devices of every controller.
+    """
+    if shard_by == "controller" and not controller_clients(ctx):
+        raise click.UsageError("--shard-by controller requires --controllers.")
+    # Get available CLI device credentials stored in DNAC (on every controller)
+    cli_users = per_controller(ctx, get_cli_users, strict=True)
+    users = list(dict.fromkeys(user for users in cli_users.values() for user in users))
+    if os.environ.get("DNAC_CLI_USER"):
+        selected_user = os.environ.get("DNAC_CLI_USER")
+    else:
+        selected_user = click.prompt(f"Which username would you like to use {users}")
+    if os.environ.get("DNAC_CLI_PASS"):
+        selected_pass = os.environ.get("DNAC_CLI_PASS")
     else:
-        click.echo("Could not retrieve device credentials from DNAC.")
+        selected_pass = click.prompt(f"What's the CLI password for {selected_user}?")
+    if click.confirm("Is enable password the same as previous password?"):
+        enable_pass = selected_pass
+    else:
+        enable_pass = click.prompt(f"What's the enable password for {selected_user}?")
 
-    device_list = ctx.invoke(devices, output="none")
-    device_list = json.loads(device_list)
+    # Devices are streamed from DNAC (or the cache) rather than collected into a list. With --controllers,
+    # a testbed missing a cluster's devices isn't generated, so any failed controller stops the command.
+    device_list = map(
+        Device.from_json,
+        with_controller(iter_controllers(ctx, iter_devices, strict=True)),
+    )
 
     if (selected_user, selected_pass, enable_pass):
         table_data = {
             "user": selected_user,
             "pass": selected_pass,
             "enable_pass": enable_pass,
-            "device_data": device_list,
         }
     else:
         raise click.ClickException("Device credentials not found.")
 
     if output == "yaml":
+        # Each generator only imports the library it renders with
+        from jinja2 import Environment, FileSystemLoader
+
         current_dir = os.path.dirname(os.path.realpath(__file__))
         env = Environment(loader=FileSystemLoader(f"{current_dir}/j2_templates"))
         tb_template = env.get_template("pyats_testbed.j2")
-        generated_tb = tb_template.render(**table_data)
-        with open("testbed.yaml", "w") as outfile:
-            outfile.write(generated_tb)
+        if not shard_by:
+            render_testbed(tb_template, table_data, device_list, "testbed.yaml")
             print(
                 f"[bold bright_yellow]pyATS testbed file saved at {os.path.dirname(os.getcwd())}/testbed.yaml[/bold bright_yellow]"
             )
+            return
+        if shard_by == "site":
+            # Format: {controller name: shard key function} (the name is None without --controllers)
+            site_keys = per_controller(ctx, site_shard_keys, strict=True)
+            shard_key = lambda device: site_keys[device.controller](device)
+        elif shard_by == "controller":
+            shard_key = lambda device: device.controller
+        else:
+            shard_key = lambda device: device.family
+        with tempfile.TemporaryDirectory() as spool_dir:
+            spools = spool_shards(device_list, shard_key, spool_dir)
+            for shard, spool in sorted(spools.items()):
+                # Devices are read from local spool files, so this only measures rendering
+                with profile_phase("render"):
+                    render_testbed(
+                        tb_template,
+                        table_data,
+                        read_spool(spool),
+                        f"testbed_{shard}.yaml",
+                    )
+                print(
+                    f"[bold bright_yellow]pyATS testbed file saved at {os.path.dirname(os.getcwd())}/testbed_{shard}.yaml[/bold bright_yellow]"
+                )
 
 
 @click.command()
@@ -95,89 +268,52 @@ def pyats_testbed(ctx, output):
     show_default=True,
     help="Specify an output format",
 )
-def ansible_inventory(output):
+@click.option(
+    "--max-depth",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Limit how many site levels are nested in the inventory. Devices in deeper sites are rolled up to their ancestor site at this depth.",
+)
+@click.pass_context
+def ansible_inventory(ctx, output, max_depth):
     """
     Generate Ansible inventory of all devices in DNAC inventory.
 
-    Note: Currently limited to a nested depth of 2. If site hierarchy is deeper than 2 sites/buildings, then nested devices (nested depth > 2) will be rolled up to a higher-level site. For example, if a site hierarchy looks like this: Site1 -> Building1 -> Floor1, then any device assigned to Floor1 will be grouped under Building1. Floor1 will not be included in the inventory file. This is to reduce nested complexity in the resulting Ansible inventory file.
+    Every site in the DNAC site hierarchy becomes an Ansible group, nested under its parent site. For example, if a site hierarchy looks like this: Site1 -> Building1 -> Floor1, then any device assigned to Floor1 will be grouped under Floor1, which is a child group of Building1. Use --max-depth to limit nesting. For example, with '--max-depth 2', devices assigned to Floor1 will be grouped under Building1 instead. Since Ansible group names must be unique, a site whose name is already used by another group is prefixed with its parent's group name (ex. building1_floor1), then numbered if that name is taken too (ex. building1_floor1_2).
+
+    With --controllers, one inventory is generated with a top-level group per controller (ex. emea), holding that controller's site groups.
     """
-    site_topo = get_site_hierarchy()
-    devices = get_assigned_devices()
+    # Site hierarchy and device assignments are independent, so pull both at the same time
+    # (for every controller at once with --controllers)
+    topologies = per_controller(
+        ctx,
+        lambda client: fetch_topology(client, get_site_hierarchy, get_assigned_devices),
+        strict=True,
+    )
     inventory = {"all": {"children": {}, "hosts": {}}}
-    # Create site hierarchy, then add devices
-    # Create top-level sites in hierarchy
-    for key, dets in site_topo.items():
-        if dets["groupNameHierarchy"].count("/") == 1:
-            # Confirms that parentId is 'Global' and is a top-level "area" in DNAC
-            inventory["all"]["children"].update(
-                {dets["name"]: {"children": {}, "hosts": {}}}
-            )
-
-    # Add sites that are belong to a parent site
-    for key, dets in site_topo.items():
-        if dets.get("parentId") is not None:
-            par_id = dets.get("parentId")
-            par_name = get_site_name_by_id(site_topo, par_id)
-            if par_name != "all":
-                if inventory["all"]["children"].get(par_name) is not None:
-                    # Assumes parent is already in the inventory
-                    child_loc = inventory["all"]["children"].get(par_name)
-                    child_loc["children"].update({dets["name"]: {"hosts": {}}})
-                else:
-                    # Assumes parent is not in inventory
-                    par_name = get_site_name_by_id(site_topo, par_id)
-        else:
-            print(f"{dets['name']} has no parent site.")
-    # Add devices to site hierarchy
-    # Use 'groupNameHierarchy' to figure out where the device belongs. Only use first two locations under Global
-    for dev in devices.values():
-        # Don't waste time on 'unassigned' devices in DNAC
-        if dev["siteId"] != "unassigned":
-            for site_id, dets in site_topo.items():
-                if dev["siteId"] == site_id:
-                    # Get site hierarchy assigned to device from site list (ex. Global/SanJose/Building1/Floor1)
-                    site_loc = dets["groupNameHierarchy"]
-                    hier = site_loc.split("/")
-                    if len(hier) < 3:
-                        new_hier = (
-                            "/children/".join(hier[1])
-                            .lower()
-                            .replace(" ", "_")
-                            .replace("-", "_")
-                        )
-                    else:
-                        new_hier = (
-                            "/children/".join(hier[1:3])
-                            .lower()
-                            .replace(" ", "_")
-                            .replace("-", "_")
-                        )
-                    # Create list of the dict path (ex. ["all", "children", "site1"] => dict["all"]["children"]["site1"])
-                    site_list = new_hier.split("/")
-                    # Prepend 'all' and 'children', as they are top-level keys in Ansible inventory
-                    site_list.insert(0, "all")
-                    site_list.insert(1, "children")
-                    # Add hosts to end of list, as that's the key where the hostnames/IPs will be added
-                    site_list.append("hosts")
-                    # Creates a string that will have the proper syntax to find the proper "hosts" key
-                    # For ex: inventory["all"]["children"]["san_jose"]["children"]["sjc_20"]["hosts"]
-                    inv_str_eval = "inventory"
-                    for idx, site in enumerate(site_list):
-                        if site != site_list:
-                            inv_str_eval += f"['{site_list[idx]}']"
-                    # Once proper path is created, update the the "hosts" key (last key in path) with host info
-                    inv_str_eval += f".update({{'{dev['hostname']}' : {{'ansible_host': '{dev['ip']}'}}}})"
-                    # Once string literal is built, use eval() to parse and run the expression
-                    eval(inv_str_eval)
-                    # Ex. inventory["all"]["children"]["san_jose"]["children"]["sjc_20"]["hosts"].update({"leaf2.abc.inc" : {"ansible_host": "10.10.20.82"}})
-        else:
-            inventory["all"]["hosts"].update(
-                {dev["hostname"]: {"ansible_host": dev["ip"]}}
+    group_names = set()
+    for controller, (site_topo, devices) in topologies.items():
+        if controller is None:
+            add_site_groups(
+                inventory["all"], "", site_topo, devices, max_depth, group_names
             )
+            continue
+        # Every controller gets its own group, holding its site groups and its unassigned devices
+        controller_name = shard_name(controller)
+        group_names.add(controller_name)
+        group = inventory["all"]["children"][controller_name] = {"hosts": {}}
+        add_site_groups(
+            group, controller_name, site_topo, devices, max_depth, group_names
+        )
     if output == "yaml":
-        print(yaml.dump(inventory))
+        import yaml
+
+        with profile_phase("serialize"):
+            inventory_yaml = yaml.dump(inventory)
+        with profile_phase("render"):
+            print(inventory_yaml)
         with open("inventory.yaml", "w") as outfile:
-            outfile.write(yaml.dump(inventory))
+            outfile.write(inventory_yaml)
             print(
                 f"[bold bright_yellow]Ansible inventory file saved at {os.path.dirname(os.getcwd())}/inventory.yaml[/bold bright_yellow]"
             )
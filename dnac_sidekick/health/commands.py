@@ -1,31 +1,174 @@
 """ Commands to gather health information for network devices and clients in DNAC """
 
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple, Union
 import click
+import requests
 from rich.table import Table
 from rich.console import Console
-import requests
+from dnac_sidekick.health.history import (
+    REPORTS,
+    HealthHistory,
+    default_history_path,
+    parse_duration,
+)
+from dnac_sidekick.cli import CLIENT_OPTIONS_KEY
+from dnac_sidekick.helpers.client import DnacClient, url_from_env
+from dnac_sidekick.helpers.controllers import (
+    CONTROLLER_COLUMN,
+    controller_cells,
+    controller_clients,
+    controller_columns,
+    iter_controllers,
+    parse_controllers,
+    per_controller,
+)
+from dnac_sidekick.helpers.decode import project
+from dnac_sidekick.helpers.output import TABLE_FORMATS, TableWriter
+from dnac_sidekick.helpers.profiling import profile_phase
+from dnac_sidekick.helpers.records import Site
+from dnac_sidekick.helpers.topology import get_site_hierarchy
+from dnac_sidekick.inventory.commands import DEFAULT_WORKERS, get_device_count
+
+DEVICE_HEALTH_PATH = "/dna/intent/api/v1/device-health"
+CLIENT_HEALTH_PATH = "/dna/intent/api/v1/client-health"
+# Max limit for device health is 500 devices per call
+HEALTH_PAGE_SIZE = 500
+# Health bands and device roles that DNAC can filter device health by
+HEALTH_BANDS = ("POOR", "FAIR", "GOOD")
+DEVICE_ROLES = ("CORE", "DISTRIBUTION", "ACCESS", "ROUTER", "WLC", "AP")
+# Columns of the device health output
+DEVICE_HEALTH_COLUMNS = [
+    ("Hostname", {"justify": "left", "style": "purple"}),
+    ("Overall Health", {"justify": "left", "style": "cyan"}),
+    ("CPU Util (%)", {"justify": "center", "style": "green"}),
+    ("Memory Util (%)", {"justify": "right", "style": "red"}),
+]
+CLIENT_HEALTH_COLUMNS = [
+    ("Client Type", {"justify": "left", "style": "purple"}),
+    ("Client Count", {"justify": "center", "style": "cyan"}),
+    ("Client Health Score", {"justify": "right", "style": "green"}),
+]
+# Number of per-site client health queries sent to DNAC at the same time
+DEFAULT_SITE_WORKERS = 8
+# Default seconds between snapshots with 'health watch'
+DEFAULT_WATCH_INTERVAL = 300
+# Device health fields shown in the table. The rest are dropped after decoding.
+DEVICE_HEALTH_FIELDS = (
+    "name",
+    "overallHealth",
+    "cpuUlitilization",
+    "memoryUtilization",
+)
+
+
+def get_device_health_page(
+    client: DnacClient, offset: int, filters: dict = None, fields: tuple = None
+) -> Tuple[List[dict], Union[int, None]]:
+    """
+    Retrieve a single page of device health, starting at the given offset.
+    Returns the page (with only the given fields, if any) and DNAC's total count of matching devices (None if not reported).
+    """
+    response = client.get(
+        DEVICE_HEALTH_PATH,
+        params={**(filters or {}), "limit": HEALTH_PAGE_SIZE, "offset": offset},
+    )
+    if response.status_code == 200:
+        body = response.json()
+        page = body["response"]
+        return (project(page, fields) if fields else page), body.get("totalCount")
+    elif response.status_code == 401:
+        raise click.ClickException("Unauthorized. Please verify your token is valid.")
+    else:
+        raise click.ClickException(
+            f"Could not retrieve device health from DNAC. HTTP code: {response.status_code}. Error message: {response.text}"
+        )
+
+
+def iter_device_health(
+    client: DnacClient,
+    filters: dict = None,
+    fields: tuple = None,
+    workers: int = DEFAULT_WORKERS,
+) -> Iterator[dict]:
+    """
+    Yield the health of every device matching the filters (ex. {"health": "POOR", "deviceRole": "ACCESS"}).
+
+    DNAC returns at most 500 devices per call. The first page reports how many devices match, so the offsets of
+    the remaining pages are known up front and they're requested concurrently (up to 'workers' at a time), like
+    inventory pages. If DNAC doesn't report the total, the inventory's device count is used instead.
+    Pages are yielded in offset order.
+    """
+    page, total = get_device_health_page(client, 1, filters, fields)
+    yield from page
+    if total is None:
+        if len(page) < HEALTH_PAGE_SIZE:
+            return
+        total = get_device_count(client)
+    # DNAC offsets are 1-based (offset=1 is the first device)
+    offsets = range(HEALTH_PAGE_SIZE + 1, total + 1, HEALTH_PAGE_SIZE)
+    client.set_pool_size(workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for page, _ in executor.map(
+            lambda offset: get_device_health_page(client, offset, filters, fields),
+            offsets,
+        ):
+            yield from page
 
 
 @click.command()
+@click.option(
+    "--health",
+    type=click.Choice(HEALTH_BANDS, case_sensitive=False),
+    help="Only show devices in this health band (filtered by DNAC).",
+)
+@click.option(
+    "--site-id",
+    help="Only show devices assigned to this site (filtered by DNAC).",
+)
+@click.option(
+    "--device-role",
+    type=click.Choice(DEVICE_ROLES, case_sensitive=False),
+    help="Only show devices with this role (filtered by DNAC).",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=DEFAULT_WORKERS,
+    show_default=True,
+    help="Number of device health pages to request from DNAC concurrently. Requests are still capped by the intent API "
+    "rate limit (20/sec, burst 40 by default; see 'get --rate-limit').",
+)
+@click.option(
+    "--output",
+    type=click.Choice(TABLE_FORMATS, case_sensitive=False),
+    default="table",
+    show_default=True,
+    help="Specify an output format. plain, csv and tsv are written as devices arrive, so they suit very large networks.",
+)
 @click.pass_context
-def devices(ctx):
+def devices(ctx, health, site_id, device_role, workers, output):
     """Retrieve device health for all devices in DNAC inventory"""
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "X-Auth-Token": ctx.obj.token,
+    # Filters are sent to DNAC, so only matching devices are transferred
+    filters = {
+        param: value
+        for param, value in (
+            ("health", health),
+            ("siteId", site_id),
+            ("deviceRole", device_role),
+        )
+        if value
     }
-    dnac_device_health = f"{ctx.obj.dnac_url}/dna/intent/api/v1/device-health"
-    response = requests.get(url=dnac_device_health, headers=headers, verify=False)
-    if response.status_code == 200:
-        device_list = response.json()["response"]
-        table = Table(title="DNAC Network Health")
-        table.add_column("Hostname", justify="left", style="purple")
-        table.add_column("Overall Health", justify="left", style="cyan")
-        table.add_column("CPU Util (%)", justify="center", style="green")
-        table.add_column("Memory Util (%)", justify="right", style="red")
-
-        for device in device_list:
+    device_list = iter_controllers(
+        ctx,
+        lambda client: iter_device_health(
+            client, filters, DEVICE_HEALTH_FIELDS, workers
+        ),
+    )
+    columns = controller_columns(ctx, DEVICE_HEALTH_COLUMNS)
+    with TableWriter("DNAC Network Health", columns, output) as writer:
+        for controller, device in device_list:
             if device.get("overallHealth", -1) < 0:
                 device_overall = "N/A"
             else:
@@ -34,52 +177,399 @@ def devices(ctx):
             device_cpu_util = str(cpu_util)
             mem_util = round(device.get("memoryUtilization", 0), 1)
             device_mem_util = str(mem_util)
-            table.add_row(
-                device["name"], device_overall, device_cpu_util, device_mem_util
+            writer.add_row(
+                *controller_cells(controller),
+                device["name"],
+                device_overall,
+                device_cpu_util,
+                device_mem_util,
             )
 
-        console = Console()
-        console.print(table)
+
+def client_score_row(score: dict) -> Tuple[str, str, str]:
+    """Format a client health score (one client type) as a table row of type, count and score"""
+    client_type = score["scoreCategory"]["value"]
+    client_count = str(score["clientCount"]) if score["clientCount"] > 0 else "0"
+    client_score = str(score["scoreValue"]) if score["scoreValue"] > 0 else "0"
+    return client_type, client_count, client_score
+
+
+def get_site_client_health(
+    client: DnacClient, site_id: str, timestamp: int
+) -> Tuple[Union[List[dict], None], Union[str, None]]:
+    """
+    Retrieve client health scores for a single site at the given time (epoch milliseconds).
+
+    Returns a tuple of (score details, error message). Errors are returned rather than raised, so one
+    failed site doesn't stop the rest of the sites from being reported.
+    """
+    try:
+        response = client.get(
+            CLIENT_HEALTH_PATH, params={"siteId": site_id, "timestamp": timestamp}
+        )
+    except requests.RequestException as e:
+        return None, f"Request failed: {e}"
+    if response.status_code == 200:
+        for site in response.json()["response"]:
+            if site.get("siteId") == site_id:
+                return site.get("scoreDetail") or [], None
+        # DNAC answered, but without the site, so it's reported rather than silently left out of the table
+        return None, "DNAC didn't return client health for this site."
     elif response.status_code == 401:
-        click.echo("Unauthorized. Please verify your token is valid.")
+        return None, "Unauthorized. Please verify your token is valid."
     else:
-        click.echo("Could not retrieve list of network devices from DNAC.")
+        return (
+            None,
+            f"Status code: {response.status_code}. Error message: {response.text}",
+        )
 
 
 @click.command()
+@click.option(
+    "--by-site",
+    is_flag=True,
+    help="Report client health for every site in DNAC's site hierarchy, instead of only the global totals.",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=DEFAULT_SITE_WORKERS,
+    show_default=True,
+    help="Number of sites to query concurrently with --by-site. Requests are still capped by the intent API "
+    "rate limit (20/sec, burst 40 by default; see 'get --rate-limit').",
+)
 @click.pass_context
-def clients(ctx):
+def clients(ctx, by_site, workers):
     """Retrieve client health for all tracked clients in DNAC"""
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "X-Auth-Token": ctx.obj.token,
-    }
-    dnac_client_health = f"{ctx.obj.dnac_url}/dna/intent/api/v1/client-health"
-    response = requests.get(url=dnac_client_health, headers=headers, verify=False)
-    if response.status_code == 200:
-        device_list = response.json()["response"]
-        table = Table(title="DNAC Client Health")
-        table.add_column("Client Type", justify="left", style="purple")
-        table.add_column("Client Count", justify="center", style="cyan")
-        table.add_column("Client Health Score", justify="right", style="green")
-
-        for device in device_list:
-            if device.get("siteId") == "global":
-                for score in device.get("scoreDetail"):
-                    client_type = score["scoreCategory"]["value"]
-                    client_count = (
-                        str(score["clientCount"]) if score["clientCount"] > 0 else "0"
-                    )
-                    client_score = (
-                        str(score["scoreValue"]) if score["scoreValue"] > 0 else "0"
-                    )
-
-                    table.add_row(client_type, client_count, client_score)
-
-        console = Console()
+    if by_site:
+        return site_clients(ctx, workers)
+    device_list = iter_controllers(
+        ctx, lambda client: get_health_records(client, CLIENT_HEALTH_PATH)
+    )
+    table = Table(title="DNAC Client Health")
+    for header, options in controller_columns(ctx, CLIENT_HEALTH_COLUMNS):
+        table.add_column(header, **options)
+
+    for controller, device in device_list:
+        if device.get("siteId") == "global":
+            for score in device.get("scoreDetail"):
+                table.add_row(*controller_cells(controller), *client_score_row(score))
+
+    console = Console()
+    with profile_phase("render"):
+        console.print(table)
+
+
+def iter_site_client_health(
+    client: DnacClient, workers: int, timestamp: int
+) -> Iterator[Tuple[Site, Union[List[dict], None], Union[str, None]]]:
+    """
+    Yield (site, score details, error message) for every site in the (cached) site hierarchy, in hierarchy order.
+    Sites are queried concurrently, up to 'workers' at a time.
+    """
+    sites = sorted(get_site_hierarchy(client).values(), key=lambda site: site.hierarchy)
+    if not sites:
+        raise click.ClickException("No sites found in DNAC.")
+    client.set_pool_size(workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            lambda site: get_site_client_health(client, site.id, timestamp), sites
+        )
+        for site, (scores, error) in zip(sites, results):
+            yield site, scores, error
+
+
+def site_clients(ctx: click.Context, workers: int):
+    """
+    Print client health for every site in one table.
+
+    Sites come from the (cached) site hierarchy and are queried concurrently, up to 'workers' at a time. Every
+    site is queried for the same timestamp, so the table is a consistent snapshot. Sites are listed in hierarchy
+    order, and sites that couldn't be queried are summarized after the table.
+    """
+    timestamp = int(time.time() * 1000)
+    table = Table(title="DNAC Client Health By Site")
+    columns = [("Site", {"justify": "left", "style": "blue"})] + CLIENT_HEALTH_COLUMNS
+    for header, options in controller_columns(ctx, columns):
+        table.add_column(header, **options)
+    failed = []
+    for controller, (site, scores, error) in iter_controllers(
+        ctx, lambda client: iter_site_client_health(client, workers, timestamp)
+    ):
+        if error:
+            failed.append((controller, site.hierarchy, error))
+            continue
+        for idx, score in enumerate(scores):
+            first = (*controller_cells(controller), site.hierarchy)
+            table.add_row(
+                *(first if idx == 0 else [""] * len(first)),
+                *client_score_row(score),
+                end_section=idx == len(scores) - 1,
+            )
+
+    console = Console()
+    with profile_phase("render"):
         console.print(table)
+    if failed:
+        click.echo(
+            f"Could not retrieve client health of {len(failed)} site(s) from DNAC:",
+            err=True,
+        )
+        for controller, site_name, error in failed:
+            if controller is not None:
+                site_name = f"{controller}/{site_name}"
+            click.echo(f"  {site_name}: {error}", err=True)
+
+
+def get_health_records(
+    client: DnacClient, path: str, fields: tuple = None
+) -> List[dict]:
+    """Pull health records from a DNAC health endpoint (ex. device-health), keeping only the given fields"""
+    response = client.get(path)
+    if response.status_code == 200:
+        records = response.json()["response"]
+        return project(records, fields) if fields else records
     elif response.status_code == 401:
-        click.echo("Unauthorized. Please verify your token is valid.")
+        raise click.ClickException("Unauthorized. Please verify your token is valid.")
     else:
-        click.echo("Could not retrieve list of network devices from DNAC.")
+        raise click.ClickException(
+            f"Could not retrieve health from {path}. Status code: {response.status_code}. Error message: {response.text}"
+        )
+
+
+def pull_snapshot(
+    client: DnacClient, clients: bool
+) -> Tuple[List[dict], Union[List[dict], None]]:
+    """Pull the current device health (and client health, if clients is set) from DNAC"""
+    device_health = list(
+        iter_device_health(client, fields=DEVICE_HEALTH_FIELDS + ("location",))
+    )
+    client_health = None
+    if clients:
+        client_health = get_health_records(
+            client, CLIENT_HEALTH_PATH, ("siteId", "scoreDetail")
+        )
+    return device_health, client_health
+
+
+def record_snapshot(ctx: click.Context, history: HealthHistory, clients: bool):
+    """
+    Pull the current device (and client) health from DNAC and add it to the health history.
+    With --controllers, every controller is pulled concurrently and recorded under its own DNAC URL.
+    """
+    # Format: {controller name: DnacClient} (the name is None without --controllers)
+    controllers = controller_clients(ctx) or {None: ctx.obj}
+    snapshots = per_controller(ctx, lambda client: pull_snapshot(client, clients))
+    # SQLite connections can't be shared between threads, so snapshots are stored once they're all pulled
+    for controller, (device_health, client_health) in snapshots.items():
+        dnac_url = controllers[controller].dnac_url
+        prefix = f"{controller}: " if controller is not None else ""
+        total, changed = history.record_devices(dnac_url, device_health)
+        click.echo(f"{prefix}Recorded health for {total} device(s), {changed} changed.")
+        if client_health is not None:
+            total, changed = history.record_clients(dnac_url, client_health)
+            click.echo(
+                f"{prefix}Recorded {total} client health score(s), {changed} changed."
+            )
+
+
+def history_option(f):
+    """Option for the health history database, shared by the record, watch and trends commands"""
+    return click.option(
+        "--history-db",
+        type=click.Path(dir_okay=False),
+        envvar="DNAC_HEALTH_DB",
+        default=default_history_path,
+        show_default="~/.cache/dnac-sidekick/health.db",
+        help="SQLite database that health snapshots are stored in.",
+    )(f)
+
+
+@click.command()
+@click.option(
+    "--clients/--no-clients",
+    default=True,
+    show_default=True,
+    help="Also record client health.",
+)
+@history_option
+@click.pass_context
+def record(ctx, clients, history_db):
+    """
+    Record a snapshot of device and client health in the local health history.
+
+    Only values that changed since the last snapshot are stored. Use 'health trends' to query the history.
+    """
+    history = HealthHistory(history_db)
+    try:
+        record_snapshot(ctx, history, clients)
+    finally:
+        history.close()
+
+
+@click.command()
+@click.option(
+    "--interval",
+    type=click.IntRange(min=1),
+    default=DEFAULT_WATCH_INTERVAL,
+    show_default=True,
+    help="Seconds between health snapshots.",
+)
+@click.option(
+    "--count",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Stop after this many snapshots (default is to run until interrupted with Ctrl+C).",
+)
+@click.option(
+    "--clients/--no-clients",
+    default=True,
+    show_default=True,
+    help="Also record client health.",
+)
+@history_option
+@click.pass_context
+def watch(ctx, interval, count, clients, history_db):
+    """
+    Poll DNAC and record device and client health every --interval seconds.
+
+    A failed poll is reported and retried at the next interval, rather than stopping the watch.
+    """
+    history = HealthHistory(history_db)
+    taken = 0
+    try:
+        while True:
+            started = time.monotonic()
+            try:
+                record_snapshot(ctx, history, clients)
+            except click.ClickException as e:
+                click.echo(f"Snapshot failed: {e.format_message()}", err=True)
+            taken += 1
+            if count and taken >= count:
+                break
+            time.sleep(max(interval - (time.monotonic() - started), 0))
+    except KeyboardInterrupt:
+        click.echo("Stopped watching.")
+    finally:
+        history.close()
+
+
+@click.command()
+@click.option(
+    "--report",
+    type=click.Choice(REPORTS, case_sensitive=False),
+    default="degraded",
+    show_default=True,
+    help="Devices whose health dropped, devices with the highest CPU or memory, sites with the lowest health, or client scores.",
+)
+@click.option(
+    "--since",
+    default="6h",
+    show_default=True,
+    callback=lambda ctx, param, value: parse_duration(value),
+    help="How far back to look (ex. 30m, 6h, 7d).",
+)
+@click.option(
+    "--limit",
+    type=click.IntRange(min=1),
+    default=10,
+    show_default=True,
+    help="Max number of rows to show.",
+)
+@history_option
+@click.pass_context
+def trends(ctx, report, since, limit, history_db):
+    """
+    Query the local health history (from 'health record' or 'health watch'), without contacting DNAC.
+    """
+    # The history is keyed by DNAC URL, so only the controllers' URLs are needed (no client or credentials)
+    # Format: {controller name: DNAC URL} (the name is None without --controllers)
+    names = parse_controllers(ctx.meta[CLIENT_OPTIONS_KEY]["controllers"])
+    controllers = {name: url_from_env(name) for name in names} or {None: url_from_env()}
+    history = HealthHistory(history_db)
+    try:
+        if not any(
+            history.snapshot_count(dnac_url, since) for dnac_url in controllers.values()
+        ):
+            click.echo(
+                "No health snapshots were recorded in this time window. Record some with 'health record' or 'health watch'."
+            )
+        if report == "degraded":
+            title = "Devices With Degraded Health"
+            columns = [
+                ("Hostname", {"justify": "left", "style": "purple"}),
+                ("Location", {"justify": "left", "style": "cyan"}),
+                ("Health Before", {"justify": "right", "style": "green"}),
+                ("Health Now", {"justify": "right", "style": "red"}),
+            ]
+            rows = lambda dnac_url: (
+                (row["device"], row["location"], str(row["before"]), str(row["now"]))
+                for row in history.degraded(dnac_url, since, limit)
+            )
+        elif report in ("top-cpu", "top-memory"):
+            metric = "cpu" if report == "top-cpu" else "memory"
+            label = "CPU" if metric == "cpu" else "Memory"
+            title = f"Top {label} Utilization"
+            columns = [
+                ("Hostname", {"justify": "left", "style": "purple"}),
+                ("Location", {"justify": "left", "style": "cyan"}),
+                (f"Peak {label} (%)", {"justify": "right", "style": "red"}),
+                (f"{label} Now (%)", {"justify": "right", "style": "green"}),
+            ]
+            rows = lambda dnac_url: (
+                (
+                    row["device"],
+                    row["location"],
+                    str(row["peak"]),
+                    "N/A" if row["now"] is None else str(row["now"]),
+                )
+                for row in history.top(dnac_url, metric, since, limit)
+            )
+        elif report == "worst-sites":
+            title = "Sites With The Lowest Device Health"
+            columns = [
+                ("Location", {"justify": "left", "style": "purple"}),
+                ("Devices", {"justify": "right", "style": "cyan"}),
+                ("Average Health", {"justify": "right", "style": "green"}),
+                ("Lowest Health", {"justify": "right", "style": "red"}),
+            ]
+            rows = lambda dnac_url: (
+                (
+                    row["location"],
+                    str(row["devices"]),
+                    f"{row['average']:.1f}",
+                    str(row["worst"]),
+                )
+                for row in history.worst_sites(dnac_url, since, limit)
+            )
+        else:
+            title = "Client Health"
+            columns = [
+                ("Site", {"justify": "left", "style": "purple"}),
+                ("Client Type", {"justify": "left", "style": "cyan"}),
+                ("Client Count", {"justify": "right", "style": "green"}),
+                ("Score Now", {"justify": "right", "style": "green"}),
+                ("Lowest Score", {"justify": "right", "style": "red"}),
+            ]
+            rows = lambda dnac_url: (
+                (
+                    row["site"],
+                    row["category"],
+                    str(row["client_count"]),
+                    str(row["now"]),
+                    str(row["lowest"]),
+                )
+                for row in history.client_scores(dnac_url, since)[:limit]
+            )
+        table = Table(title=title)
+        for header, options in ([CONTROLLER_COLUMN] if names else []) + columns:
+            table.add_column(header, **options)
+        # Every controller gets its own top rows (--limit applies per controller)
+        for controller, dnac_url in controllers.items():
+            for row in rows(dnac_url):
+                table.add_row(*controller_cells(controller), *row)
+    finally:
+        history.close()
+    console = Console()
+    with profile_phase("render"):
+        console.print(table)
@@ -0,0 +1,315 @@
+""" Local history of device and client health snapshots, stored in SQLite so trends can be queried without DNAC """
+
+import os
+import re
+import sqlite3
+import time
+from typing import Iterable, List, Tuple
+import click
+from dnac_sidekick.helpers.cache import default_cache_dir
+
+# Health values are only stored when they change, so each row holds a device's health from the time it was
+# recorded until the next row for that device. A device that's missing from a snapshot (ex. removed from DNAC)
+# gets a row without any values, so it stops counting toward current health. Every poll is logged in
+# 'snapshots', so the history still shows when DNAC was polled even if nothing changed.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    controller TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    recorded_at INTEGER NOT NULL,
+    records INTEGER NOT NULL,
+    changed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS device_health (
+    controller TEXT NOT NULL,
+    device TEXT NOT NULL,
+    location TEXT,
+    recorded_at INTEGER NOT NULL,
+    overall_health INTEGER,
+    cpu REAL,
+    memory REAL
+);
+CREATE INDEX IF NOT EXISTS device_health_idx ON device_health (controller, device, recorded_at);
+CREATE TABLE IF NOT EXISTS client_health (
+    controller TEXT NOT NULL,
+    site TEXT NOT NULL,
+    category TEXT NOT NULL,
+    recorded_at INTEGER NOT NULL,
+    client_count INTEGER,
+    score INTEGER
+);
+CREATE INDEX IF NOT EXISTS client_health_idx ON client_health (controller, site, category, recorded_at);
+"""
+# Format: {unit: seconds}
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+REPORTS = ("degraded", "top-cpu", "top-memory", "worst-sites", "clients")
+# Values stored for a device that's no longer in DNAC
+# Format: (location, overall_health, cpu, memory)
+REMOVED = (None, None, None, None)
+
+
+def default_history_path() -> str:
+    return os.path.join(default_cache_dir(), "health.db")
+
+
+def parse_duration(value: str) -> int:
+    """
+    Convert a duration like '90s', '30m', '6h' or '7d' to seconds. Plain numbers are seconds.
+
+    Example usage:
+    >>> parse_duration("6h")
+    21600
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*([smhd]?)\s*", str(value).lower())
+    if not match:
+        raise click.BadParameter(
+            f"'{value}' is not a valid duration. Use a number followed by s, m, h or d (ex. 6h)."
+        )
+    return int(match.group(1)) * DURATION_UNITS[match.group(2) or "s"]
+
+
+def health_values(device: dict) -> Tuple:
+    """
+    Pull the values stored for a device-health record.
+
+    CPU and memory are rounded to one decimal (as shown by 'get health devices'), so small fluctuations
+    don't count as a change. Negative health scores (no data) are stored as NULL.
+    """
+    overall = device.get("overallHealth")
+    cpu = device.get("cpuUlitilization")
+    memory = device.get("memoryUtilization")
+    return (
+        device.get("location"),
+        overall if overall is not None and overall >= 0 else None,
+        round(cpu, 1) if cpu is not None else None,
+        round(memory, 1) if memory is not None else None,
+    )
+
+
+class HealthHistory(object):
+    """
+    SQLite store of health snapshots, shared by every controller (rows are keyed by the DNAC URL).
+
+    Example usage:
+    >>> history = HealthHistory()
+    >>> history.record_devices("https://sandboxdnac.cisco.com", device_health)
+    (500, 12)
+    >>> history.degraded("https://sandboxdnac.cisco.com", since=6 * 3600)
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or default_history_path()
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _log_snapshot(
+        self, controller: str, kind: str, recorded_at: int, records: int, changed: int
+    ):
+        self.conn.execute(
+            "INSERT INTO snapshots VALUES (?, ?, ?, ?, ?)",
+            (controller, kind, recorded_at, records, changed),
+        )
+
+    def record_devices(
+        self, controller: str, devices: Iterable[dict], recorded_at: int = None
+    ) -> Tuple[int, int]:
+        """Store a device-health snapshot. Returns the number of devices in the snapshot and how many changed."""
+        recorded_at = int(recorded_at or time.time())
+        # Latest stored values for each device
+        # Format: {hostname: (location, overall_health, cpu, memory)}
+        latest = {
+            row["device"]: tuple(row)[1:5]
+            for row in self.conn.execute(
+                "SELECT device, location, overall_health, cpu, memory, MAX(recorded_at) "
+                "FROM device_health WHERE controller = ? GROUP BY device",
+                (controller,),
+            )
+        }
+        rows = []
+        total = 0
+        seen = set()
+        for device in devices:
+            total += 1
+            seen.add(device["name"])
+            values = health_values(device)
+            if latest.get(device["name"]) != values:
+                rows.append(
+                    (controller, device["name"], values[0], recorded_at) + values[1:]
+                )
+        for name, values in latest.items():
+            if name not in seen and values != REMOVED:
+                rows.append((controller, name, None, recorded_at) + REMOVED[1:])
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO device_health VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._log_snapshot(controller, "devices", recorded_at, total, len(rows))
+        return total, len(rows)
+
+    def record_clients(
+        self, controller: str, sites: Iterable[dict], recorded_at: int = None
+    ) -> Tuple[int, int]:
+        """Store a client-health snapshot (client count and score per site and client type)"""
+        recorded_at = int(recorded_at or time.time())
+        # Format: {(site, category): (client_count, score)}
+        latest = {
+            (row["site"], row["category"]): (row["client_count"], row["score"])
+            for row in self.conn.execute(
+                "SELECT site, category, client_count, score, MAX(recorded_at) "
+                "FROM client_health WHERE controller = ? GROUP BY site, category",
+                (controller,),
+            )
+        }
+        rows = []
+        total = 0
+        for site in sites:
+            for score in site.get("scoreDetail") or []:
+                total += 1
+                key = (site.get("siteId"), score["scoreCategory"]["value"])
+                values = (score.get("clientCount"), score.get("scoreValue"))
+                if latest.get(key) != values:
+                    rows.append((controller, *key, recorded_at, *values))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO client_health VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            self._log_snapshot(controller, "clients", recorded_at, total, len(rows))
+        return total, len(rows)
+
+    def snapshot_count(self, controller: str, since: int) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM snapshots WHERE controller = ? AND recorded_at >= ?",
+            (controller, int(time.time()) - since),
+        ).fetchone()[0]
+
+    def degraded(
+        self, controller: str, since: int, limit: int = None
+    ) -> List[sqlite3.Row]:
+        """
+        Devices whose overall health is lower now than at the start of the window (or when they were first recorded,
+        if that was later). Worst drops first.
+        """
+        return self.conn.execute(
+            """
+            WITH latest AS (
+                SELECT device, location, overall_health, MAX(recorded_at) AS recorded_at
+                FROM device_health WHERE controller = :controller GROUP BY device
+            ), baseline AS (
+                SELECT device, overall_health, MAX(recorded_at)
+                FROM device_health WHERE controller = :controller AND recorded_at <= :start GROUP BY device
+            ), earliest AS (
+                SELECT device, overall_health, MIN(recorded_at)
+                FROM device_health WHERE controller = :controller GROUP BY device
+            )
+            SELECT latest.device, latest.location, latest.recorded_at,
+                COALESCE(baseline.overall_health, earliest.overall_health) AS before,
+                latest.overall_health AS now
+            FROM latest JOIN earliest USING (device) LEFT JOIN baseline USING (device)
+            WHERE latest.overall_health < COALESCE(baseline.overall_health, earliest.overall_health)
+            ORDER BY now - before, latest.device
+            LIMIT :limit
+            """,
+            {
+                "controller": controller,
+                "start": int(time.time()) - since,
+                "limit": limit or -1,
+            },
+        ).fetchall()
+
+    def top(
+        self, controller: str, metric: str, since: int, limit: int = None
+    ) -> List[sqlite3.Row]:
+        """Devices with the highest peak CPU or memory utilization ('cpu' or 'memory') during the window"""
+        if metric not in ("cpu", "memory"):
+            raise ValueError(f"Unknown health metric '{metric}'")
+        return self.conn.execute(
+            f"""
+            WITH latest AS (
+                SELECT device, {metric}, MAX(recorded_at)
+                FROM device_health WHERE controller = :controller GROUP BY device
+            )
+            SELECT d.device, d.location, MAX(d.{metric}) AS peak, latest.{metric} AS now
+            FROM device_health d JOIN latest USING (device)
+            WHERE d.controller = :controller AND d.{metric} IS NOT NULL AND (
+                d.recorded_at >= :start OR d.recorded_at = (
+                    SELECT MAX(recorded_at) FROM device_health
+                    WHERE controller = d.controller AND device = d.device AND recorded_at < :start
+                )
+            )
+            GROUP BY d.device
+            ORDER BY peak DESC, d.device
+            LIMIT :limit
+            """,
+            {
+                "controller": controller,
+                "start": int(time.time()) - since,
+                "limit": limit or -1,
+            },
+        ).fetchall()
+
+    def worst_sites(
+        self, controller: str, since: int, limit: int = None
+    ) -> List[sqlite3.Row]:
+        """
+        Sites (device locations) ordered by the average current health of their devices, lowest first, with the
+        lowest health any of their devices had during the window. Devices no longer in DNAC aren't counted.
+        """
+        return self.conn.execute(
+            """
+            WITH latest AS (
+                SELECT device, location, overall_health, MAX(recorded_at)
+                FROM device_health WHERE controller = :controller GROUP BY device
+            ), windowed AS (
+                SELECT d.device, MIN(d.overall_health) AS worst
+                FROM device_health d
+                WHERE d.controller = :controller AND (
+                    d.recorded_at >= :start OR d.recorded_at = (
+                        SELECT MAX(recorded_at) FROM device_health
+                        WHERE controller = d.controller AND device = d.device AND recorded_at < :start
+                    )
+                )
+                GROUP BY d.device
+            )
+            SELECT COALESCE(latest.location, 'unassigned') AS location, COUNT(*) AS devices,
+                AVG(latest.overall_health) AS average, MIN(windowed.worst) AS worst
+            FROM latest JOIN windowed USING (device)
+            WHERE latest.overall_health IS NOT NULL
+            GROUP BY latest.location
+            ORDER BY average, location
+            LIMIT :limit
+            """,
+            {
+                "controller": controller,
+                "start": int(time.time()) - since,
+                "limit": limit or -1,
+            },
+        ).fetchall()
+
+    def client_scores(self, controller: str, since: int) -> List[sqlite3.Row]:
+        """Current client count and score for each site and client type, with the lowest score during the window"""
+        return self.conn.execute(
+            """
+            WITH latest AS (
+                SELECT site, category, client_count, score, MAX(recorded_at)
+                FROM client_health WHERE controller = :controller GROUP BY site, category
+            )
+            SELECT c.site, c.category, latest.client_count, latest.score AS now, MIN(c.score) AS lowest
+            FROM client_health c JOIN latest USING (site, category)
+            WHERE c.controller = :controller AND (
+                c.recorded_at >= :start OR c.recorded_at = (
+                    SELECT MAX(recorded_at) FROM client_health
+                    WHERE controller = c.controller AND site = c.site AND category = c.category
+                        AND recorded_at < :start
+                )
+            )
+            GROUP BY c.site, c.category
+            ORDER BY c.site, c.category
+            """,
+            {"controller": controller, "start": int(time.time()) - since},
+        ).fetchall()
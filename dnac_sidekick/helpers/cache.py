@@ -0,0 +1,207 @@
+"""Module for caching DNA Center API responses on disk between CLI runs"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Iterable, Iterator, Union
+import click
+from dnac_sidekick.helpers import decode
+
+# Seconds a cached response is considered fresh
+DEFAULT_TTL = 300
+# Seconds an incrementally synced snapshot is used before it's replaced by a full pull. Syncs only re-fetch
+# devices whose fingerprint changed, so other fields (ex. reachabilityStatus, upTime) are only refreshed
+# by full pulls.
+DEFAULT_MAX_SYNC_AGE = 86400
+
+
+def default_cache_dir() -> str:
+    """Cache location, following the XDG base directory spec (ex. ~/.cache/dnac-sidekick)"""
+    if os.environ.get("DNAC_CACHE_DIR"):
+        return os.environ.get("DNAC_CACHE_DIR")
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "dnac-sidekick")
+
+
+class ResponseCache(object):
+    """
+    Stores lists of records returned by DNAC (devices, sites, topology nodes) as NDJSON files.
+
+    Each file is keyed by the DNAC URL and the endpoint it came from, so several controllers can share
+    the same cache directory. Records are written and read one line at a time, so caching a large
+    inventory doesn't require holding it in memory.
+    """
+
+    def __init__(
+        self,
+        dnac_url: str,
+        directory: str = None,
+        ttl: int = DEFAULT_TTL,
+        refresh: bool = False,
+        offline: bool = False,
+        incremental: bool = False,
+        max_sync_age: int = DEFAULT_MAX_SYNC_AGE,
+    ):
+        self.dnac_url = dnac_url
+        self.directory = directory or default_cache_dir()
+        self.ttl = ttl
+        self.refresh = refresh
+        self.offline = offline
+        self.incremental = incremental
+        self.max_sync_age = max_sync_age
+        self.hits = 0
+        self.misses = 0
+        self.syncs = 0
+        # Cached endpoints can be read from several worker threads at once
+        self.lock = threading.Lock()
+
+    def _count(self, counter: str):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def path(self, endpoint: str) -> str:
+        key = hashlib.sha256(f"{self.dnac_url}|{endpoint}".encode()).hexdigest()
+        return os.path.join(self.directory, f"{key}.ndjson")
+
+    def pulled_path(self, endpoint: str) -> str:
+        """Marker file whose mtime is the last time every record of the endpoint was pulled (not synced)"""
+        return f"{os.path.splitext(self.path(endpoint))[0]}.pulled"
+
+    def age(self, endpoint: str) -> float:
+        """Seconds since the endpoint was cached (None if it isn't cached)"""
+        try:
+            return time.time() - os.path.getmtime(self.path(endpoint))
+        except OSError:
+            return None
+
+    def pull_age(self, endpoint: str) -> float:
+        """Seconds since the endpoint was last pulled in full (None if that isn't known)"""
+        try:
+            return time.time() - os.path.getmtime(self.pulled_path(endpoint))
+        except OSError:
+            return None
+
+    def can_sync(self, endpoint: str) -> bool:
+        """Whether a stale cached copy can be synced instead of pulled again (see max_sync_age)"""
+        pull_age = self.pull_age(endpoint)
+        return (
+            self.age(endpoint) is not None
+            and pull_age is not None
+            and pull_age < self.max_sync_age
+        )
+
+    def is_fresh(self, endpoint: str) -> bool:
+        age = self.age(endpoint)
+        return age is not None and age < self.ttl
+
+    def use_cached(self, endpoint: str) -> bool:
+        """
+        Whether the cached copy of an endpoint can be used without asking DNAC: always in offline mode,
+        otherwise while it's fresh and not refreshed. A copy that was synced since its last full pull
+        stops being used once that pull is older than max_sync_age, even if the sync itself is fresh.
+        """
+        if self.offline:
+            if self.age(endpoint) is None:
+                raise click.ClickException(
+                    f"No cached data for {endpoint}. Run the command without --offline first."
+                )
+            return True
+        if self.refresh or not self.is_fresh(endpoint):
+            return False
+        # A full pull writes the marker after the records, so records newer than the marker were synced
+        try:
+            synced = os.path.getmtime(self.path(endpoint)) > os.path.getmtime(
+                self.pulled_path(endpoint)
+            )
+        except OSError:
+            synced = False
+        return not synced or self.pull_age(endpoint) < self.max_sync_age
+
+    def read(self, endpoint: str) -> Iterator[dict]:
+        with open(self.path(endpoint)) as infile:
+            for line in infile:
+                yield decode.loads(line)
+
+    def write(
+        self, endpoint: str, records: Iterable[dict], pulled: bool = False
+    ) -> Iterator[dict]:
+        """
+        Yield records while writing them to the cache.
+
+        Records go to a temporary file that only replaces the cached copy once every record has been
+        consumed, so an error (or a caller that stops early) never leaves a partial cache behind.
+        Every write gets its own temporary file, so threads writing the same endpoint don't collide.
+        Set 'pulled' when the records are a full pull from DNAC, to restart the snapshot's max_sync_age.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(endpoint)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.directory, prefix=os.path.basename(path), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as outfile:
+                for record in records:
+                    outfile.write(f"{decode.dumps(record)}\n")
+                    yield record
+            os.replace(tmp_path, path)
+            if pulled:
+                with open(self.pulled_path(endpoint), "w"):
+                    pass
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def cached(self, endpoint: str) -> Union[Iterator[dict], None]:
+        """Yield cached records if they can be used without asking DNAC (see use_cached), otherwise None"""
+        if self.use_cached(endpoint):
+            self._count("hits")
+            return self.read(endpoint)
+        return None
+
+    def records(
+        self,
+        endpoint: str,
+        fetch: Callable[[], Iterable[dict]],
+        sync: Callable[[Iterable[dict]], Union[Iterable[dict], None]] = None,
+    ) -> Iterator[dict]:
+        """
+        Yield cached records for an endpoint, calling 'fetch' to pull them from DNAC when needed.
+
+        In incremental mode, a stale copy is handed to 'sync' (if given) to be brought up to date instead
+        of pulling every record again. 'sync' can return None to fall back to a full fetch. Once the last
+        full fetch is older than max_sync_age, a full fetch is done instead of a sync.
+        """
+        cached = self.cached(endpoint)
+        if cached is not None:
+            return cached
+        if self.incremental and sync is not None and self.can_sync(endpoint):
+            synced = sync(self.read(endpoint))
+            if synced is not None:
+                self._count("syncs")
+                return self.write(endpoint, synced)
+        self._count("misses")
+        return self.write(endpoint, fetch(), pulled=sync is not None)
+
+    def report(self, controller: str = None):
+        """Print cache hit/miss counts (to stderr, so piped output isn't affected)"""
+        label = f"Cache ({controller})" if controller else "Cache"
+        if self.hits or self.misses or self.syncs:
+            click.echo(
+                f"{label}: {self.hits} hit(s), {self.misses} miss(es), {self.syncs} incremental sync(s) ({self.directory})",
+                err=True,
+            )
+
+
+def cached_records(
+    client,
+    endpoint: str,
+    fetch: Callable[[], Iterable[dict]],
+    sync: Callable[[Iterable[dict]], Union[Iterable[dict], None]] = None,
+) -> Iterator[dict]:
+    """Use the client's cache (if one is configured) for the records returned by 'fetch'"""
+    if client.cache is None:
+        return iter(fetch())
+    return client.cache.records(endpoint, fetch, sync)
@@ -0,0 +1,249 @@
+"""Module for the DNA Center API client shared by every command"""
+import os
+import re
+import threading
+from typing import Tuple
+import click
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from dnac_sidekick.helpers import decode
+from dnac_sidekick.helpers.profiling import current_profiler
+from dnac_sidekick.helpers.ratelimit import RequestScheduler, parse_rate_limits
+from dnac_sidekick.helpers.tokens import TokenCache
+
+# DNAC often uses a self-signed certificate, so don't warn on every unverified HTTPS request
+requests.packages.urllib3.disable_warnings()
+
+# Number of keep-alive connections kept open to DNAC. Every command talks to a single host,
+# so this is effectively the number of requests that can be in flight without opening new sockets.
+DEFAULT_POOL_SIZE = 10
+# Seconds to wait for DNAC to accept the connection and to send back a response
+DEFAULT_TIMEOUT = 30
+AUTH_PATH = "/dna/system/api/v1/auth/token"
+
+
+class DnacClient(object):
+    """
+    Holds the DNAC connection details and a keep-alive HTTP session.
+
+    One client is created per CLI run and stored on the Click context, so every API call made by the
+    commands reuses the same pooled connections, headers and timeout instead of paying a new TCP/TLS
+    handshake per request.
+
+    If a username and password are set, the client logs in when it doesn't have a token and logs in
+    again (then replays the request) when DNAC rejects an expired token. New tokens are saved to the
+    token cache, if one is set, so later runs can reuse them.
+    """
+
+    def __init__(
+        self,
+        dnac_url=None,
+        username=None,
+        password=None,
+        token=None,
+        timeout=DEFAULT_TIMEOUT,
+        pool_size=DEFAULT_POOL_SIZE,
+        rate_limits=None,
+        profiler=None,
+        token_cache=None,
+    ):
+        # Strip trailing slash so paths can always be appended as "/dna/..."
+        self.dnac_url = dnac_url.rstrip("/") if dnac_url else dnac_url
+        self.dnac_user = username
+        self.dnac_pass = password
+        self.token = token
+        self.timeout = timeout
+        self.pool_size = pool_size
+        # Optional ResponseCache, set by the CLI groups that support caching
+        self.cache = None
+        # Every request goes through the scheduler, which enforces rate limits and retries throttled requests
+        self.scheduler = RequestScheduler(rate_limits)
+        # Optional Profiler, set when the CLI is run with --profile
+        self.profiler = profiler
+        # Optional TokenCache that new tokens are saved to
+        self.token_cache = token_cache
+        # Only one thread logs in when several requests are rejected at the same time
+        self.auth_lock = threading.Lock()
+
+        self.session = requests.Session()
+        self.session.verify = False
+        self.session.headers.update(
+            {
+                "Content-Type": "application/json",
+                "Accept": "application/json",
+            }
+        )
+        if token:
+            self.session.headers.update({"X-Auth-Token": token})
+        self._mount_adapter()
+
+    def set_token(self, token: str):
+        self.token = token
+        self.session.headers.update({"X-Auth-Token": token})
+
+    def _mount_adapter(self):
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def set_pool_size(self, size: int):
+        """Grow the connection pool so 'size' concurrent requests can each keep a connection open"""
+        if size > self.pool_size:
+            self.pool_size = size
+            self._mount_adapter()
+
+    def url(self, path: str) -> str:
+        """Build the full DNAC URL for an API path (ex. /dna/intent/api/v1/network-device)"""
+        return f"{self.dnac_url}{path}"
+
+    def _send(self, method: str, path: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        send = lambda: self.session.request(method, self.url(path), **kwargs)
+        if self.profiler is not None:
+            send = self.profiler.wrap(method, path, send)
+        response = self.scheduler.send(method, path, send)
+        # Decode response bodies with the configured JSON library (orjson when installed)
+        # instead of requests' own decoder, timing it separately when profiling
+        if self.profiler is not None:
+            response.json = lambda **kwargs: self.profiler.time_call(
+                "decode", decode.loads, response.content
+            )
+        else:
+            response.json = lambda **kwargs: decode.loads(response.content)
+        return response
+
+    def can_authenticate(self) -> bool:
+        return bool(self.dnac_user and self.dnac_pass)
+
+    def login(self) -> requests.Response:
+        """Request a new token from DNAC. On success, the token is used for every following request and cached."""
+        response = self._send(
+            "POST",
+            AUTH_PATH,
+            auth=HTTPBasicAuth(username=self.dnac_user, password=self.dnac_pass),
+        )
+        if response.status_code == 200:
+            self.set_token(response.json()["Token"])
+            if self.token_cache is not None:
+                self.token_cache.save(self.dnac_url, self.dnac_user, self.token)
+        return response
+
+    def authenticate(self, expired_token: str = None):
+        """
+        Log in to DNAC, unless another thread already replaced the expired token while this one was waiting.
+        Raises a ClickException if DNAC doesn't accept the username and password.
+        """
+        with self.auth_lock:
+            if self.token and self.token != expired_token:
+                return
+            response = self.login()
+        if response.status_code != 200:
+            raise click.ClickException(
+                f"Could not authenticate to DNAC. Status code: {response.status_code}. Error message: {response.text}"
+            )
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Send a request to DNAC using the shared session.
+
+        A request rejected because the token expired (HTTP 401) is sent once more after logging in again.
+        """
+        if path == AUTH_PATH:
+            return self._send(method, path, **kwargs)
+        if not self.token and self.can_authenticate():
+            self.authenticate()
+        token = self.token
+        response = self._send(method, path, **kwargs)
+        if response.status_code == 401 and self.can_authenticate():
+            self.authenticate(expired_token=token)
+            response = self._send(method, path, **kwargs)
+        return response
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def profile_env(name: str, profile: str = None) -> str:
+    """
+    Name of the environment variable holding a setting (ex. URL) for a controller profile.
+
+    Example usage:
+    >>> profile_env("URL")
+    'DNAC_URL'
+    >>> profile_env("URL", "us-east")
+    'DNAC_US_EAST_URL'
+    """
+    if not profile:
+        return f"DNAC_{name}"
+    return f"DNAC_{re.sub(r'[^A-Z0-9]+', '_', profile.upper()).strip('_')}_{name}"
+
+
+def url_from_env(profile: str = None) -> str:
+    """
+    DNAC URL of the default controller, or of a controller profile (ex. DNAC_EMEA_URL for 'emea').
+    Commands that only read local data (ex. the health history, which is keyed by DNAC URL) use this
+    instead of a client, so they don't need credentials.
+    """
+    if profile and not os.environ.get(profile_env("URL", profile)):
+        raise click.ClickException(
+            f"Controller '{profile}' has not been set up. Set {profile_env('URL', profile)} (and its credentials) as environment variables."
+        )
+    dnac_url = os.environ.get(profile_env("URL", profile))
+    if not dnac_url:
+        raise click.ClickException(
+            "DNAC URL has not been provided or has not been set as an environment variable."
+        )
+    return dnac_url.rstrip("/")
+
+
+def client_from_env(
+    profile: str = None, rate_limit: Tuple[float, float] = None
+) -> DnacClient:
+    """
+    Create a DNAC client from the environment variables set by the user.
+
+    A valid cached token (from 'dnac-sidekick login' or an earlier run) is used before DNAC_TOKEN.
+    DNAC_TOKEN can be left out, as long as DNAC_USER and DNAC_PASS are set.
+
+    With a controller profile (ex. 'emea'), settings are read from the profile's variables instead
+    (DNAC_EMEA_URL, DNAC_EMEA_USER, DNAC_EMEA_PASS, DNAC_EMEA_TOKEN and DNAC_EMEA_RATE_LIMITS).
+    The username, password and rate limits fall back to DNAC_USER, DNAC_PASS and DNAC_RATE_LIMITS,
+    since they're often shared by every cluster. The URL and token are never shared.
+
+    A rate limit (rate, burst) overrides the intent API limit from the environment (ex. from --rate-limit).
+    """
+    if profile and not os.environ.get(profile_env("URL", profile)):
+        raise click.ClickException(
+            f"Controller '{profile}' has not been set up. Set {profile_env('URL', profile)} (and its credentials) as environment variables."
+        )
+    shared = lambda name: os.environ.get(
+        profile_env(name, profile), os.environ.get(profile_env(name))
+    )
+    dnac_url = os.environ.get(profile_env("URL", profile))
+    dnac_user = shared("USER")
+    dnac_pass = shared("PASS")
+    dnac_token = os.environ.get(profile_env("TOKEN", profile))
+    if dnac_url is None or (dnac_token is None and None in (dnac_user, dnac_pass)):
+        raise click.ClickException("A necessary environment variable has not been set.")
+    rate_limits = shared("RATE_LIMITS")
+    rate_limits = parse_rate_limits(rate_limits) if rate_limits else None
+    if rate_limit:
+        rate_limits = {**(rate_limits or {}), "intent": rate_limit}
+    token_cache = TokenCache()
+    cached_token = token_cache.get(dnac_url.rstrip("/"), dnac_user)
+    return DnacClient(
+        dnac_url=dnac_url,
+        username=dnac_user,
+        password=dnac_pass,
+        token=cached_token or dnac_token,
+        rate_limits=rate_limits,
+        profiler=current_profiler(),
+        token_cache=token_cache,
+    )
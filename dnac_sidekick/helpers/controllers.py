@@ -0,0 +1,207 @@
+"""Module for running commands against several DNA Center clusters (controllers) at once"""
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple, Union
+import click
+import requests
+from dnac_sidekick.helpers.client import DnacClient
+
+# Key of the selected controllers' clients in the Click context's metadata
+CONTROLLERS_KEY = "dnac_sidekick.controllers"
+# Column added in front of table output when controllers are selected with --controllers
+CONTROLLER_COLUMN = ("Controller", {"justify": "left", "style": "yellow"})
+# Items buffered per controller by iter_controllers while an earlier controller's items are yielded
+CONTROLLER_QUEUE_SIZE = 1000
+
+
+def parse_controllers(values: Iterable[str]) -> List[str]:
+    """
+    Split --controllers values into profile names. Names can be comma-separated and/or given multiple times.
+
+    Example usage:
+    >>> parse_controllers(["emea,amer", "apac", "emea"])
+    ['emea', 'amer', 'apac']
+    """
+    names = [name.strip() for value in values for name in value.split(",")]
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def controller_clients(ctx: click.Context) -> Dict[str, DnacClient]:
+    """Clients of the controllers selected with --controllers, by profile name. Empty when only DNAC_URL is used."""
+    return ctx.meta.get(CONTROLLERS_KEY, {})
+
+
+def controller_columns(ctx: click.Context, columns: List[Tuple[str, dict]]) -> list:
+    """Table columns for a command's output, with a Controller column in front when several controllers are queried"""
+    return [CONTROLLER_COLUMN] + columns if controller_clients(ctx) else columns
+
+
+def controller_cells(name: Union[str, None]) -> tuple:
+    """Cells added in front of a row by controller_columns"""
+    return () if name is None else (name,)
+
+
+# Errors that mark a single controller as failed, instead of stopping the command
+CONTROLLER_ERRORS = (click.ClickException, requests.RequestException, OSError)
+
+
+def failure_message(e: Exception) -> str:
+    """Describe an error from CONTROLLER_ERRORS for the failure summary"""
+    if isinstance(e, click.ClickException):
+        return e.format_message()
+    if isinstance(e, requests.RequestException):
+        return f"Request failed: {e}"
+    # Ex. the controller's cache couldn't be written
+    return f"{type(e).__name__}: {e}"
+
+
+def fan_out(
+    controllers: Dict[str, DnacClient], func: Callable[[DnacClient], Any]
+) -> Tuple[Dict[str, Any], List[Tuple[str, str]]]:
+    """
+    Run func(client) for every controller at the same time, each with its own client (session, token and cache).
+
+    Returns the results by controller name (in the order the controllers were given), and a list of
+    (controller name, error message) for controllers that failed. Errors are returned rather than raised,
+    so one unreachable cluster doesn't hide the others.
+    """
+    results = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=len(controllers)) as executor:
+        futures = {
+            name: executor.submit(func, client) for name, client in controllers.items()
+        }
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except CONTROLLER_ERRORS as e:
+                failed.append((name, failure_message(e)))
+    return results, failed
+
+
+def report_failures(failed: List[Tuple[str, str]], strict: bool = False):
+    """
+    Summarize controllers that failed on stderr. Raises a ClickException instead when strict is set
+    (ex. a combined inventory file would be missing a cluster).
+    """
+    if not failed:
+        return
+    details = "\n".join(f"  {name}: {error}" for name, error in failed)
+    if strict:
+        raise click.ClickException(
+            f"Could not retrieve data from {len(failed)} controller(s):\n{details}"
+        )
+    click.echo(
+        f"Could not retrieve data from {len(failed)} controller(s):\n{details}",
+        err=True,
+    )
+
+
+def per_controller(
+    ctx: click.Context, func: Callable[[DnacClient], Any], strict: bool = False
+) -> Dict[Union[str, None], Any]:
+    """
+    Run func(client) for every controller selected with --controllers (concurrently) and return the results
+    by controller name. Controllers that fail are reported (see report_failures) and left out. If every
+    controller fails, or any controller fails with strict set, a ClickException is raised.
+
+    Without --controllers, func runs with the command's client, under the name None, and raises as usual.
+    """
+    controllers = controller_clients(ctx)
+    if not controllers:
+        return {None: func(ctx.obj)}
+    results, failed = fan_out(controllers, func)
+    report_failures(failed, strict=strict or not results)
+    return results
+
+
+def iter_controllers(
+    ctx: click.Context,
+    func: Callable[[DnacClient], Iterable],
+    strict: bool = False,
+) -> Iterator[Tuple[Union[str, None], Any]]:
+    """
+    Yield (controller name, item) for every item that func(client) returns, as items are produced.
+
+    Without --controllers, func runs with the command's client, with a controller name of None, and raises
+    as usual. With --controllers, func runs for every controller concurrently and each controller's items
+    are yielded in the order the controllers were given. Every controller's worker buffers at most
+    CONTROLLER_QUEUE_SIZE items ahead of the consumer, so memory use doesn't grow with the inventory.
+
+    A controller that fails stops yielding (items it already produced are kept), and the failures are
+    summarized once every controller is done (see report_failures). If every controller fails, or any
+    controller fails with strict set, a ClickException is raised instead.
+
+    Example usage:
+    >>> for name, device in iter_controllers(ctx, lambda client: iter_devices(client)):
+    ...     writer.add_row(*controller_cells(name), device["hostname"])
+    """
+    controllers = controller_clients(ctx)
+    if not controllers:
+        for item in func(ctx.obj):
+            yield None, item
+        return
+    # Format: {controller name: queue of (kind, value)}, where kind is "item", "failed", "error" or "done"
+    queues = {name: queue.Queue(maxsize=CONTROLLER_QUEUE_SIZE) for name in controllers}
+    # Set when the consumer stops early, so blocked workers give up instead of waiting for space
+    stop = threading.Event()
+
+    def put(name: str, entry: tuple) -> bool:
+        while not stop.is_set():
+            try:
+                queues[name].put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(name: str, client: DnacClient):
+        items = iter(())
+        try:
+            items = iter(func(client))
+            for item in items:
+                if not put(name, ("item", item)):
+                    return
+        except CONTROLLER_ERRORS as e:
+            put(name, ("failed", failure_message(e)))
+            return
+        except Exception as e:
+            put(name, ("error", e))
+            return
+        finally:
+            # Ex. lets a cache write discard its temporary file when the consumer stopped early
+            if hasattr(items, "close"):
+                items.close()
+        put(name, ("done", None))
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=len(controllers)) as executor:
+        for name, client in controllers.items():
+            executor.submit(produce, name, client)
+        try:
+            for name in controllers:
+                while True:
+                    kind, value = queues[name].get()
+                    if kind == "item":
+                        yield name, value
+                        continue
+                    if kind == "failed":
+                        failed.append((name, value))
+                    elif kind == "error":
+                        raise value
+                    break
+                if strict and failed:
+                    report_failures(failed, strict=True)
+        finally:
+            stop.set()
+    report_failures(failed, strict=strict or len(failed) == len(controllers))
+
+
+def with_controller(records: Iterable[Tuple[Union[str, None], dict]]) -> Iterator[dict]:
+    """
+    Turn (controller name, record) pairs from iter_controllers into records with a 'controller' field,
+    for output without columns (ex. JSON). Records are left as they are without --controllers.
+    """
+    for name, record in records:
+        yield record if name is None else {**record, "controller": name}
@@ -0,0 +1,63 @@
+"""Module for decoding and encoding JSON, using orjson when it's installed (pip install dnac-sidekick[fast])"""
+import json
+from typing import Iterable, List, Union
+import click
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ("json", "orjson")
+# JSON library used by loads() and dumps(). Can be picked with the DNAC_JSON_DECODER environment variable.
+backend = "orjson" if orjson else "json"
+
+
+def set_backend(name: str = None):
+    """Pick the JSON library to use ('json' or 'orjson'). Defaults to orjson when it's installed."""
+    global backend
+    if not name:
+        backend = "orjson" if orjson else "json"
+    elif name not in BACKENDS:
+        raise click.ClickException(
+            f"Unknown JSON decoder '{name}'. Valid decoders: {', '.join(BACKENDS)}"
+        )
+    elif name == "orjson" and orjson is None:
+        raise click.ClickException(
+            "The orjson decoder isn't installed. Install it with 'pip install dnac-sidekick[fast]'."
+        )
+    else:
+        backend = name
+
+
+def loads(data: Union[bytes, str]):
+    if backend == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj) -> str:
+    """Serialize to compact JSON on a single line (used for NDJSON output and the on-disk cache)"""
+    if backend == "orjson":
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+def project(records: Iterable[dict], fields: Iterable[str]) -> List[dict]:
+    """
+    Keep only the fields a command uses from each record.
+
+    DNAC records carry dozens of fields, but most commands only use a handful of them. Dropping the rest
+    right after decoding means large responses aren't kept in memory (or written to the cache) in full.
+    The whole response is still decoded first, so this saves memory and cache space, not decoding time
+    (use the orjson backend for that).
+
+    Example usage:
+    >>> project([{"name": "leaf1", "overallHealth": 10, "osVersion": "17.9.3"}], ("name", "overallHealth"))
+    [{'name': 'leaf1', 'overallHealth': 10}]
+    """
+    fields = tuple(fields)
+    return [
+        {field: record[field] for field in fields if field in record}
+        for record in records
+    ]
@@ -0,0 +1,71 @@
+"""Module for the Click group that only imports a subcommand's module when the subcommand is used"""
+import importlib
+from typing import Dict, List
+import click
+
+
+class LazyGroup(click.Group):
+    """
+    Click group whose subcommands are given as import paths instead of command objects.
+
+    A subcommand's module (and everything it imports, like rich, jinja2 or requests) is only imported
+    when that subcommand is invoked, so running one command doesn't pay for loading every other command.
+    Listing the group's commands in --help also imports them, unless their short help is given in lazy_help.
+
+    Example usage:
+    >>> @click.group(cls=LazyGroup, lazy_subcommands={"devices": "dnac_sidekick.inventory.commands.devices"})
+    ... def inventory():
+    ...     pass
+    """
+
+    def __init__(
+        self,
+        *args,
+        lazy_subcommands: Dict[str, str] = None,
+        lazy_help: Dict[str, str] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        # Format: {command name: "package.module.command_function"}
+        self.lazy_subcommands = lazy_subcommands or {}
+        # Format: {command name: "Short help shown in the group's --help"}
+        self.lazy_help = lazy_help or {}
+
+    def list_commands(self, ctx: click.Context) -> List[str]:
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_subcommands))
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> click.Command:
+        if cmd_name in self.lazy_subcommands:
+            return self._load(cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def format_commands(self, ctx: click.Context, formatter: click.HelpFormatter):
+        """Same as click.Group.format_commands, but uses lazy_help instead of importing commands where it can"""
+        commands = []
+        for cmd_name in self.list_commands(ctx):
+            if cmd_name in self.lazy_help:
+                commands.append((cmd_name, None))
+                continue
+            command = self.get_command(ctx, cmd_name)
+            if command is not None and not command.hidden:
+                commands.append((cmd_name, command))
+        if not commands:
+            return
+        limit = formatter.width - 6 - max(len(cmd_name) for cmd_name, _ in commands)
+        rows = []
+        for cmd_name, command in commands:
+            if command is None:
+                rows.append((cmd_name, self.lazy_help[cmd_name]))
+            else:
+                rows.append((cmd_name, command.get_short_help_str(limit)))
+        with formatter.section("Commands"):
+            formatter.write_dl(rows)
+
+    def _load(self, cmd_name: str) -> click.Command:
+        module_name, _, attr = self.lazy_subcommands[cmd_name].rpartition(".")
+        command = getattr(importlib.import_module(module_name), attr)
+        if not isinstance(command, click.Command):
+            raise ValueError(
+                f"Lazy subcommand '{cmd_name}' ({self.lazy_subcommands[cmd_name]}) is not a Click command"
+            )
+        return command
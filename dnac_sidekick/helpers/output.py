@@ -0,0 +1,146 @@
+"""Module for writing tabular command output as Rich tables, or streamed as plain text, CSV or TSV"""
+import csv
+import os
+from typing import List, Tuple
+import click
+from dnac_sidekick.helpers.profiling import profile_phase
+
+TABLE_FORMATS = ("table", "plain", "csv", "tsv")
+# Rich measures every row of a table before printing it, so large results are printed as consecutive
+# tables of this many rows. Can be changed with the DNAC_TABLE_PAGE_SIZE environment variable.
+DEFAULT_PAGE_SIZE = 1000
+# Rows used to work out column widths for plain text output. Wider rows after these aren't cut off.
+PLAIN_SAMPLE_ROWS = 100
+
+
+def table_page_size() -> int:
+    return int(os.environ.get("DNAC_TABLE_PAGE_SIZE", DEFAULT_PAGE_SIZE))
+
+
+def cell_text(value) -> str:
+    """Plain text of a table cell (cells can be strings, Rich Text objects or None)"""
+    if value is None:
+        return ""
+    return getattr(value, "plain", str(value))
+
+
+class EchoWriter(object):
+    """File-like wrapper around click.echo, so the csv module writes to Click's stdout"""
+
+    def write(self, text: str):
+        click.echo(text, nl=False)
+
+
+class TableWriter(object):
+    """
+    Writes rows as they're produced, in one of the TABLE_FORMATS:
+    - table: Rich tables of up to page_size rows. Each page is printed as soon as it fills up, so rendering
+      time grows linearly with the number of rows and only one page is held in memory.
+    - plain: aligned text columns. Widths come from the first rows, then every row is written as it arrives.
+    - csv/tsv: a header row, then every row as it arrives.
+
+    Columns use the same arguments as Rich's Table.add_column.
+
+    Example usage:
+    >>> with TableWriter("DNAC Network Devices", [("Hostname", {"justify": "left", "style": "purple"})], "csv") as writer:
+    ...     writer.add_row("leaf1.abc.inc")
+    """
+
+    def __init__(
+        self,
+        title: str,
+        columns: List[Tuple[str, dict]],
+        output_format: str = "table",
+        page_size: int = None,
+    ):
+        self.title = title
+        self.columns = columns
+        self.output_format = output_format
+        self.page_size = page_size or table_page_size()
+        self.rows = 0
+        self.pages = 0
+        self.buffer = []
+        self.widths = None
+        self.console = None
+        self.csv_writer = None
+        if output_format in ("csv", "tsv"):
+            self.csv_writer = csv.writer(
+                EchoWriter(),
+                delimiter="," if output_format == "csv" else "\t",
+                lineterminator="\n",
+            )
+            self.csv_writer.writerow(header for header, _ in columns)
+
+    def __enter__(self) -> "TableWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Don't print an empty table when the command fails before producing any rows
+        if exc_type is None or self.rows:
+            self.close()
+
+    def add_row(self, *values):
+        self.rows += 1
+        if self.csv_writer is not None:
+            self.csv_writer.writerow(cell_text(value) for value in values)
+        elif self.output_format == "plain":
+            if self.widths is None:
+                self.buffer.append([cell_text(value) for value in values])
+                if len(self.buffer) >= PLAIN_SAMPLE_ROWS:
+                    self._flush_plain()
+            else:
+                self._write_plain([cell_text(value) for value in values])
+        else:
+            self.buffer.append(values)
+            if len(self.buffer) >= self.page_size:
+                self._flush_table()
+
+    def close(self):
+        """Write any rows that are still buffered"""
+        if self.output_format == "plain":
+            self._flush_plain()
+        elif self.output_format == "table" and (self.buffer or not self.pages):
+            self._flush_table()
+
+    def _flush_table(self):
+        from rich.console import Console
+        from rich.table import Table
+
+        if self.console is None:
+            self.console = Console()
+        title = self.title if not self.pages else f"{self.title} (continued)"
+        table = Table(title=title)
+        for header, options in self.columns:
+            table.add_column(header, **options)
+        for values in self.buffer:
+            table.add_row(*values)
+        self.buffer = []
+        self.pages += 1
+        with profile_phase("render"):
+            self.console.print(table)
+
+    def _flush_plain(self):
+        if self.widths is not None:
+            return
+        headers = [header for header, _ in self.columns]
+        self.widths = [
+            max([len(header)] + [len(row[idx]) for row in self.buffer])
+            for idx, header in enumerate(headers)
+        ]
+        self._write_plain(headers)
+        self._write_plain(["-" * width for width in self.widths])
+        for row in self.buffer:
+            self._write_plain(row)
+        self.buffer = []
+
+    def _write_plain(self, values: List[str]):
+        cells = []
+        for value, width, (_, options) in zip(values, self.widths, self.columns):
+            justify = options.get("justify", "left")
+            if justify == "right":
+                cells.append(value.rjust(width))
+            elif justify == "center":
+                cells.append(value.center(width))
+            else:
+                cells.append(value.ljust(width))
+        click.echo("  ".join(cells).rstrip())
@@ -0,0 +1,317 @@
+"""Module for profiling DNA Center requests and local processing (enabled with 'dnac-sidekick --profile')"""
+import contextlib
+import json
+import math
+import re
+import threading
+import time
+from typing import Callable, ContextManager, List
+import click
+import requests
+
+# Key used to share the active profiler through Click's context metadata
+PROFILER_KEY = "dnac_sidekick.profiler"
+PERCENTILES = (50, 95, 99)
+# IDs in API paths (ex. device, task and file UUIDs) are grouped together, so every device's
+# license lookup is reported as one endpoint
+ID_PATTERN = re.compile(
+    r"/[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}(?=/|$)"
+)
+
+
+def endpoint_name(method: str, path: str) -> str:
+    """Name a request by its method and path, with IDs replaced (ex. GET /api/v1/task/{id})"""
+    return f"{method} {ID_PATTERN.sub('/{id}', path)}"
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class EndpointStats(object):
+    """Requests sent to a single DNAC endpoint"""
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latencies = []
+
+
+class Profiler(object):
+    """
+    Records every request sent to DNAC and the time spent on local work, like decoding JSON,
+    rendering tables and serializing output files.
+
+    Requests are recorded per attempt, so a request that was throttled and retried shows up as
+    one request and one retry. Phase times are summed across threads, so they can add up to more
+    than the command's wall time when work runs in parallel.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        # Format: {"GET /dna/intent/api/v1/network-device": EndpointStats}
+        self.endpoints = {}
+        # Format: {"render": [calls, seconds]}
+        self.phases = {}
+
+    def wrap(
+        self,
+        method: str,
+        path: str,
+        send: Callable[[], requests.Response],
+    ) -> Callable[[], requests.Response]:
+        """Wrap a function that sends a request, so each attempt is timed and recorded"""
+        name = endpoint_name(method, path)
+        attempts = [0]
+
+        def timed_send() -> requests.Response:
+            attempts[0] += 1
+            start = time.perf_counter()
+            try:
+                response = send()
+            except requests.RequestException:
+                self._record(name, attempts[0], time.perf_counter() - start)
+                raise
+            self._record(name, attempts[0], time.perf_counter() - start, response)
+            return response
+
+        return timed_send
+
+    def _record(
+        self,
+        name: str,
+        attempt: int,
+        seconds: float,
+        response: requests.Response = None,
+    ):
+        with self.lock:
+            stats = self.endpoints.setdefault(name, EndpointStats())
+            if attempt == 1:
+                stats.requests += 1
+            else:
+                stats.retries += 1
+            stats.latencies.append(seconds)
+            if response is None or response.status_code >= 400:
+                stats.errors += 1
+            if response is not None:
+                stats.bytes_received += len(response.content)
+                body = response.request.body or b""
+                stats.bytes_sent += len(body)
+
+    def add_phase(self, phase: str, seconds: float):
+        with self.lock:
+            calls = self.phases.setdefault(phase, [0, 0.0])
+            calls[0] += 1
+            calls[1] += seconds
+
+    @contextlib.contextmanager
+    def phase(self, phase: str):
+        """Time a block of local work (ex. 'render' or 'serialize')"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(phase, time.perf_counter() - start)
+
+    def time_call(self, phase: str, func: Callable, *args, **kwargs):
+        with self.phase(phase):
+            return func(*args, **kwargs)
+
+    def summary(self) -> dict:
+        """Collected stats, in the format used for JSON output"""
+        with self.lock:
+            endpoints = {
+                name: {
+                    "requests": stats.requests,
+                    "retries": stats.retries,
+                    "errors": stats.errors,
+                    "bytes_sent": stats.bytes_sent,
+                    "bytes_received": stats.bytes_received,
+                    "seconds": round(sum(stats.latencies), 6),
+                    **{
+                        f"p{pct}": round(percentile(stats.latencies, pct), 6)
+                        for pct in PERCENTILES
+                    },
+                }
+                for name, stats in sorted(self.endpoints.items())
+            }
+            phases = {
+                phase: {"calls": calls, "seconds": round(seconds, 6)}
+                for phase, (calls, seconds) in sorted(self.phases.items())
+            }
+        return {
+            "wall_seconds": round(time.perf_counter() - self.started, 6),
+            "endpoints": endpoints,
+            "phases": phases,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.summary(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """Collected stats in the Prometheus text exposition format"""
+        summary = self.summary()
+        metrics = [
+            (
+                "dnac_sidekick_requests_total",
+                "counter",
+                "Requests sent to DNAC",
+                "requests",
+            ),
+            (
+                "dnac_sidekick_request_retries_total",
+                "counter",
+                "Requests retried after being throttled or failing",
+                "retries",
+            ),
+            (
+                "dnac_sidekick_request_errors_total",
+                "counter",
+                "Request attempts that failed or returned an HTTP error",
+                "errors",
+            ),
+            (
+                "dnac_sidekick_request_bytes_total",
+                "counter",
+                "Request body bytes sent to DNAC",
+                "bytes_sent",
+            ),
+            (
+                "dnac_sidekick_response_bytes_total",
+                "counter",
+                "Response body bytes received from DNAC",
+                "bytes_received",
+            ),
+        ]
+        lines = []
+        for metric, metric_type, help_text, field in metrics:
+            lines.extend(
+                [f"# HELP {metric} {help_text}", f"# TYPE {metric} {metric_type}"]
+            )
+            for name, stats in summary["endpoints"].items():
+                lines.append(f"{metric}{{{endpoint_labels(name)}}} {stats[field]}")
+        metric = "dnac_sidekick_request_duration_seconds"
+        lines.extend(
+            [
+                f"# HELP {metric} Time taken by each request attempt",
+                f"# TYPE {metric} summary",
+            ]
+        )
+        for name, stats in summary["endpoints"].items():
+            labels = endpoint_labels(name)
+            for pct in PERCENTILES:
+                lines.append(
+                    f'{metric}{{{labels},quantile="{pct / 100}"}} {stats[f"p{pct}"]}'
+                )
+            lines.append(f"{metric}_sum{{{labels}}} {stats['seconds']}")
+            lines.append(
+                f"{metric}_count{{{labels}}} {stats['requests'] + stats['retries']}"
+            )
+        metric = "dnac_sidekick_phase_seconds_total"
+        lines.extend(
+            [
+                f"# HELP {metric} Time spent on local work (decoding, rendering, serializing)",
+                f"# TYPE {metric} counter",
+            ]
+        )
+        for phase, stats in summary["phases"].items():
+            lines.append(
+                f'{metric}{{phase="{escape_label(phase)}"}} {stats["seconds"]}'
+            )
+        metric = "dnac_sidekick_run_seconds"
+        lines.extend(
+            [
+                f"# HELP {metric} Wall time of the command",
+                f"# TYPE {metric} gauge",
+                f"{metric} {summary['wall_seconds']}",
+            ]
+        )
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        """Print the collected stats as tables (to stderr, so piped output isn't affected)"""
+        from rich.console import Console
+        from rich.table import Table
+
+        summary = self.summary()
+        console = Console(stderr=True)
+        table = Table(title="DNAC Requests")
+        # Keep the numbers on one line and fold long endpoint paths instead. The common API prefix is
+        # dropped to leave room for them (the JSON and Prometheus output keep full paths).
+        table.add_column("Endpoint", justify="left", style="purple", overflow="fold")
+        table.add_column("Requests", justify="right", style="cyan", no_wrap=True)
+        table.add_column("Retries", justify="right", style="yellow", no_wrap=True)
+        table.add_column("Errors", justify="right", style="red", no_wrap=True)
+        table.add_column(
+            f"{'/'.join(f'p{pct}' for pct in PERCENTILES)} (ms)",
+            justify="right",
+            style="green",
+            no_wrap=True,
+        )
+        table.add_column("Received (KB)", justify="right", no_wrap=True)
+        for name, stats in summary["endpoints"].items():
+            table.add_row(
+                name.replace(" /dna/intent/api/v1/", " "),
+                str(stats["requests"]),
+                str(stats["retries"]),
+                str(stats["errors"]),
+                "/".join(f"{stats[f'p{pct}'] * 1000:.1f}" for pct in PERCENTILES),
+                f"{stats['bytes_received'] / 1024:.1f}",
+            )
+        console.print(table)
+        if summary["phases"]:
+            table = Table(title="Local Processing")
+            table.add_column("Phase", justify="left", style="purple")
+            table.add_column("Calls", justify="right", style="cyan")
+            table.add_column("Seconds", justify="right", style="green")
+            for phase, stats in summary["phases"].items():
+                table.add_row(phase, str(stats["calls"]), f"{stats['seconds']:.3f}")
+            console.print(table)
+        console.print(f"Total wall time: {summary['wall_seconds']:.3f} seconds")
+
+    def dump(self, path: str, output_format: str):
+        with open(path, "w") as outfile:
+            if output_format == "prometheus":
+                outfile.write(self.to_prometheus())
+            else:
+                outfile.write(self.to_json())
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def endpoint_labels(name: str) -> str:
+    method, _, path = name.partition(" ")
+    return f'method="{escape_label(method)}",endpoint="{escape_label(path)}"'
+
+
+def current_profiler() -> "Profiler":
+    """The profiler for the running command, or None if --profile wasn't given"""
+    ctx = click.get_current_context(silent=True)
+    if ctx is None:
+        return None
+    return ctx.meta.get(PROFILER_KEY)
+
+
+def profile_phase(phase: str) -> ContextManager:
+    """
+    Time a block of local work if --profile was given, otherwise do nothing.
+
+    Example usage:
+    >>> with profile_phase("render"):
+    ...     console.print(table)
+    """
+    profiler = current_profiler()
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.phase(phase)
@@ -0,0 +1,245 @@
+"""Module for rate limiting and retrying requests sent to DNA Center"""
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Iterator, Tuple
+import click
+import requests
+
+# Requests per second (and burst size) allowed for each family of DNAC endpoints.
+# Format: {family: (rate, burst)}
+# Can be overridden with the DNAC_RATE_LIMITS environment variable (ex. "intent=50/100,task=10"). The intent
+# limit caps how much commands gain from --workers, so it can also be set with --rate-limit (or DNAC_RATE_LIMIT).
+DEFAULT_RATE_LIMITS = {
+    "intent": (20, 40),
+    "command-runner": (1, 5),
+    "task": (5, 10),
+    "file": (5, 10),
+}
+# Number of times a throttled or failed request is retried before giving up
+MAX_RETRIES = 5
+# Longest time (in seconds) to honor a Retry-After header for
+MAX_RETRY_AFTER = 120
+# Status codes that are safe to retry. 429 is retried for every method, since DNAC didn't process the request.
+# The others are only retried for GET requests.
+THROTTLED_STATUS = 429
+TRANSIENT_STATUSES = (502, 503, 504)
+
+
+def backoff_delays(
+    initial: float = 0.5, maximum: float = 10, factor: float = 2
+) -> Iterator[float]:
+    """
+    Yield exponentially growing delays with jitter.
+
+    Each delay is picked at random between half and all of the current backoff, so many waiters started at
+    the same time don't keep hitting DNAC in lockstep.
+    """
+    delay = initial
+    while True:
+        yield random.uniform(delay / 2, delay)
+        delay = min(delay * factor, maximum)
+
+
+def parse_rate_limit(value: str) -> Tuple[float, float]:
+    """Parse a single rate limit in the format "rate[/burst]" (ex. "50/100"). The burst defaults to the rate."""
+    try:
+        rate, _, burst = value.partition("/")
+        rate = float(rate)
+        burst = float(burst) if burst else max(rate, 1)
+    except ValueError:
+        raise click.ClickException(
+            f"Invalid rate limit '{value}'. Expected format is rate[/burst] (ex. 50/100)."
+        )
+    if rate <= 0 or burst < 1:
+        raise click.ClickException(
+            f"Invalid rate limit '{value}'. Rate must be positive and burst at least 1."
+        )
+    return rate, burst
+
+
+def parse_rate_limits(value: str) -> Dict[str, Tuple[float, float]]:
+    """
+    Parse rate limit overrides in the format "family=rate[/burst],..." (ex. "intent=50/100,task=10").
+    Families that aren't mentioned keep their default limits.
+    """
+    rate_limits = dict(DEFAULT_RATE_LIMITS)
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        family, sep, limit = item.partition("=")
+        if not sep:
+            raise click.ClickException(
+                f"Invalid rate limit '{item}'. Expected format is family=rate[/burst] (ex. intent=50/100)."
+            )
+        if family not in DEFAULT_RATE_LIMITS:
+            raise click.ClickException(
+                f"Unknown endpoint family '{family}'. Valid families: {', '.join(DEFAULT_RATE_LIMITS)}"
+            )
+        rate_limits[family] = parse_rate_limit(limit)
+    return rate_limits
+
+
+def endpoint_family(path: str) -> str:
+    """Group DNAC API paths into the families that share a rate limit"""
+    if "/network-device-poller/" in path:
+        return "command-runner"
+    if path.startswith("/api/v1/task"):
+        return "task"
+    if path.startswith("/dna/intent/api/v1/file"):
+        return "file"
+    return "intent"
+
+
+def parse_retry_after(value: str) -> float:
+    """Convert a Retry-After header (seconds or an HTTP date) to a number of seconds"""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0), MAX_RETRY_AFTER)
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket allowing 'rate' requests per second, with bursts of up to 'capacity'"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> float:
+        """Block until a request can be sent. Returns the number of seconds the request was held back for."""
+        start = None
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return time.monotonic() - start if start else 0
+                wait = (1 - self.tokens) / self.rate
+            start = start or time.monotonic()
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Hold back every request in this bucket for at least 'seconds' (ex. after DNAC returns 429)"""
+        with self.lock:
+            self._refill()
+            # Several workers can be throttled at once, so don't stack their pauses
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class RequestScheduler(object):
+    """
+    Sends requests through a token bucket per DNAC endpoint family and retries throttled or failed requests.
+
+    When DNAC returns 429, the whole endpoint family is paused for the Retry-After period (or an exponential
+    backoff when the header is missing), so concurrent workers back off together instead of each tripping
+    the limit again.
+    """
+
+    def __init__(
+        self,
+        rate_limits: Dict[str, Tuple[float, float]] = None,
+        max_retries: int = MAX_RETRIES,
+    ):
+        rate_limits = {**DEFAULT_RATE_LIMITS, **(rate_limits or {})}
+        self.buckets = {
+            family: TokenBucket(rate, burst)
+            for family, (rate, burst) in rate_limits.items()
+        }
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        # "held" counts requests the rate limit made wait, and "held_seconds" how long they waited in total
+        # Format: {family: {"requests": 0, "retries": 0, "throttled": 0, "failed": 0, "held": 0, "held_seconds": 0}}
+        self.stats = {
+            family: {
+                "requests": 0,
+                "retries": 0,
+                "throttled": 0,
+                "failed": 0,
+                "held": 0,
+                "held_seconds": 0,
+            }
+            for family in self.buckets
+        }
+
+    def _count(self, family: str, counter: str, amount: float = 1):
+        with self.lock:
+            self.stats[family][counter] += amount
+
+    def send(
+        self, method: str, path: str, send: Callable[[], requests.Response]
+    ) -> requests.Response:
+        """Call 'send' once the endpoint family's rate limit allows it, retrying when it's safe to do so"""
+        family = endpoint_family(path)
+        bucket = self.buckets.get(family, self.buckets["intent"])
+        delays = backoff_delays()
+        attempt = 0
+        while True:
+            held = bucket.acquire()
+            self._count(family, "requests")
+            if held > 0:
+                self._count(family, "held")
+                self._count(family, "held_seconds", held)
+            try:
+                response = send()
+            except (requests.ConnectionError, requests.Timeout):
+                if method != "GET" or attempt >= self.max_retries:
+                    self._count(family, "failed")
+                    raise
+                attempt += 1
+                self._count(family, "retries")
+                time.sleep(next(delays))
+                continue
+            if response.status_code == THROTTLED_STATUS:
+                self._count(family, "throttled")
+                retryable = True
+            else:
+                retryable = (
+                    method == "GET" and response.status_code in TRANSIENT_STATUSES
+                )
+            if not retryable:
+                return response
+            if attempt >= self.max_retries:
+                self._count(family, "failed")
+                return response
+            attempt += 1
+            self._count(family, "retries")
+            wait = parse_retry_after(response.headers.get("Retry-After"))
+            if wait is None:
+                wait = next(delays)
+            if response.status_code == THROTTLED_STATUS:
+                bucket.pause(wait)
+            else:
+                time.sleep(wait)
+
+    def report(self, controller: str = None):
+        """Print a summary of throttled, retried and held back requests (to stderr), if there were any"""
+        label = f"DNAC {controller}" if controller else "DNAC"
+        for family, counts in self.stats.items():
+            if counts["throttled"] or counts["retries"]:
+                click.echo(
+                    f"{label} {family} API: {counts['requests']} request(s), {counts['throttled']} throttled, "
+                    f"{counts['retries']} retried, {counts['failed']} failed after retries.",
+                    err=True,
+                )
+            # Requests held back by our own rate limit, which more --workers can't speed up
+            if counts["held"]:
+                rate, burst = self.buckets[family].rate, self.buckets[family].capacity
+                click.echo(
+                    f"{label} {family} API: {counts['held']} of {counts['requests']} request(s) held back "
+                    f"{counts['held_seconds']:.1f}s in total by the rate limit ({rate:g}/sec, burst {burst:g}).",
+                    err=True,
+                )
@@ -0,0 +1,145 @@
+"""Module for the compact record types built from DNA Center API responses"""
+
+
+class Record(object):
+    """
+    Base for records that keep only the fields DNAC Sidekick uses from a DNAC JSON object.
+
+    Records use __slots__, so each one is a small fixed-size object instead of a dict holding every
+    field DNAC returned. Fields that aren't given default to None.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for attr in self.__slots__:
+            setattr(self, attr, fields.pop(attr, None))
+        if fields:
+            raise TypeError(f"Unknown {type(self).__name__} field(s): {list(fields)}")
+
+    def __eq__(self, other) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(
+            getattr(self, attr) == getattr(other, attr) for attr in self.__slots__
+        )
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{attr}={getattr(self, attr)!r}" for attr in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class Device(Record):
+    """
+    A device from DNAC inventory (network-device API).
+
+    'controller' is the controller profile the device was pulled from, when several DNAC clusters are
+    queried with --controllers (None otherwise).
+    """
+
+    __slots__ = (
+        "id",
+        "hostname",
+        "management_ip",
+        "serial_number",
+        "platform_id",
+        "type",
+        "family",
+        "role",
+        "software_type",
+        "software_version",
+        "controller",
+    )
+
+    @classmethod
+    def from_json(cls, device: dict) -> "Device":
+        """
+        Example usage:
+        >>> Device.from_json({"id": "f16955ae-...", "hostname": "spine1.abc.inc", "managementIpAddress": "10.10.20.80"})
+        Device(id='f16955ae-...', hostname='spine1.abc.inc', management_ip='10.10.20.80', serial_number=None, ...)
+        """
+        return cls(
+            id=device.get("id"),
+            hostname=device.get("hostname"),
+            management_ip=device.get("managementIpAddress"),
+            serial_number=device.get("serialNumber"),
+            platform_id=device.get("platformId"),
+            type=device.get("type"),
+            family=device.get("family"),
+            role=device.get("role"),
+            software_type=device.get("softwareType"),
+            software_version=device.get("softwareVersion"),
+            controller=device.get("controller"),
+        )
+
+    def to_json(self) -> dict:
+        """Convert back to a dict with DNAC's field names (ex. to spool devices to an NDJSON file)"""
+        device = {
+            "id": self.id,
+            "hostname": self.hostname,
+            "managementIpAddress": self.management_ip,
+            "serialNumber": self.serial_number,
+            "platformId": self.platform_id,
+            "type": self.type,
+            "family": self.family,
+            "role": self.role,
+            "softwareType": self.software_type,
+            "softwareVersion": self.software_version,
+        }
+        if self.controller is not None:
+            device["controller"] = self.controller
+        return device
+
+
+class Site(Record):
+    """
+    A site (area, building or floor) from DNAC's site topology.
+
+    'children' holds the IDs of the site's child sites once the site index has been built (see build_site_index).
+    """
+
+    __slots__ = ("id", "name", "parent_id", "hierarchy", "children")
+
+    def __init__(self, **fields):
+        super().__init__(**fields)
+        if self.children is None:
+            self.children = []
+
+    @classmethod
+    def from_json(cls, site: dict) -> "Site":
+        """
+        Site names are normalized, so they can be used as Ansible group names.
+
+        Example usage:
+        >>> Site.from_json({"id": "27eb9050-...", "name": "San Jose", "parentId": "b73390ce-...", "groupNameHierarchy": "Global/San Jose"})
+        Site(id='27eb9050-...', name='san_jose', parent_id='b73390ce-...', hierarchy='Global/San Jose', children=[])
+        """
+        return cls(
+            id=site["id"],
+            name=site["name"].replace(" ", "_").replace("-", "_").lower(),
+            parent_id=site.get("parentId"),
+            hierarchy=site["groupNameHierarchy"],
+        )
+
+
+class TopologyNode(Record):
+    """A device node from DNAC's physical topology, with the ID of the site it's assigned to"""
+
+    __slots__ = ("id", "hostname", "ip", "site_id")
+
+    @classmethod
+    def from_json(cls, node: dict) -> "TopologyNode":
+        """
+        Devices that aren't assigned to a site get a site ID of 'unassigned'.
+
+        Example usage:
+        >>> TopologyNode.from_json({"id": "aa0a5258-...", "label": "leaf1.abc.inc", "ip": "10.10.20.81", "additionalInfo": {}})
+        TopologyNode(id='aa0a5258-...', hostname='leaf1.abc.inc', ip='10.10.20.81', site_id='unassigned')
+        """
+        site_id = (node.get("additionalInfo") or {}).get("siteid")
+        return cls(
+            id=node["id"],
+            hostname=node["label"],
+            ip=node["ip"],
+            site_id=site_id if site_id is not None else "unassigned",
+        )
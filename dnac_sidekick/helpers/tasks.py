@@ -0,0 +1,68 @@
+"""Module for helper functions to wait on asynchronous DNA Center tasks"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+import click
+from dnac_sidekick.helpers.client import DnacClient
+from dnac_sidekick.helpers.ratelimit import backoff_delays
+
+# Seconds to wait before the first re-check of unfinished tasks. Doubles after every check, up to MAX_DELAY.
+INITIAL_DELAY = 0.5
+MAX_DELAY = 10
+BACKOFF_FACTOR = 2
+# Seconds to wait for all tasks to finish before giving up
+DEFAULT_TIMEOUT = 300
+# Number of task checks sent to DNAC at the same time
+DEFAULT_WORKERS = 8
+
+
+def get_task(client: DnacClient, task_id: str) -> dict:
+    """Retrieve the current status of a DNAC task"""
+    task_check_resp = client.get(f"/api/v1/task/{task_id}")
+    if task_check_resp.status_code != 200:
+        raise click.ClickException(
+            f"Could not check task {task_id}. Status code: {task_check_resp.status_code}. Error message: {task_check_resp.text}"
+        )
+    return task_check_resp.json()["response"]
+
+
+def wait_for_tasks(
+    client: DnacClient,
+    task_ids: List[str],
+    timeout: float = DEFAULT_TIMEOUT,
+    workers: int = DEFAULT_WORKERS,
+    show_progress: bool = True,
+) -> Dict[str, dict]:
+    """
+    Wait for a group of DNAC tasks to end and return their final status (keyed by task ID).
+
+    All unfinished tasks are checked together on every round, then the waiter backs off (with jitter)
+    before checking again, so long-running tasks don't flood DNAC with status checks.
+    """
+    deadline = time.monotonic() + timeout
+    delays = backoff_delays(INITIAL_DELAY, MAX_DELAY, BACKOFF_FACTOR)
+    finished = {}
+    reported = None
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            pending = [task_id for task_id in task_ids if task_id not in finished]
+            for task_id, task in zip(
+                pending,
+                executor.map(lambda task_id: get_task(client, task_id), pending),
+            ):
+                if task.get("endTime") is not None:
+                    finished[task_id] = task
+            # Only report progress when more tasks have finished since the last check
+            if show_progress and len(task_ids) > 1 and len(finished) != reported:
+                reported = len(finished)
+                click.echo(
+                    f"{len(finished)}/{len(task_ids)} DNAC task(s) finished.", err=True
+                )
+            if len(finished) == len(task_ids):
+                return finished
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise click.ClickException(
+                    f"Timed out after {timeout} seconds waiting for {len(task_ids) - len(finished)} DNAC task(s) to finish."
+                )
+            time.sleep(min(next(delays), remaining))
@@ -0,0 +1,107 @@
+"""Module for caching DNA Center auth tokens on disk, so they can be reused between CLI runs"""
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Union
+import click
+from dnac_sidekick.helpers.cache import default_cache_dir
+
+# DNAC tokens are valid for 60 minutes. Used when the token's own expiry can't be read.
+TOKEN_LIFETIME = 3600
+# Seconds before a token expires that it stops being reused, so it doesn't expire mid-request
+EXPIRY_MARGIN = 60
+# Serializes updates to the token file between threads of the same run
+SAVE_LOCK = threading.Lock()
+
+
+def token_expiry(token: str, issued: float = None) -> float:
+    """
+    Get the time (in seconds since the epoch) a token expires.
+
+    DNAC tokens are JWTs, so the expiry is read from the token's 'exp' claim. If the token can't be
+    decoded, it's assumed to last TOKEN_LIFETIME seconds from when it was issued.
+    """
+    issued = issued or time.time()
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(
+            base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        )
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return issued + TOKEN_LIFETIME
+
+
+class TokenCache(object):
+    """
+    Stores one token per DNAC URL and username in a JSON file that only the current user can read.
+
+    Example file:
+    {
+        "9f2c...": {"token": "eyJhbGciOiJS...", "expires": 1665000000.0}
+    }
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or default_cache_dir()
+        self.path = os.path.join(self.directory, "tokens.json")
+
+    @staticmethod
+    def key(dnac_url: str, username: str) -> str:
+        return hashlib.sha256(f"{dnac_url}|{username}".encode()).hexdigest()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path) as infile:
+                return json.load(infile)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, dnac_url: str, username: str) -> Union[str, None]:
+        """Get a cached token that's still valid (None if there isn't one)"""
+        entry = self._load().get(self.key(dnac_url, username))
+        if entry and entry.get("expires", 0) - EXPIRY_MARGIN > time.time():
+            return entry.get("token")
+        return None
+
+    def save(self, dnac_url: str, username: str, token: str):
+        """
+        Add a token to the cache file. Failing to write the file only prints a warning (to stderr),
+        since the token can still be used for the rest of the command.
+        """
+        # Tokens for several controllers can be saved at the same time (ex. with --controllers), so only
+        # one thread reads, updates and rewrites the file at a time
+        with SAVE_LOCK:
+            try:
+                self._save(dnac_url, username, token)
+            except OSError as e:
+                click.echo(f"Could not cache DNAC token at {self.path}: {e}", err=True)
+
+    def _save(self, dnac_url: str, username: str, token: str):
+        tokens = self._load()
+        # Drop expired tokens while the file is being rewritten anyway
+        tokens = {
+            key: entry
+            for key, entry in tokens.items()
+            if entry.get("expires", 0) > time.time()
+        }
+        tokens[self.key(dnac_url, username)] = {
+            "token": token,
+            "expires": token_expiry(token),
+        }
+        # Write the new file with owner-only permissions (mkstemp's default), then swap it in
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.directory, prefix="tokens.", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as outfile:
+                json.dump(tokens, outfile)
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -1,114 +1,111 @@
 """Module for helper fuctions to pull topology and site information from DNA Center"""
-from typing import Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple, Union
 import click
-import os
-import requests
+from dnac_sidekick.helpers.cache import cached_records
+from dnac_sidekick.helpers.client import DnacClient
+from dnac_sidekick.helpers.decode import project
+from dnac_sidekick.helpers.records import Site, TopologyNode
 
+# Fields kept from site and device topology records (and in their cached copies). The rest are dropped after decoding.
+SITE_FIELDS = ("id", "name", "parentId", "groupNameHierarchy")
+NODE_FIELDS = ("id", "label", "ip", "additionalInfo")
 
-def get_site_hierarchy() -> dict:
+
+def get_topology_records(client: DnacClient, path: str, key: str, **params) -> list:
+    """Pull a list of records (ex. 'sites' or 'nodes') from a DNAC topology endpoint"""
+    response = client.get(path, params=params or None)
+    if response.status_code == 200:
+        return response.json()["response"][key]
+    elif response.status_code == 401:
+        raise click.ClickException(
+            f"HTTP Status Code: {response.status_code}. Unauthorized. Please verify your token is valid."
+        )
+    else:
+        raise click.ClickException(
+            f"HTTP Status Code: {response.status_code}. Could not retrieve {key} from DNAC. Error message: {response.text}"
+        )
+
+
+def get_site_hierarchy(client: DnacClient) -> Dict[str, Site]:
     """
-    Get site topology information from DNA Center.
+    Get site topology information from DNA Center, keyed by site ID. This ensures each site captured is unique.
 
     Example output:
     {
-        "27eb9050-63bf-4832-92a0-95796391a92b": {
-            "name": "san_jose",
-            "parentId": "b73390ce-b713-49c1-899b-1605853c321d",
-            "groupNameHierarchy": "Global/San Jose"
-        },
-        "c323fba3-b7f4-462a-9867-f2eb865ece19": {
-            "name": "sjc_20",
-            "parentId": "27eb9050-63bf-4832-92a0-95796391a92b",
-            "groupNameHierarchy": "Global/San Jose/SJC-20"
-        }
+        "27eb9050-63bf-4832-92a0-95796391a92b": Site(
+            id="27eb9050-63bf-4832-92a0-95796391a92b",
+            name="san_jose",
+            parent_id="b73390ce-b713-49c1-899b-1605853c321d",
+            hierarchy="Global/San Jose",
+            children=[]
+        ),
+        "c323fba3-b7f4-462a-9867-f2eb865ece19": Site(
+            id="c323fba3-b7f4-462a-9867-f2eb865ece19",
+            name="sjc_20",
+            parent_id="27eb9050-63bf-4832-92a0-95796391a92b",
+            hierarchy="Global/San Jose/SJC-20",
+            children=[]
+        )
     }
     """
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "X-Auth-Token": os.environ.get("DNAC_TOKEN"),
-    }
-    # Get available CLI device credentials stored in DNAC
-    dnac_sites = (
-        f"{os.environ.get('DNAC_URL')}/dna/intent/api/v1/topology/site-topology"
+    sites_path = "/dna/intent/api/v1/topology/site-topology"
+    sites = cached_records(
+        client,
+        sites_path,
+        lambda: project(get_topology_records(client, sites_path, "sites"), SITE_FIELDS),
     )
-    response = requests.get(url=dnac_sites, headers=headers, verify=False)
-    # Site structure dict will hold important values that are needed to build site hierarchy for Ansible inventory
-    # Site IDs will be used as keys for each site in the output. This will ensure each site captured is unique.
-    site_structure = {}
-    if response.status_code == 200:
-        for site in response.json()["response"]["sites"]:
-            site_key = {site["id"]: {}}
-            site_structure.update(site_key)
-            site_structure[site["id"]].update(
-                {"name": site["name"].replace(" ", "_").replace("-", "_").lower()}
-            )
-            site_structure[site["id"]].update({"parentId": site["parentId"]})
-            site_structure[site["id"]].update(
-                {"groupNameHierarchy": site["groupNameHierarchy"]}
-            )
-    else:
-        click.echo(f"HTTP Status Code: {response.status_code}")
-        click.echo("Unauthorized. Please verify your token is valid.")
-    return site_structure
+    return {site["id"]: Site.from_json(site) for site in sites}
 
 
-def get_assigned_devices() -> dict:
+def get_assigned_devices(client: DnacClient) -> Dict[str, TopologyNode]:
     """
-    Get list of devices and the site IDs they are assigned to in DNA Center.
+    Get list of devices and the site IDs they are assigned to in DNA Center, keyed by device ID.
 
     Example output:
     {
-        "6b741b27-f7e7-4470-b6fc-d5168cc59502": {
-            "hostname": "c3504.abc.inc",
-            "ip": "10.10.20.51",
-            "siteId": "unassigned"
-        },
-        "aa0a5258-3e6f-422f-9c4e-9c196db115ae": {
-            "hostname": "leaf1.abc.inc",
-            "ip": "10.10.20.81",
-            "siteId": "c323fba3-b7f4-462a-9867-f2eb865ece19"
-        },
-        "f0cb8464-1ce7-4afe-9c0d-a4b0cc5ee84c": {
-            "hostname": "leaf2.abc.inc",
-            "ip": "10.10.20.82",
-            "siteId": "unassigned"
-        },
-        "f16955ae-c349-47e9-8e8f-9b62104ab604": {
-            "hostname": "spine1.abc.inc",
-            "ip": "10.10.20.80",
-            "siteId": "unassigned"
-        }
+        "6b741b27-f7e7-4470-b6fc-d5168cc59502": TopologyNode(
+            id="6b741b27-f7e7-4470-b6fc-d5168cc59502",
+            hostname="c3504.abc.inc",
+            ip="10.10.20.51",
+            site_id="unassigned"
+        ),
+        "aa0a5258-3e6f-422f-9c4e-9c196db115ae": TopologyNode(
+            id="aa0a5258-3e6f-422f-9c4e-9c196db115ae",
+            hostname="leaf1.abc.inc",
+            ip="10.10.20.81",
+            site_id="c323fba3-b7f4-462a-9867-f2eb865ece19"
+        )
     }
     """
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "X-Auth-Token": os.environ.get("DNAC_TOKEN"),
-    }
-    # Get available CLI device credentials stored in DNAC
-    dnac_sites = f"{os.environ.get('DNAC_URL')}/dna/intent/api/v1/topology/physical-topology?nodeType=device"
-    response = requests.get(url=dnac_sites, headers=headers, verify=False)
-    # Site structure dict will hold important values that are needed to build site hierarchy for Ansible inventory
-    # Device IDs will be used as keys for each device in the output. This will ensure each device captured is unique.
-    node_structure = {}
-    if response.status_code == 200:
-        for node in response.json()["response"]["nodes"]:
-            node_key = {node["id"]: {}}
-            node_structure.update(node_key)
-            node_structure[node["id"]].update({"hostname": node["label"]})
-            node_structure[node["id"]].update({"ip": node["ip"]})
-            if node["additionalInfo"].get("siteid") is not None:
-                node_structure[node["id"]].update(
-                    {"siteId": node["additionalInfo"]["siteid"]}
-                )
-            else:
-                node_structure[node["id"]].update({"siteId": "unassigned"})
-    else:
-        click.echo(f"HTTP Status Code: {response.status_code}")
-        click.echo("Unauthorized. Please verify your token is valid.")
+    nodes_path = "/dna/intent/api/v1/topology/physical-topology"
+    nodes = cached_records(
+        client,
+        f"{nodes_path}?nodeType=device",
+        lambda: project(
+            get_topology_records(client, nodes_path, "nodes", nodeType="device"),
+            NODE_FIELDS,
+        ),
+    )
+    return {node["id"]: TopologyNode.from_json(node) for node in nodes}
+
+
+def fetch_topology(
+    client: DnacClient, *fetchers: Callable[[DnacClient], dict]
+) -> List[dict]:
+    """
+    Run several topology fetchers (ex. get_site_hierarchy, get_assigned_devices) concurrently over the shared session.
 
-    return node_structure
+    Each response is decoded in its own worker as soon as it arrives, so the total time is bound by the slowest
+    endpoint rather than the sum of all of them. Results are returned in the same order as the fetchers.
+
+    Example usage:
+    >>> site_topo, devices = fetch_topology(client, get_site_hierarchy, get_assigned_devices)
+    """
+    client.set_pool_size(len(fetchers))
+    with ThreadPoolExecutor(max_workers=len(fetchers)) as executor:
+        futures = [executor.submit(fetch, client) for fetch in fetchers]
+        return [future.result() for future in futures]
 
 
 def dict_query(d: dict, path: str) -> Union[object, None]:
@@ -144,10 +141,48 @@ def get_all_keys(d):
 
 def get_site_name_by_id(sites: dict, site_id: str) -> Union[str, None]:
     """Function used to get the site name given the site ID"""
-    all_site_ids = get_all_keys(sites)
-    if site_id in all_site_ids:
-        site_name = sites.get(site_id)
-        return site_name["name"]
+    if site_id in sites:
+        return sites[site_id].name
     else:
         # For top-level sites (Global is the parent, so ID won't be found)
         return "all"
+
+
+def build_site_index(sites: Dict[str, Site]) -> Tuple[Dict[str, Site], List[str]]:
+    """
+    Link each site (from get_site_hierarchy) to its child sites, so the hierarchy can be walked top-down.
+
+    Returns the sites and the IDs of the top-level sites (sites whose parent, 'Global', isn't in the hierarchy).
+    Built in a single pass over the sites.
+
+    Example output:
+    (
+        {
+            "27eb9050-63bf-4832-92a0-95796391a92b": Site(
+                id="27eb9050-63bf-4832-92a0-95796391a92b",
+                name="san_jose",
+                parent_id="b73390ce-b713-49c1-899b-1605853c321d",
+                hierarchy="Global/San Jose",
+                children=["c323fba3-b7f4-462a-9867-f2eb865ece19"]
+            ),
+            "c323fba3-b7f4-462a-9867-f2eb865ece19": Site(
+                id="c323fba3-b7f4-462a-9867-f2eb865ece19",
+                name="sjc_20",
+                parent_id="27eb9050-63bf-4832-92a0-95796391a92b",
+                hierarchy="Global/San Jose/SJC-20",
+                children=[]
+            )
+        },
+        ["27eb9050-63bf-4832-92a0-95796391a92b"]
+    )
+    """
+    for site in sites.values():
+        site.children = []
+    root_ids = []
+    for site_id, site in sites.items():
+        parent = sites.get(site.parent_id)
+        if parent is not None:
+            parent.children.append(site_id)
+        else:
+            root_ids.append(site_id)
+    return sites, root_ids
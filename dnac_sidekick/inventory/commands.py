@@ -3,121 +3,201 @@
 import json
 import os
 import click
+from concurrent.futures import ThreadPoolExecutor
 from math import ceil
+from typing import Iterator
 from rich import print_json, print
-from rich.table import Table
-from rich.console import Console
-import requests
+from dnac_sidekick.helpers import decode
+from dnac_sidekick.helpers.cache import cached_records
+from dnac_sidekick.helpers.client import DnacClient
+from dnac_sidekick.helpers.controllers import (
+    controller_cells,
+    controller_columns,
+    iter_controllers,
+    with_controller,
+)
+from dnac_sidekick.helpers.output import TABLE_FORMATS, TableWriter
+from dnac_sidekick.helpers.profiling import profile_phase
+from dnac_sidekick.helpers.records import Device
+from dnac_sidekick.inventory.index import INVENTORY_PATH, resolve_controller_devices
+from dnac_sidekick.inventory.sync import sync_devices
 
+# Columns of the table output
+INVENTORY_COLUMNS = [
+    ("Hostname", {"justify": "left", "style": "purple"}),
+    ("Device Type", {"justify": "left", "style": "cyan"}),
+    ("Serial Number", {"justify": "center", "style": "green"}),
+    ("Software Version", {"justify": "right", "style": "red"}),
+]
+# Default and max limit for device inventory is 500 devices per call
+PAGE_SIZE = 500
+# Number of inventory pages requested from DNAC at the same time
+DEFAULT_WORKERS = 4
 
-@click.pass_context
-def get_device_count(ctx):
+
+def get_device_count(client: DnacClient) -> int:
     """Retrieve device count from DNAC inventory"""
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "X-Auth-Token": ctx.obj.token,
-    }
-    if not ctx.obj.dnac_url:
+    if not client.dnac_url:
         raise click.ClickException(
             "DNAC URL has not been provided and has not been set as an environment variable."
         )
-    device_count_url = f"{ctx.obj.dnac_url}/dna/intent/api/v1/network-device/count"
-    response = requests.get(url=device_count_url, headers=headers, verify=False)
+    response = client.get("/dna/intent/api/v1/network-device/count")
     if response.status_code == 200:
         device_count = response.json()["response"]
         return device_count
+    else:
+        raise click.ClickException(
+            f"Could not retrieve device count. HTTP code: {response.status_code}. Error message: {response.text}"
+        )
+
+
+def get_device_page(client: DnacClient, offset: int) -> list:
+    """
+    Retrieve a single page of devices from DNAC inventory, starting at the given offset.
+
+    Pages aren't projected (see decode.project): every command shares the cached inventory, and JSON/NDJSON
+    output and incremental syncs need full device records.
+    """
+    response = client.get(
+        "/dna/intent/api/v1/network-device",
+        params={"limit": PAGE_SIZE, "offset": offset},
+    )
+    if response.status_code == 200:
+        return response.json()["response"]
+    else:
+        raise click.ClickException(
+            f"There was an error collecting the device inventory. HTTP code: {response.status_code}. Error message: {response.text}"
+        )
+
+
+def get_device_pages(
+    client: DnacClient, total_dev_count: int, workers: int = DEFAULT_WORKERS
+) -> Iterator[list]:
+    """
+    Retrieve every page of devices from DNAC inventory.
+
+    Since the device count is known up front, all page offsets are known as well, so the pages are requested
+    concurrently (up to 'workers' at a time). Pages are yielded in offset order, as soon as each one is available.
+    """
+    # DNAC offsets are 1-based (offset=1 is the first device in inventory)
+    offsets = [
+        page * PAGE_SIZE + 1 for page in range(ceil(total_dev_count / PAGE_SIZE))
+    ]
+    client.set_pool_size(workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(lambda offset: get_device_page(client, offset), offsets)
+
+
+def fetch_devices(client: DnacClient, workers: int = DEFAULT_WORKERS) -> Iterator[dict]:
+    """Yield every device in DNAC inventory, pulled page by page from DNAC"""
+    # There's a hard limit to only return 500 devices per call, so get total number of devices
+    # to figure out how many pages (and offsets) are needed for larger inventories
+    total_dev_count = get_device_count(client)
+    for page in get_device_pages(client, total_dev_count, workers):
+        yield from page
+
+
+def iter_devices(client: DnacClient, workers: int = DEFAULT_WORKERS) -> Iterator[dict]:
+    """
+    Yield every device in DNAC inventory, one page at a time.
+
+    Only the pages currently being fetched are held in memory, so callers that process devices as they
+    arrive (ex. writing NDJSON or rendering a testbed) use the same amount of memory regardless of inventory size.
+    Devices are served from the local cache when a fresh copy is available. In incremental mode, a stale
+    cached copy is synced by only re-fetching the devices that were added or changed, until the last full
+    pull is older than the cache's max_sync_age.
+    """
+    yield from cached_records(
+        client,
+        INVENTORY_PATH,
+        lambda: fetch_devices(client, workers),
+        lambda snapshot: sync_devices(
+            client, snapshot, get_device_count(client), workers
+        ),
+    )
 
 
 @click.command
 @click.option(
     "--hostname",
-    default="",
-    help="Specify a device's hostname to retrieve from inventory",
+    multiple=True,
+    help="Specify a device's hostname, management IP or serial number to retrieve from inventory. Can be used multiple times.",
 )
 @click.option(
     "--output",
-    type=click.Choice(["table", "json", "none"], case_sensitive=False),
+    type=click.Choice(
+        ["table", "plain", "csv", "tsv", "json", "ndjson", "none"],
+        case_sensitive=False,
+    ),
     default="table",
     show_default=True,
-    help="Specify an output format",
+    help="Specify an output format. plain, csv and tsv are written as devices arrive, so they suit very large inventories.",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=DEFAULT_WORKERS,
+    show_default=True,
+    help="Number of inventory pages to request from DNAC concurrently. Requests are still capped by the intent API "
+    "rate limit (20/sec, burst 40 by default; see 'get --rate-limit').",
 )
 @click.pass_context
-def devices(ctx, hostname, output):
-    """Retrieve all devices from DNAC inventory"""
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "X-Auth-Token": ctx.obj.token,
-    }
+def devices(ctx, hostname, output, workers):
+    """
+    Retrieve all devices from DNAC inventory
+
+    With '--output none', an iterator of device dicts is returned for use by other commands.
+    With --controllers, every controller's devices are included and each device gets a 'controller' field.
+    """
     if not ctx.obj.dnac_url:
         raise click.ClickException(
             "DNAC URL has not been provided and has not been set as an environment variable."
         )
-    # Get total number of devices to figure out offset for larger inventories
-    total_dev_count = get_device_count()
-    # Default and max limit for device inventory is 500, so we need to figure out how many API calls to make
-    total_pages = ceil(total_dev_count / 500)
     if hostname:
-        dnac_devices_url = (
-            f"{ctx.obj.dnac_url}/dna/intent/api/v1/network-device?hostname={hostname}"
-        )
-        response = requests.get(url=dnac_devices_url, headers=headers, verify=False)
-        device_list = response.json()["response"]
+        # Resolved from the cached inventory when possible, otherwise with batched lookups
+        device_iter = with_controller(resolve_controller_devices(ctx, hostname))
     else:
         # Since hostname was not provided, get all devices from DNAC inventory
-        # There's a hard limit to only return 500 devices per call, so we must change the params
-        # if there's more than 500 devices in the inventory
-        # Initialize device list
-        device_list = []
-        for page in range(total_pages):
-            # Make additional calls (if necessary) - needed for inventories with more than 500 devices
-            calc_offset = page * 500
-            if calc_offset > 0:
-                dnac_devices_url = f"{ctx.obj.dnac_url}/dna/intent/api/v1/network-device?limit=500&offset={calc_offset}"
-            else:
-                # No offset needed
-                dnac_devices_url = (
-                    f"{ctx.obj.dnac_url}/dna/intent/api/v1/network-device?limit=500"
-                )
-            response = requests.get(
-                url=dnac_devices_url,
-                headers=headers,
-                verify=False,
-            )
-            if response.status_code == 200:
-                # Add devices to the response from the initial call
-                device_list.extend(response.json()["response"])
-            else:
-                raise click.ClickException(
-                    f"There was an error collecting the device inventory. HTTP code: {response.status_code}. Error message: {response.text}"
+        device_iter = with_controller(
+            iter_controllers(ctx, lambda client: iter_devices(client, workers))
+        )
+    if output == "none":
+        # Hand back Python objects (lazily fetched) instead of a serialized string
+        return device_iter
+    elif output == "ndjson":
+        # Write each device as soon as its page arrives, so memory stays flat for large inventories
+        with open("dnac_inventory.ndjson", "w") as outfile:
+            for device in device_iter:
+                with profile_phase("serialize"):
+                    dev_out = decode.dumps(device)
+                click.echo(dev_out)
+                outfile.write(f"{dev_out}\n")
+        print(
+            f"[bold bright_yellow]NDJSON output saved at {os.path.dirname(os.getcwd())}/dnac_inventory.ndjson[/bold bright_yellow]"
+        )
+        return
+    elif output in TABLE_FORMATS:
+        # Rows are written as devices arrive (large tables are printed in pages), so only the
+        # devices currently being rendered are held in memory
+        columns = controller_columns(ctx, INVENTORY_COLUMNS)
+        with TableWriter("DNAC Network Devices", columns, output) as writer:
+            for device in map(Device.from_json, device_iter):
+                writer.add_row(
+                    *controller_cells(device.controller),
+                    device.hostname,
+                    device.type,
+                    device.serial_number,
+                    device.software_version,
                 )
-    if device_list and output == "table":
-        # Output nicely formatted table of inventory devices
-        table = Table(title="DNAC Network Devices")
-        table.add_column("Hostname", justify="left", style="purple")
-        table.add_column("Device Type", justify="left", style="cyan")
-        table.add_column("Serial Number", justify="center", style="green")
-        table.add_column("Software Version", justify="right", style="red")
-
-        for device in device_list:
-            table.add_row(
-                device["hostname"],
-                device["type"],
-                device["serialNumber"],
-                device["softwareVersion"],
-            )
-
-        console = Console()
-        console.print(table)
-    elif device_list and output == "json":
-        dev_list_out = json.dumps(device_list)
-        print_json(f"{dev_list_out}")
+        return
+    device_list = list(device_iter)
+    if device_list and output == "json":
+        with profile_phase("serialize"):
+            dev_list_out = json.dumps(device_list)
+        with profile_phase("render"):
+            print_json(f"{dev_list_out}")
         with open("dnac_inventory.json", "w") as outfile:
             outfile.write(dev_list_out)
             print(
                 f"[bold bright_yellow]JSON output saved at {os.path.dirname(os.getcwd())}/dnac_inventory.json[/bold bright_yellow]"
             )
-    elif device_list and output == "none":
-        dev_list_out = json.dumps(device_list)
-        return dev_list_out
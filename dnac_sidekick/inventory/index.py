@@ -0,0 +1,115 @@
+""" Resolve device hostnames, management IPs and serial numbers to DNAC inventory records """
+
+from typing import Dict, Iterable, List, Tuple, Union
+import click
+from dnac_sidekick.helpers.client import DnacClient
+from dnac_sidekick.helpers.controllers import iter_controllers
+
+INVENTORY_PATH = "/dna/intent/api/v1/network-device"
+# Device fields a device can be looked up by, in the order they're tried against DNAC
+INDEX_FIELDS = ("hostname", "managementIpAddress", "serialNumber")
+# Number of names sent in a single network-device lookup. Keeps the query string to a reasonable URL length.
+NAME_BATCH_SIZE = 100
+
+
+class DeviceIndex(object):
+    """
+    Map of hostname, management IP and serial number -> device record.
+
+    Only the devices being looked up are kept, so building an index from a large cached inventory
+    doesn't hold the whole inventory in memory.
+    """
+
+    def __init__(self, names: Iterable[str]):
+        self.names = list(names)
+        self.wanted = set(self.names)
+        self.devices = {}
+
+    def add(self, device: dict):
+        for field in INDEX_FIELDS:
+            value = device.get(field)
+            if value in self.wanted:
+                self.devices[value] = device
+
+    def update(self, devices: Iterable[dict]):
+        for device in devices:
+            self.add(device)
+
+    def missing(self) -> List[str]:
+        return [name for name in self.names if name not in self.devices]
+
+
+def get_devices_by_field(
+    client: DnacClient, field: str, values: List[str]
+) -> List[dict]:
+    """Look up a batch of devices by hostname, management IP or serial number in a single inventory query"""
+    response = client.get(INVENTORY_PATH, params={field: values})
+    if response.status_code == 200:
+        return response.json()["response"]
+    else:
+        raise click.ClickException(
+            f"Could not look up devices by {field}. Status code: {response.status_code}. Error message: {response.text}"
+        )
+
+
+def resolve_devices(
+    client: DnacClient, names: Iterable[str], missing_ok: bool = False
+) -> Dict[str, dict]:
+    """
+    Find the inventory records for a list of device hostnames, management IPs and/or serial numbers.
+
+    Names are looked up in the cached inventory first (when a fresh copy is cached). Names that
+    aren't found are looked up in DNAC in batches, trying each field in turn, so resolving hundreds
+    of devices only takes a handful of requests. In offline mode, only the cache is used.
+
+    Raises a ClickException listing any names that don't match a device (unless missing_ok is set).
+    Returns records keyed by name, in the order the names were given.
+    """
+    names = list(dict.fromkeys(names))
+    index = DeviceIndex(names)
+    offline = False
+    if client.cache is not None:
+        offline = client.cache.offline
+        cached = client.cache.cached(INVENTORY_PATH)
+        if cached is not None:
+            index.update(cached)
+    for field in INDEX_FIELDS:
+        missing = index.missing()
+        if not missing or offline:
+            break
+        for idx in range(0, len(missing), NAME_BATCH_SIZE):
+            index.update(
+                get_devices_by_field(
+                    client, field, missing[idx : idx + NAME_BATCH_SIZE]
+                )
+            )
+    missing = index.missing()
+    if missing and not missing_ok:
+        raise click.ClickException(
+            f"Device(s) not found in inventory: {', '.join(sorted(missing))}"
+        )
+    return {name: index.devices[name] for name in names if name in index.devices}
+
+
+def resolve_controller_devices(
+    ctx: click.Context, names: Iterable[str]
+) -> List[Tuple[Union[str, None], dict]]:
+    """
+    Same as resolve_devices, for every controller selected with --controllers (or the command's client without it).
+
+    A device only lives on one cluster, so a name only has to match a device on one of the controllers.
+    Raises a ClickException listing any names that don't match a device anywhere. Returns a list of
+    (controller name, device record).
+    """
+    names = list(dict.fromkeys(names))
+    matches = list(
+        iter_controllers(
+            ctx, lambda client: resolve_devices(client, names, missing_ok=True).items()
+        )
+    )
+    missing = set(names) - {name for _, (name, _) in matches}
+    if missing:
+        raise click.ClickException(
+            f"Device(s) not found in inventory: {', '.join(sorted(missing))}"
+        )
+    return [(controller, device) for controller, (_, device) in matches]
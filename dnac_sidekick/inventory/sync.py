@@ -0,0 +1,111 @@
+""" Incremental sync of a locally cached DNAC inventory snapshot """
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Union
+import click
+from dnac_sidekick.helpers.client import DnacClient
+from dnac_sidekick.helpers.decode import project
+from dnac_sidekick.helpers.topology import get_topology_records
+
+# Number of device IDs requested per network-device call when re-fetching changed devices.
+# Keeps the comma-separated 'id' query parameter to a reasonable URL length.
+ID_BATCH_SIZE = 100
+# Device fields that are also reported on physical topology nodes. If any of them differ between the
+# snapshot and the topology, the device has changed since it was cached and is re-fetched.
+# Format: (network-device field, topology node field)
+FINGERPRINT_FIELDS = (
+    ("hostname", "label"),
+    ("managementIpAddress", "ip"),
+    ("softwareVersion", "softwareVersion"),
+    ("platformId", "platformId"),
+    ("role", "role"),
+)
+
+
+def get_device_listing(client: DnacClient) -> List[dict]:
+    """
+    Get a lightweight listing of every device in DNAC.
+
+    DNAC's network-device API can't filter on 'lastUpdateTime' or return only a few fields, so the device
+    nodes from the physical topology (ID plus a handful of fields) are used to detect what changed.
+    """
+    nodes = get_topology_records(
+        client,
+        "/dna/intent/api/v1/topology/physical-topology",
+        "nodes",
+        nodeType="device",
+    )
+    return project(nodes, ("id", *(node_field for _, node_field in FINGERPRINT_FIELDS)))
+
+
+def is_changed(device: dict, node: dict) -> bool:
+    """Compare the fields a device and its topology node have in common"""
+    for dev_field, node_field in FINGERPRINT_FIELDS:
+        if dev_field in device and node_field in node:
+            if device[dev_field] != node[node_field]:
+                return True
+    return False
+
+
+def get_devices_by_id(client: DnacClient, dev_ids: List[str]) -> List[dict]:
+    """Retrieve full device records for a batch of device IDs"""
+    response = client.get(
+        "/dna/intent/api/v1/network-device", params={"id": ",".join(dev_ids)}
+    )
+    if response.status_code == 200:
+        return response.json()["response"]
+    else:
+        raise click.ClickException(
+            f"There was an error collecting changed devices. HTTP code: {response.status_code}. Error message: {response.text}"
+        )
+
+
+def sync_devices(
+    client: DnacClient,
+    snapshot: Iterable[dict],
+    total_dev_count: int,
+    workers: int,
+) -> Union[Iterator[dict], None]:
+    """
+    Bring a cached inventory snapshot up to date, only re-fetching devices that were added or changed.
+
+    Devices that no longer exist in DNAC are dropped. Returns None if the device listing doesn't line up
+    with DNAC's device count, in which case the caller should fall back to a full inventory pull.
+    """
+    snapshot = {dev["id"]: dev for dev in snapshot}
+    listing = {node["id"]: node for node in get_device_listing(client)}
+    if len(listing) != total_dev_count:
+        click.echo(
+            f"Device listing ({len(listing)}) doesn't match inventory count ({total_dev_count}). Pulling full inventory.",
+            err=True,
+        )
+        return None
+
+    removed = [dev_id for dev_id in snapshot if dev_id not in listing]
+    added = [dev_id for dev_id in listing if dev_id not in snapshot]
+    changed = [
+        dev_id
+        for dev_id, node in listing.items()
+        if dev_id in snapshot and is_changed(snapshot[dev_id], node)
+    ]
+    stale_ids = added + changed
+    batches = [
+        stale_ids[idx : idx + ID_BATCH_SIZE]
+        for idx in range(0, len(stale_ids), ID_BATCH_SIZE)
+    ]
+    client.set_pool_size(workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch in executor.map(
+            lambda dev_ids: get_devices_by_id(client, dev_ids), batches
+        ):
+            for dev in batch:
+                snapshot[dev["id"]] = dev
+    for dev_id in removed:
+        snapshot.pop(dev_id, None)
+    click.echo(
+        f"Incremental sync: {len(added)} added, {len(changed)} changed, {len(removed)} removed, "
+        f"{len(snapshot) - len(stale_ids)} unchanged.",
+        err=True,
+    )
+    # Existing devices keep their position from the snapshot, new devices are added at the end
+    return iter(snapshot.values())
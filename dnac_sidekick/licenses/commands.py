@@ -1,139 +1,175 @@
 """ Commands to run CLI commands on network devices in DNAC inventory and view the output. """
 
 import click
-from rich.table import Table
-from rich.console import Console
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Union
+from rich.text import Text
 import requests
+from dnac_sidekick.helpers.client import DnacClient
+from dnac_sidekick.helpers.controllers import (
+    controller_cells,
+    controller_clients,
+    controller_columns,
+    iter_controllers,
+)
+from dnac_sidekick.helpers.output import TABLE_FORMATS, TableWriter
+from dnac_sidekick.inventory.commands import (
+    DEFAULT_WORKERS as INVENTORY_WORKERS,
+    iter_devices,
+)
+from dnac_sidekick.inventory.index import resolve_controller_devices
+
+# Number of license lookups sent to DNAC at the same time
+DEFAULT_WORKERS = 8
+# Lookups queued per worker ahead of the oldest unwritten row. Keeps workers busy while rows are written
+# in inventory order, without holding a lookup for every device in memory.
+LOOKUP_WINDOW = 2
+# Seconds to wait for each license lookup before reporting the device as failed
+DEFAULT_TIMEOUT = 30
+# Columns of the license output
+LICENSE_COLUMNS = [
+    ("Network License Level", {"justify": "left", "style": "blue"}),
+    ("DNA License Level", {"justify": "left", "style": "purple"}),
+    ("License Validity", {"justify": "center", "style": "cyan"}),
+    ("Virtual Account", {"justify": "center", "style": "green"}),
+    ("Device UDI", {"justify": "center", "style": "red"}),
+]
+
+
+def get_device_license(
+    client: DnacClient, dev_id: str, timeout: float = DEFAULT_TIMEOUT
+) -> Tuple[Union[dict, None], Union[str, None]]:
+    """
+    Retrieve license details for a single device.
+
+    Returns a tuple of (license details, error message). Errors are returned rather than raised, so one
+    failed device doesn't stop a sweep across the whole inventory.
+    """
+    try:
+        dev_licensing_resp = client.get(
+            f"/dna/intent/api/v1/licenses/device/{dev_id}/details", timeout=timeout
+        )
+    except requests.RequestException as e:
+        return None, f"Request failed: {e}"
+    if dev_licensing_resp.status_code == 200:
+        return dev_licensing_resp.json(), None
+    elif dev_licensing_resp.status_code == 401:
+        return None, "Unauthorized. Please verify your token is valid."
+    else:
+        return (
+            None,
+            f"Status code: {dev_licensing_resp.status_code}. Error message: {dev_licensing_resp.text}",
+        )
 
 
 @click.command
 @click.option(
-    "--device", default="", help="Specify a device's hostname to get licensing."
+    "--device",
+    multiple=True,
+    help="Specify a device's hostname, management IP or serial number to get licensing. Can be used multiple times.",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=DEFAULT_WORKERS,
+    show_default=True,
+    help="Number of device license lookups to run concurrently. Requests are still capped by the intent API "
+    "rate limit (20/sec, burst 40 by default; see 'get --rate-limit').",
+)
+@click.option(
+    "--timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    default=DEFAULT_TIMEOUT,
+    show_default=True,
+    help="Seconds to wait for each device's license lookup.",
+)
+@click.option(
+    "--output",
+    type=click.Choice(TABLE_FORMATS, case_sensitive=False),
+    default="table",
+    show_default=True,
+    help="Specify an output format. plain, csv and tsv are written as lookups finish, so they suit very large inventories.",
 )
 @click.pass_context
-def licenses(ctx, device):
+def licenses(ctx, device, workers, timeout, output):
     """Get license info for devices in DNAC inventory."""
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "X-Auth-Token": ctx.obj.token,
-    }
     if not ctx.obj.dnac_url:
         raise click.ClickException(
             "DNAC URL has not been provided or has not been set as an environment variable."
         )
-    # different workflow if a device hostname is specified
+    # Format: {controller name: DnacClient} (the name is None without --controllers)
+    clients = controller_clients(ctx) or {None: ctx.obj}
+    for client in clients.values():
+        client.set_pool_size(workers + INVENTORY_WORKERS)
     if device:
-        dnac_devices_url = (
-            f"{ctx.obj.dnac_url}/dna/intent/api/v1/network-device?hostname={device}"
-        )
-        net_devices_resp = requests.get(
-            url=dnac_devices_url, headers=headers, verify=False
-        )
-        if net_devices_resp.status_code == 200:
-            dev_id = net_devices_resp.json()["response"][0].get("id")
-            # raise exception if device ID is not found
-            if not dev_id:
-                raise click.ClickException("Device hostname not found in inventory.")
-        # could handle more error codes (i.e. 400, 401, etc) instead of using else
-        else:
-            raise click.ClickException(
-                f"Could not pull device ID. Status code: {net_devices_resp.status_code}. Error message: {net_devices_resp.text}"
-            )
-        dev_licensing_url = (
-            f"{ctx.obj.dnac_url}/dna/intent/api/v1/licenses/device/{dev_id}/details"
-        )
-        dev_licensing_resp = requests.get(
-            url=dev_licensing_url, headers=headers, verify=False
+        # Named devices are resolved from the cached inventory, or with batched lookups
+        devices = resolve_controller_devices(ctx, device)
+    else:
+        devices = iter_controllers(
+            ctx, lambda client: iter_devices(client, INVENTORY_WORKERS)
         )
-        if dev_licensing_resp.status_code == 200:
-            device_lic_details = dev_licensing_resp.json()
-            table = Table(title="DNAC Network Device Licensing")
-            table.add_column(
-                "Network License Level", justify="left", style="turquoise2"
-            )
-            table.add_column("DNA License Level", justify="left", style="purple")
-            table.add_column("License Validity", justify="center", style="cyan")
-            table.add_column("Virtual Account", justify="center", style="green")
-            table.add_column("Device UDI", justify="center", style="red")
+    # Pull license data for each device. For the whole inventory, pages are fetched with the same paged
+    # (and concurrent) iterator used by 'get inventory devices'. Up to LOOKUP_WINDOW lookups per worker are
+    # in flight at once, and results are collected in inventory order, so memory use doesn't grow with
+    # the inventory.
+    failed = []
+    found = False
+    # Format: deque of (controller name, hostname, future)
+    pending = deque()
+    # Rows are written as each lookup finishes (in inventory order), instead of after the whole sweep
+    columns = controller_columns(ctx, LICENSE_COLUMNS)
+    writer = TableWriter("DNAC Network Device Licensing", columns, output)
 
-            if device_lic_details.get("is_license_expired") == False:
-                lic_validity = "[bold green3]Valid[bold green3]"
-            else:
-                lic_validity = "[bold red]Expired[/bold red]"
+    def write_oldest():
+        controller, hostname, future = pending.popleft()
+        device_lic_details, error = future.result()
+        if error:
+            failed.append((controller, hostname, error))
+            return
 
-            table.add_row(
-                device_lic_details.get("network_license", "N/A"),
-                device_lic_details.get("dna_level", "N/A"),
-                lic_validity,
-                device_lic_details.get("virtual_account_name", "N/A"),
-                device_lic_details.get("udi", "N/A"),
-            )
-
-            console = Console()
-            console.print(table)
-        elif dev_licensing_resp.status_code == 401:
-            click.echo("Unauthorized. Please verify your token is valid.")
-            click.echo(dev_licensing_resp.text)
+        if device_lic_details.get("is_license_expired") == False:
+            lic_validity = Text("Valid", style="bold green3")
         else:
-            click.echo("Could not retrieve license status of network device from DNAC.")
-    else:
-        dnac_devices_url = f"{ctx.obj.dnac_url}/dna/intent/api/v1/network-device"
-        net_devices_resp = requests.get(
-            url=dnac_devices_url, headers=headers, verify=False
-        )
-        if net_devices_resp.status_code == 200:
-            net_devs = net_devices_resp.json()["response"]
-            dev_ids = []
-            for dev in net_devs:
-                dev_ids.append(dev.get("id"))
-            # raise exception if device ID list is empty
-            if not dev_ids:
-                raise click.ClickException("Device IDs could not be found.")
-        elif dev_licensing_resp.status_code == 401:
-            click.echo("Unauthorized. Please verify your token is valid.")
-            click.echo(dev_licensing_resp.text)
-        else:
-            click.echo(
-                "Could not retrieve license status of network device(s) from DNAC."
-            )
-        # initialize table to pretty print data
-        table = Table(title="DNAC Network Device Licensing")
-        table.add_column("Network License Level", justify="left", style="blue")
-        table.add_column("DNA License Level", justify="left", style="purple")
-        table.add_column("License Validity", justify="center", style="cyan")
-        table.add_column("Virtual Account", justify="center", style="green")
-        table.add_column("Device UDI", justify="center", style="red")
-        # Pull license data for each device found in inventory
-        for net_id in dev_ids:
-            dev_licensing_url = (
-                f"{ctx.obj.dnac_url}/dna/intent/api/v1/licenses/device/{net_id}/details"
-            )
-            dev_licensing_resp = requests.get(
-                url=dev_licensing_url, headers=headers, verify=False
-            )
-            if dev_licensing_resp.status_code == 200:
-                device_lic_details = dev_licensing_resp.json()
+            lic_validity = Text("Expired", style="bold red")
 
-                if device_lic_details.get("is_license_expired") == False:
-                    lic_validity = "[bold green3]Valid[bold green3]"
-                else:
-                    lic_validity = "[bold red]Expired[/bold red]"
+        writer.add_row(
+            *controller_cells(controller),
+            device_lic_details.get("network_license", "N/A"),
+            device_lic_details.get("dna_level", "N/A"),
+            lic_validity,
+            device_lic_details.get("virtual_account_name", "N/A"),
+            device_lic_details.get("udi", "N/A"),
+        )
 
-                table.add_row(
-                    device_lic_details.get("network_license", "N/A"),
-                    device_lic_details.get("dna_level", "N/A"),
-                    lic_validity,
-                    device_lic_details.get("virtual_account_name", "N/A"),
-                    device_lic_details.get("udi", "N/A"),
-                )
-            elif dev_licensing_resp.status_code == 401:
-                click.echo("Unauthorized. Please verify your token is valid.")
-                click.echo(dev_licensing_resp.text)
-            else:
-                click.echo(
-                    "Could not retrieve license status of network device(s) from DNAC."
+    with writer, ThreadPoolExecutor(max_workers=workers) as executor:
+        for controller, dev in devices:
+            found = True
+            if len(pending) >= workers * LOOKUP_WINDOW:
+                write_oldest()
+            pending.append(
+                (
+                    controller,
+                    dev.get("hostname", dev.get("id")),
+                    executor.submit(
+                        get_device_license, clients[controller], dev.get("id"), timeout
+                    ),
                 )
+            )
+        # raise exception if no devices were found in inventory
+        if not found:
+            raise click.ClickException("Device IDs could not be found.")
+        while pending:
+            write_oldest()
 
-        console = Console()
-        console.print(table)
+    if failed:
+        # Summarize devices that could not be checked instead of interrupting the table output
+        # (on stderr, so it doesn't end up in CSV/TSV output)
+        click.echo(
+            f"Could not retrieve license status of {len(failed)} network device(s) from DNAC:",
+            err=True,
+        )
+        for controller, hostname, error in failed:
+            if controller is not None:
+                hostname = f"{controller}/{hostname}"
+            click.echo(f"  {hostname}: {error}", err=True)
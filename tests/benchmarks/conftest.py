@@ -0,0 +1,116 @@
+"""
+Fixtures for benchmarking DNAC Sidekick commands against the mock DNAC (tests/mock_dnac.py).
+
+Every benchmark records the command's wall time, the number of requests DNAC received and the peak memory
+allocated while the command ran. Results are printed at the end of the test session, and saved as JSON when
+DNAC_BENCH_OUTPUT is set. Inventories of 500 and 5,000 devices are benchmarked by default; set
+DNAC_BENCH_LARGE=1 to add 50,000 devices.
+"""
+import json
+import os
+import time
+import tracemalloc
+import pytest
+from click.testing import CliRunner
+from dnac_sidekick.cli import dnac_cli
+from tests.mock_dnac import MockDnac
+
+BENCH_SIZES = [500, 5000]
+if os.environ.get("DNAC_BENCH_LARGE"):
+    BENCH_SIZES.append(50000)
+# Client-side rate limits are raised, so benchmarks measure DNAC Sidekick rather than the limiter
+BENCH_RATE_LIMITS = (
+    "intent=100000/100000,command-runner=1000/1000,task=1000/1000,file=1000/1000"
+)
+
+# Results of every benchmark in the session
+# Format: [{"name": "inventory devices", "devices": 500, "seconds": 0.5, "requests": 2, ...}]
+RESULTS = []
+
+
+@pytest.fixture(scope="module", params=BENCH_SIZES, ids=lambda size: f"{size}dev")
+def mock_dnac(request):
+    """Mock DNAC with a given number of devices, shared by every benchmark of that size in a module"""
+    with MockDnac(devices=request.param) as dnac:
+        dnac.devices = request.param
+        yield dnac
+
+
+@pytest.fixture
+def bench_env(monkeypatch, tmp_path):
+    """Point the CLI at the mock DNAC, using an empty cache and a scratch working directory"""
+
+    def configure(dnac: MockDnac):
+        monkeypatch.setenv("DNAC_URL", dnac.url)
+        monkeypatch.setenv("DNAC_USER", "admin")
+        monkeypatch.setenv("DNAC_PASS", "admin")
+        # The CLI logs in to the mock DNAC (which only accepts tokens it issued) and caches the token
+        monkeypatch.delenv("DNAC_TOKEN", raising=False)
+        monkeypatch.setenv("DNAC_CLI_USER", "admin")
+        monkeypatch.setenv("DNAC_CLI_PASS", "admin")
+        monkeypatch.setenv("DNAC_CACHE_DIR", str(tmp_path / "cache"))
+        monkeypatch.setenv("DNAC_RATE_LIMITS", BENCH_RATE_LIMITS)
+        monkeypatch.chdir(tmp_path)
+
+    return configure
+
+
+@pytest.fixture
+def cli_benchmark(mock_dnac, bench_env):
+    """
+    Run a CLI command against the mock DNAC and record how it performed.
+
+    Example usage:
+    >>> cli_benchmark("inventory devices", ["get", "inventory", "devices"])
+    """
+
+    def run(name: str, args: list, input: str = None, dnac: MockDnac = None) -> dict:
+        dnac = dnac or mock_dnac
+        bench_env(dnac)
+        dnac.reset()
+        runner = CliRunner()
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            result = runner.invoke(dnac_cli, args, input=input)
+            seconds = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert result.exit_code == 0, result.output or repr(result.exception)
+        stats = dnac.stats()
+        record = {
+            "name": name,
+            "devices": dnac.devices,
+            "seconds": round(seconds, 3),
+            "requests": stats["requests"],
+            "throttled": stats["throttled"],
+            "peak_memory_mb": round(peak / 1024 / 1024, 2),
+            "endpoints": stats["endpoints"],
+        }
+        RESULTS.append(record)
+        return record
+
+    return run
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not RESULTS:
+        return
+    terminalreporter.section("DNAC Sidekick benchmarks")
+    terminalreporter.write_line(
+        f"{'Command':<40}{'Devices':>9}{'Seconds':>10}{'Requests':>10}{'429s':>7}{'Peak MB':>10}"
+    )
+    for record in sorted(
+        RESULTS, key=lambda record: (record["name"], record["devices"])
+    ):
+        terminalreporter.write_line(
+            f"{record['name']:<40}{record['devices']:>9}{record['seconds']:>10}"
+            f"{record['requests']:>10}{record['throttled']:>7}{record['peak_memory_mb']:>10}"
+        )
+    if os.environ.get("DNAC_BENCH_OUTPUT"):
+        with open(os.environ.get("DNAC_BENCH_OUTPUT"), "w") as outfile:
+            json.dump(RESULTS, outfile, indent=2)
+        terminalreporter.write_line(
+            f"Benchmark results saved at {os.environ.get('DNAC_BENCH_OUTPUT')}"
+        )
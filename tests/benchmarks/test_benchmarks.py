@@ -0,0 +1,170 @@
+import pytest
+from tests.mock_dnac import MockDnac
+
+"""
+Benchmarks for DNAC Sidekick commands, run against a local mock DNAC (see tests/benchmarks/conftest.py).
+
+Run only the benchmarks with:
+    pytest tests/benchmarks -m bench
+"""
+
+# Only run when selected with -m bench (see [tool.pytest.ini_options] in pyproject.toml)
+pytestmark = pytest.mark.bench
+
+
+def test_bench_inventory_devices(cli_benchmark):
+    cli_benchmark(
+        "get inventory devices",
+        ["get", "inventory", "devices", "--output", "ndjson"],
+    )
+
+
+def test_bench_inventory_devices_cached(cli_benchmark):
+    cli_benchmark(
+        "get inventory devices", ["get", "inventory", "devices", "--output", "ndjson"]
+    )
+    record = cli_benchmark(
+        "get inventory devices (cached)",
+        ["get", "inventory", "devices", "--output", "ndjson"],
+    )
+    assert record["requests"] == 0
+
+
+def test_bench_health_devices(cli_benchmark):
+    cli_benchmark("get health devices", ["get", "health", "devices"])
+
+
+@pytest.mark.parametrize("output", ["table", "plain", "csv"])
+def test_bench_health_devices_output(cli_benchmark, output):
+    cli_benchmark(
+        f"get health devices --output {output}",
+        ["get", "health", "devices", "--output", output],
+    )
+
+
+def test_bench_health_devices_filtered(cli_benchmark):
+    cli_benchmark(
+        "get health devices (poor, access)",
+        ["get", "health", "devices", "--health", "poor", "--device-role", "access"],
+    )
+
+
+def test_bench_health_clients(cli_benchmark):
+    cli_benchmark("get health clients", ["get", "health", "clients"])
+
+
+def test_bench_health_clients_by_site(cli_benchmark):
+    cli_benchmark(
+        "get health clients --by-site", ["get", "health", "clients", "--by-site"]
+    )
+
+
+def test_bench_licenses(cli_benchmark):
+    record = cli_benchmark("get licenses", ["get", "licenses", "--workers", "16"])
+    assert record["endpoints"]["GET /dna/intent/api/v1/licenses/device/details"] == (
+        record["devices"]
+    )
+
+
+def test_bench_licenses_csv(cli_benchmark):
+    cli_benchmark(
+        "get licenses --output csv",
+        ["get", "licenses", "--workers", "16", "--output", "csv"],
+    )
+
+
+def test_bench_command_runner(cli_benchmark):
+    cli_benchmark(
+        "command-runner",
+        [
+            "command-runner",
+            "--device-regex",
+            "^dev1",
+            "--command",
+            "show version",
+            "--command",
+            "show clock",
+        ],
+    )
+
+
+def test_bench_generate_pyats_testbed(cli_benchmark):
+    cli_benchmark("generate pyats-testbed", ["generate", "pyats-testbed"], input="y\n")
+
+
+def test_bench_generate_ansible_inventory(cli_benchmark):
+    cli_benchmark("generate ansible-inventory", ["generate", "ansible-inventory"])
+
+
+@pytest.mark.parametrize("decoder", ["json", "orjson"])
+@pytest.mark.parametrize(
+    "name,args",
+    [
+        (
+            "get inventory devices",
+            ["get", "inventory", "devices", "--output", "ndjson"],
+        ),
+        ("get health devices", ["get", "health", "devices"]),
+        ("generate ansible-inventory", ["generate", "ansible-inventory"]),
+    ],
+    ids=["inventory", "health", "ansible"],
+)
+def test_bench_json_decoder(cli_benchmark, monkeypatch, decoder, name, args):
+    """Compare the standard library's JSON decoder with orjson (pip install dnac-sidekick[fast])"""
+    if decoder == "orjson":
+        pytest.importorskip("orjson")
+    monkeypatch.setenv("DNAC_JSON_DECODER", decoder)
+    cli_benchmark(f"{name} [{decoder}]", args)
+
+
+@pytest.fixture(scope="module")
+def second_dnac(mock_dnac):
+    """Second mock DNAC cluster, the same size as mock_dnac but with different devices"""
+    with MockDnac(devices=mock_dnac.devices, prefix="west-") as dnac:
+        dnac.devices = mock_dnac.devices
+        yield dnac
+
+
+@pytest.mark.parametrize(
+    "name,args",
+    [
+        (
+            "get inventory devices",
+            ["get", "inventory", "devices", "--output", "ndjson"],
+        ),
+        ("get health devices", ["get", "health", "devices", "--output", "csv"]),
+        ("generate ansible-inventory", ["generate", "ansible-inventory"]),
+    ],
+    ids=["inventory", "health", "ansible"],
+)
+def test_bench_multiple_controllers(
+    cli_benchmark, monkeypatch, mock_dnac, second_dnac, name, args
+):
+    """Two controllers are queried concurrently, so this should take about as long as a single controller"""
+    monkeypatch.setenv("DNAC_EAST_URL", mock_dnac.url)
+    monkeypatch.setenv("DNAC_WEST_URL", second_dnac.url)
+    second_dnac.reset()
+    cli_benchmark(
+        f"{name} (2 controllers)",
+        [args[0], "--controllers", "east,west", *args[1:]],
+    )
+    # Requests to the second controller aren't counted by cli_benchmark, so check it was queried too
+    assert second_dnac.stats()["requests"] > 0
+
+
+@pytest.fixture(scope="module")
+def throttled_dnac():
+    """Mock DNAC that answers every 10th request with HTTP 429"""
+    with MockDnac(devices=5000, throttle_every=10, retry_after=0.5) as dnac:
+        dnac.devices = 5000
+        yield dnac
+
+
+@pytest.mark.parametrize("mock_dnac", [500], indirect=True, ids=["500dev"])
+def test_bench_inventory_devices_throttled(cli_benchmark, throttled_dnac):
+    record = cli_benchmark(
+        "get inventory devices (throttled)",
+        ["get", "inventory", "devices", "--output", "ndjson"],
+        dnac=throttled_dnac,
+    )
+    assert record["throttled"] > 0
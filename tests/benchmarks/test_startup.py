@@ -0,0 +1,54 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+import pytest
+from tests.benchmarks.conftest import RESULTS
+from tests.test_offline import import_times
+
+"""
+Startup benchmarks. The CLI is often run many times in a row (ex. from cron jobs or Ansible), so importing it
+shouldn't load any command modules or heavy libraries until a command that needs them runs.
+
+The import time budget can be changed with DNAC_STARTUP_BUDGET_MS (ex. on slow CI runners).
+"""
+
+STARTUP_BUDGET_MS = float(os.environ.get("DNAC_STARTUP_BUDGET_MS", 120))
+STARTUP_RUNS = 5
+
+
+# Only run when selected with -m bench (see [tool.pytest.ini_options] in pyproject.toml). The check that
+# startup skips heavy imports is cheap, so it runs with the default tests (see tests/test_offline.py).
+@pytest.mark.bench
+def test_bench_startup():
+    # Best of several runs, since a single run is easily skewed by the OS
+    import_ms = min(
+        import_times("import dnac_sidekick.cli")["dnac_sidekick.cli"] / 1000
+        for _ in range(STARTUP_RUNS)
+    )
+    help_seconds = []
+    for _ in range(STARTUP_RUNS):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "dnac_sidekick.cli", "--help"],
+            capture_output=True,
+            check=True,
+        )
+        help_seconds.append(time.perf_counter() - start)
+    RESULTS.append(
+        {
+            "name": "startup (--help)",
+            "devices": 0,
+            "seconds": round(statistics.median(help_seconds), 3),
+            "requests": 0,
+            "throttled": 0,
+            "peak_memory_mb": 0,
+            "import_ms": round(import_ms, 1),
+            "endpoints": {},
+        }
+    )
+    if import_ms > STARTUP_BUDGET_MS:
+        pytest.fail(
+            f"Importing dnac_sidekick.cli took {import_ms:.1f}ms (budget is {STARTUP_BUDGET_MS:.0f}ms)"
+        )
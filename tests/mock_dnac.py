@@ -0,0 +1,611 @@
+"""
+Local stand-in for the DNA Center API, used to test and benchmark DNAC Sidekick without a live controller.
+
+Implements the endpoints used by the inventory, health, licenses, command runner and topology commands,
+with a configurable number of devices, sites and clients, injected latency and throttling (HTTP 429).
+
+Run it on its own with:
+    python -m tests.mock_dnac --devices 5000 --latency 0.05
+
+Or start it from a test (in a separate process, so it doesn't skew the CLI's memory usage):
+    with MockDnac(devices=5000) as dnac:
+        os.environ["DNAC_URL"] = dnac.url
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+from urllib.parse import parse_qs, urlparse
+import click
+import requests
+
+# DNAC returns at most this many records per page
+MAX_PAGE_SIZE = 500
+# Number of times a command runner task is checked before it's reported as finished
+TASK_CHECKS_TO_FINISH = 2
+# Every Nth device isn't assigned to a site (like devices that were just discovered)
+UNASSIGNED_EVERY = 7
+DEVICE_FAMILIES = (
+    ("Switches and Hubs", "Cisco Catalyst 9300 Switch", "ACCESS"),
+    ("Routers", "Cisco Catalyst 8300 Router", "BORDER ROUTER"),
+    ("Switches and Hubs", "Cisco Catalyst 9500 Switch", "DISTRIBUTION"),
+    ("Wireless Controller", "Cisco Catalyst 9800 Wireless Controller", "ACCESS"),
+)
+CLIENT_CATEGORIES = ("WIRED", "WIRELESS")
+# Overall health scores in each device-health 'health' filter band
+HEALTH_BANDS = {"POOR": range(1, 4), "FAIR": range(4, 8), "GOOD": range(8, 11)}
+
+
+class MockDnacState(object):
+    """Sites, devices and tasks served by the mock DNAC, plus counters for the requests it received"""
+
+    def __init__(
+        self,
+        devices: int = 500,
+        areas: int = 10,
+        buildings: int = 2,
+        floors: int = 2,
+        clients: int = 1000,
+        latency: float = 0,
+        throttle_every: int = 0,
+        retry_after: float = 1,
+        token_lifetime: float = 3600,
+        prefix: str = "",
+    ):
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.token_lifetime = token_lifetime
+        # Tokens handed out by the auth endpoint. Format: {token: expiry time}
+        self.tokens = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        # Format: {"GET /dna/intent/api/v1/network-device": 0}
+        self.endpoints = {}
+        self.tasks = {}
+
+        # Site hierarchy: Global -> area -> building -> floor. Devices are assigned to floors.
+        self.sites = []
+        floor_ids = []
+        global_id = str(uuid.uuid5(uuid.NAMESPACE_URL, "Global"))
+        for area in range(areas):
+            area_name = f"Area {area}"
+            area_id = str(uuid.uuid5(uuid.NAMESPACE_URL, area_name))
+            self.sites.append(self._site(area_id, area_name, global_id, "Global"))
+            for building in range(buildings):
+                building_name = f"BLD-{area}-{building}"
+                building_id = str(uuid.uuid5(uuid.NAMESPACE_URL, building_name))
+                self.sites.append(
+                    self._site(
+                        building_id, building_name, area_id, f"Global/{area_name}"
+                    )
+                )
+                for floor in range(floors):
+                    floor_id = str(
+                        uuid.uuid5(uuid.NAMESPACE_URL, f"{building_name}/{floor}")
+                    )
+                    floor_ids.append(floor_id)
+                    self.sites.append(
+                        self._site(
+                            floor_id,
+                            f"Floor {floor + 1}",
+                            building_id,
+                            f"Global/{area_name}/{building_name}",
+                        )
+                    )
+        self.site_ids = {site["id"] for site in self.sites}
+        # Format: {site ID: "Global/Area 1/BLD-1-0/Floor 1"}
+        self.site_hierarchy = {
+            site["id"]: site["groupNameHierarchy"] for site in self.sites
+        }
+
+        self.devices = []
+        for idx in range(devices):
+            family, platform, role = DEVICE_FAMILIES[idx % len(DEVICE_FAMILIES)]
+            site_id = None
+            if floor_ids and idx % UNASSIGNED_EVERY:
+                site_id = floor_ids[idx % len(floor_ids)]
+            self.devices.append(
+                {
+                    "id": str(uuid.uuid5(uuid.NAMESPACE_URL, f"{prefix}device-{idx}")),
+                    "hostname": f"{prefix}dev{idx}.abc.inc",
+                    "managementIpAddress": f"10.{idx // 65536 % 256}.{idx // 256 % 256}.{idx % 256}",
+                    "serialNumber": f"FOC{idx:08d}",
+                    "platformId": platform.split()[-2],
+                    "type": platform,
+                    "family": family,
+                    "role": role,
+                    "softwareType": "IOS-XE",
+                    "softwareVersion": "17.9.3",
+                    "upTime": f"{idx % 300} days, 1:02:03.00",
+                    "reachabilityStatus": "Reachable",
+                    "siteId": site_id,
+                }
+            )
+        self.devices_by_id = {dev["id"]: dev for dev in self.devices}
+        self.clients = clients
+
+    @staticmethod
+    def _site(site_id: str, name: str, parent_id: str, parent_hierarchy: str) -> dict:
+        return {
+            "id": site_id,
+            "name": name,
+            "parentId": parent_id,
+            "groupNameHierarchy": f"{parent_hierarchy}/{name}",
+        }
+
+    def count(self, endpoint: str, throttled: bool = False):
+        with self.lock:
+            self.requests += 1
+            self.endpoints[endpoint] = self.endpoints.get(endpoint, 0) + 1
+            if throttled:
+                self.throttled += 1
+
+    def issue_token(self) -> str:
+        token = str(uuid.uuid4())
+        with self.lock:
+            self.tokens[token] = time.time() + self.token_lifetime
+        return token
+
+    def is_valid_token(self, token: str) -> bool:
+        with self.lock:
+            return self.tokens.get(token, 0) > time.time()
+
+    def should_throttle(self) -> bool:
+        if not self.throttle_every:
+            return False
+        with self.lock:
+            return (self.requests + 1) % self.throttle_every == 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "endpoints": dict(self.endpoints),
+            }
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.throttled = 0
+            self.endpoints = {}
+
+
+def health_role(device: dict) -> str:
+    """Role used by the device-health 'deviceRole' filter (CORE, DISTRIBUTION, ACCESS, ROUTER, WLC or AP)"""
+    if device["family"] == "Wireless Controller":
+        return "WLC"
+    if "ROUTER" in device["role"]:
+        return "ROUTER"
+    return device["role"]
+
+
+def device_health(device: dict, location: str = None) -> dict:
+    """Build a device-health record for a device, with stable but varied values"""
+    seed = int(device["serialNumber"][3:])
+    return {
+        "name": device["hostname"],
+        "model": device["type"],
+        "ipAddress": device["managementIpAddress"],
+        "deviceFamily": device["family"],
+        "deviceType": device["type"],
+        "location": location,
+        "overallHealth": seed % 11,
+        "cpuUlitilization": (seed * 7) % 100 + 0.25,
+        "memoryUtilization": (seed * 13) % 100 + 0.5,
+    }
+
+
+class MockDnacHandler(BaseHTTPRequestHandler):
+    """Routes requests to the mock DNAC endpoints. The server's state is available at self.server.state."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, so don't let Nagle's algorithm hold back the body
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self) -> MockDnacState:
+        return self.server.state
+
+    def send_json(self, status: int, body, headers: Dict[str, str] = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def handle_request(self, method: str):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        body = self.read_json() if method == "POST" else {}
+        # Internal endpoints used by tests, which aren't counted or throttled
+        if url.path == "/_mock/stats":
+            return self.send_json(200, self.state.stats())
+        if url.path == "/_mock/reset":
+            self.state.reset()
+            return self.send_json(200, {})
+
+        # Group requests by endpoint (without IDs), ex. "GET /api/v1/task"
+        endpoint = f"{method} {re.sub(r'/[0-9a-f-]{36}', '', url.path)}"
+        if self.state.should_throttle():
+            self.state.count(endpoint, throttled=True)
+            return self.send_json(
+                429,
+                {"error": "Too many requests"},
+                {"Retry-After": str(self.state.retry_after)},
+            )
+        self.state.count(endpoint)
+        if self.state.latency:
+            time.sleep(self.state.latency)
+
+        if url.path == "/dna/system/api/v1/auth/token":
+            if not self.headers.get("Authorization", "").startswith("Basic "):
+                return self.send_json(401, {"error": "Unauthorized"})
+            return self.send_json(200, {"Token": self.state.issue_token()})
+        if not self.state.is_valid_token(self.headers.get("X-Auth-Token")):
+            return self.send_json(401, {"error": "Token expired or invalid"})
+        for pattern, route in ROUTES.get(method, []):
+            match = re.fullmatch(pattern, url.path)
+            if match:
+                return route(self, params, body, *match.groups())
+        self.send_json(404, {"error": f"{method} {url.path} not found"})
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def device_count(self, params: dict, body: dict):
+        self.send_json(200, {"response": len(self.state.devices)})
+
+    def network_devices(self, params: dict, body: dict):
+        devices = self.state.devices
+        if "id" in params:
+            dev_ids = ",".join(params["id"]).split(",")
+            devices = [
+                self.state.devices_by_id[dev_id]
+                for dev_id in dev_ids
+                if dev_id in self.state.devices_by_id
+            ]
+        for field in ("hostname", "managementIpAddress", "serialNumber"):
+            if field in params:
+                values = set(params[field])
+                devices = [dev for dev in devices if dev[field] in values]
+        # Offsets are 1-based, like DNAC
+        offset = int(params.get("offset", ["1"])[0])
+        limit = min(int(params.get("limit", [MAX_PAGE_SIZE])[0]), MAX_PAGE_SIZE)
+        self.send_json(200, {"response": devices[offset - 1 : offset - 1 + limit]})
+
+    def device_license(self, params: dict, body: dict, dev_id: str):
+        device = self.state.devices_by_id.get(dev_id)
+        if device is None:
+            return self.send_json(404, {"error": f"Device {dev_id} not found"})
+        self.send_json(
+            200,
+            {
+                "device_uuid": dev_id,
+                "device_name": device["hostname"],
+                "network_license": "network-advantage",
+                "dna_level": "dna-advantage",
+                "is_license_expired": False,
+                "virtual_account_name": "DEFAULT",
+            },
+        )
+
+    def device_health(self, params: dict, body: dict):
+        records = [
+            device_health(dev, self.state.site_hierarchy.get(dev["siteId"]))
+            for dev in self.state.devices
+            if params.get("deviceRole", [health_role(dev)])[0].upper()
+            == health_role(dev)
+        ]
+        # Filtering by site includes devices in its child sites
+        if "siteId" in params:
+            site = self.state.site_hierarchy.get(params["siteId"][0], "")
+            records = [
+                record
+                for record in records
+                if site
+                and record["location"]
+                and f"{record['location']}/".startswith(f"{site}/")
+            ]
+        if "health" in params:
+            band = HEALTH_BANDS.get(params["health"][0].upper(), range(0))
+            records = [record for record in records if record["overallHealth"] in band]
+        offset = int(params.get("offset", ["1"])[0])
+        limit = min(int(params.get("limit", [MAX_PAGE_SIZE])[0]), MAX_PAGE_SIZE)
+        self.send_json(
+            200,
+            {
+                "version": "1.0",
+                "totalCount": len(records),
+                "response": records[offset - 1 : offset - 1 + limit],
+            },
+        )
+
+    def client_health(self, params: dict, body: dict):
+        site_id = params.get("siteId", ["global"])[0]
+        if site_id == "global":
+            clients, score = self.state.clients, 85
+        elif site_id in self.state.site_hierarchy:
+            # Stable but varied client counts and scores per site
+            seed = int(uuid.UUID(site_id)) % 1000
+            clients, score = seed % 200, 60 + seed % 40
+        else:
+            self.send_json(200, {"response": []})
+            return
+        per_category = clients // len(CLIENT_CATEGORIES)
+        score_detail = [
+            {
+                "scoreCategory": {"value": "ALL"},
+                "clientCount": clients,
+                "scoreValue": min(score + 2, 100) if clients else -1,
+            }
+        ]
+        for category in CLIENT_CATEGORIES:
+            score_detail.append(
+                {
+                    "scoreCategory": {"value": category},
+                    "clientCount": per_category,
+                    "scoreValue": score if per_category else -1,
+                }
+            )
+        self.send_json(
+            200, {"response": [{"siteId": site_id, "scoreDetail": score_detail}]}
+        )
+
+    def site_topology(self, params: dict, body: dict):
+        self.send_json(200, {"response": {"sites": self.state.sites}})
+
+    def physical_topology(self, params: dict, body: dict):
+        nodes = []
+        for dev in self.state.devices:
+            additional_info = {"macAddress": "00:00:00:00:00:00"}
+            if dev["siteId"]:
+                additional_info["siteid"] = dev["siteId"]
+            nodes.append(
+                {
+                    "id": dev["id"],
+                    "label": dev["hostname"],
+                    "ip": dev["managementIpAddress"],
+                    "deviceType": dev["type"],
+                    "family": dev["family"],
+                    "platformId": dev["platformId"],
+                    "role": dev["role"],
+                    "softwareVersion": dev["softwareVersion"],
+                    "nodeType": "device",
+                    "additionalInfo": additional_info,
+                }
+            )
+        self.send_json(200, {"response": {"nodes": nodes, "links": []}})
+
+    def device_credentials(self, params: dict, body: dict):
+        self.send_json(
+            200,
+            {
+                "cli": [{"username": "admin", "id": str(uuid.uuid4())}],
+                "snmp_v2_read": [],
+                "snmp_v2_write": [],
+            },
+        )
+
+    def read_request(self, params: dict, body: dict):
+        task_id = str(uuid.uuid4())
+        with self.state.lock:
+            self.state.tasks[task_id] = {"checks": 0, "request": body}
+        self.send_json(
+            202, {"response": {"taskId": task_id, "url": f"/api/v1/task/{task_id}"}}
+        )
+
+    def task(self, params: dict, body: dict, task_id: str):
+        task = self.state.tasks.get(task_id)
+        if task is None:
+            return self.send_json(404, {"error": f"Task {task_id} not found"})
+        with self.state.lock:
+            task["checks"] += 1
+            finished = task["checks"] > TASK_CHECKS_TO_FINISH
+        response = {
+            "id": task_id,
+            "isError": False,
+            "progress": "CLI Runner request creation",
+        }
+        commands = task["request"].get("commands", [])
+        if finished and any(cmd.startswith("fail") for cmd in commands):
+            # Commands starting with 'fail' (ex. 'fail now') make the whole task fail, like DNAC does when
+            # a request can't be run
+            response.update(
+                {
+                    "endTime": int(time.time() * 1000),
+                    "isError": True,
+                    "failureReason": "Command runner request failed",
+                }
+            )
+        elif finished:
+            # The file ID is the task ID, so the file endpoint can find the original request
+            response.update(
+                {
+                    "endTime": int(time.time() * 1000),
+                    "progress": json.dumps({"fileId": task_id}),
+                }
+            )
+        self.send_json(200, {"response": response, "version": "1.0"})
+
+    def command_file(self, params: dict, body: dict, file_id: str):
+        task = self.state.tasks.get(file_id)
+        if task is None:
+            return self.send_json(404, {"error": f"File {file_id} not found"})
+        request = task["request"]
+        output = []
+        for dev_id in request.get("deviceUuids", []):
+            hostname = self.state.devices_by_id.get(dev_id, {}).get("hostname", dev_id)
+            output.append(
+                {
+                    "deviceUuid": dev_id,
+                    "commandResponses": {
+                        "SUCCESS": {
+                            cmd: f"{hostname}#{cmd}\nOutput of '{cmd}'"
+                            for cmd in request.get("commands", [])
+                        },
+                        "FAILURE": {},
+                        "BLACKLISTED": {},
+                    },
+                }
+            )
+        self.send_json(200, output)
+
+
+# Format: {method: [(path regex, handler)]}
+ROUTES = {
+    "GET": [
+        (r"/dna/intent/api/v1/network-device/count", MockDnacHandler.device_count),
+        (r"/dna/intent/api/v1/network-device", MockDnacHandler.network_devices),
+        (
+            r"/dna/intent/api/v1/licenses/device/([^/]+)/details",
+            MockDnacHandler.device_license,
+        ),
+        (r"/dna/intent/api/v1/device-health", MockDnacHandler.device_health),
+        (r"/dna/intent/api/v1/client-health", MockDnacHandler.client_health),
+        (r"/dna/intent/api/v1/topology/site-topology", MockDnacHandler.site_topology),
+        (
+            r"/dna/intent/api/v1/topology/physical-topology",
+            MockDnacHandler.physical_topology,
+        ),
+        (r"/dna/intent/api/v1/device-credential", MockDnacHandler.device_credentials),
+        (r"/api/v1/task/([^/]+)", MockDnacHandler.task),
+        (r"/dna/intent/api/v1/file/([^/]+)", MockDnacHandler.command_file),
+    ],
+    "POST": [
+        (
+            r"/dna/intent/api/v1/network-device-poller/cli/read-request",
+            MockDnacHandler.read_request,
+        ),
+    ],
+}
+
+
+class MockDnac(object):
+    """
+    Runs the mock DNAC in a child process for the duration of a 'with' block.
+
+    Options are the same as MockDnacState (ex. MockDnac(devices=5000, latency=0.05, throttle_every=50)).
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self.process = None
+        self.url = None
+
+    def start(self) -> "MockDnac":
+        args = [sys.executable, "-m", "tests.mock_dnac", "--port", "0"]
+        for option, value in self.options.items():
+            args.extend([f"--{option.replace('_', '-')}", str(value)])
+        repo_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+        self.process = subprocess.Popen(
+            args, cwd=repo_dir, stdout=subprocess.PIPE, text=True
+        )
+        # The server prints its URL once it's ready to accept requests
+        self.url = self.process.stdout.readline().split()[-1]
+        return self
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            self.process.wait()
+            self.process.stdout.close()
+            self.process = None
+
+    def stats(self) -> dict:
+        """Requests received since the server started (or was last reset), in total and per endpoint"""
+        return requests.get(f"{self.url}/_mock/stats").json()
+
+    def reset(self):
+        requests.post(f"{self.url}/_mock/reset")
+
+    def __enter__(self) -> "MockDnac":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=int, default=8443, show_default=True)
+@click.option("--devices", type=int, default=500, show_default=True)
+@click.option("--areas", type=int, default=10, show_default=True)
+@click.option(
+    "--buildings", type=int, default=2, show_default=True, help="Buildings per area."
+)
+@click.option(
+    "--floors", type=int, default=2, show_default=True, help="Floors per building."
+)
+@click.option("--clients", type=int, default=1000, show_default=True)
+@click.option(
+    "--latency",
+    type=float,
+    default=0,
+    show_default=True,
+    help="Seconds to wait before answering each request.",
+)
+@click.option(
+    "--throttle-every",
+    type=int,
+    default=0,
+    show_default=True,
+    help="Answer every Nth request with HTTP 429 (0 to never throttle).",
+)
+@click.option(
+    "--retry-after",
+    type=float,
+    default=1,
+    show_default=True,
+    help="Retry-After header sent with throttled requests.",
+)
+@click.option(
+    "--token-lifetime",
+    type=float,
+    default=3600,
+    show_default=True,
+    help="Seconds that auth tokens stay valid.",
+)
+@click.option(
+    "--prefix",
+    default="",
+    help="Prefix for device hostnames and IDs, so several mock controllers serve different devices.",
+)
+def main(host, port, **options):
+    """Serve the mock DNAC API over HTTP."""
+    server = ThreadingHTTPServer((host, port), MockDnacHandler)
+    server.daemon_threads = True
+    server.state = MockDnacState(**options)
+    click.echo(f"Mock DNAC listening on http://{host}:{server.server_port}")
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
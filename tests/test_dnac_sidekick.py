@@ -35,6 +35,31 @@ def test_dnac_login():
     assert result.exit_code == 0
 
 
+def test_dnac_get_devices_without_token(tmp_path):
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    # Logs in with DNAC_USER/DNAC_PASS and caches the token
+    result = runner.invoke(
+        dnac_cli,
+        ["get", "inventory", "devices"],
+        env={"DNAC_TOKEN": None, "DNAC_CACHE_DIR": str(tmp_path)},
+    )
+    assert result.exit_code == 0
+    assert (tmp_path / "tokens.json").exists()
+
+
+def test_dnac_get_devices_expired_token(tmp_path):
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    # Rejected token is replaced by logging in again
+    result = runner.invoke(
+        dnac_cli,
+        ["get", "inventory", "devices"],
+        env={"DNAC_TOKEN": "expired-token", "DNAC_CACHE_DIR": str(tmp_path)},
+    )
+    assert result.exit_code == 0
+
+
 def test_dnac_get_devices_table_output():
     requests.packages.urllib3.disable_warnings()
     runner = CliRunner()
@@ -51,6 +76,108 @@ def test_dnac_get_devices_json_output():
     assert result.exit_code == 0
 
 
+def test_dnac_get_devices_ndjson_output():
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    result = runner.invoke(
+        dnac_cli, ["get", "inventory", "devices", "--output", "ndjson"]
+    )
+    assert result.exit_code == 0
+
+
+def test_dnac_get_devices_csv_output():
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    result = runner.invoke(dnac_cli, ["get", "inventory", "devices", "--output", "csv"])
+    assert result.exit_code == 0
+
+
+def test_dnac_get_devices_concurrent_pages():
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    result = runner.invoke(dnac_cli, ["get", "inventory", "devices", "--workers", "2"])
+    assert result.exit_code == 0
+
+
+def test_dnac_get_devices_cached():
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    result = runner.invoke(dnac_cli, ["get", "--refresh", "inventory", "devices"])
+    assert result.exit_code == 0
+    result = runner.invoke(dnac_cli, ["get", "--offline", "inventory", "devices"])
+    assert result.exit_code == 0
+
+
+def test_dnac_get_devices_incremental_sync():
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    result = runner.invoke(dnac_cli, ["get", "inventory", "devices"])
+    assert result.exit_code == 0
+    result = runner.invoke(
+        dnac_cli,
+        ["get", "--incremental", "--cache-ttl", "0", "inventory", "devices"],
+    )
+    assert result.exit_code == 0
+    assert "Incremental sync:" in result.output
+    assert "1 incremental sync(s)" in result.output
+
+
+def test_dnac_get_devices_profile(tmp_path):
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    result = runner.invoke(
+        dnac_cli,
+        [
+            "--profile-output",
+            str(tmp_path / "profile.prom"),
+            "--profile-format",
+            "prometheus",
+            "get",
+            "--refresh",
+            "inventory",
+            "devices",
+        ],
+    )
+    assert result.exit_code == 0
+    with open(tmp_path / "profile.prom") as infile:
+        assert "dnac_sidekick_requests_total" in infile.read()
+
+
+def test_dnac_get_devices_controller_profile():
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    result = runner.invoke(
+        dnac_cli,
+        [
+            "get",
+            "--controllers",
+            "sandbox",
+            "inventory",
+            "devices",
+            "--output",
+            "csv",
+        ],
+        env={"DNAC_SANDBOX_URL": os.environ.get("DNAC_URL")},
+    )
+    assert result.exit_code == 0
+    assert "Controller,Hostname,Device Type" in result.output
+
+
+def test_dnac_get_devices_duplicate_controllers():
+    runner = CliRunner()
+    # Profiles pointing at the same DNAC are rejected before any request is sent
+    result = runner.invoke(
+        dnac_cli,
+        ["get", "--controllers", "east,west", "inventory", "devices"],
+        env={
+            "DNAC_EAST_URL": os.environ.get("DNAC_URL"),
+            "DNAC_WEST_URL": os.environ.get("DNAC_URL"),
+        },
+    )
+    assert result.exit_code == 2
+    assert "both point at" in result.output
+
+
 def test_dnac_get_device_by_hostname():
     requests.packages.urllib3.disable_warnings()
     runner = CliRunner()
@@ -60,6 +187,24 @@ def test_dnac_get_device_by_hostname():
     assert result.exit_code == 0
 
 
+def test_dnac_get_devices_by_hostname_and_ip():
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    result = runner.invoke(
+        dnac_cli,
+        [
+            "get",
+            "inventory",
+            "devices",
+            "--hostname",
+            "leaf1.abc.inc",
+            "--hostname",
+            "10.10.20.80",
+        ],
+    )
+    assert result.exit_code == 0
+
+
 def test_dnac_get_device_health():
     requests.packages.urllib3.disable_warnings()
     runner = CliRunner()
@@ -67,6 +212,23 @@ def test_dnac_get_device_health():
     assert result.exit_code == 0
 
 
+def test_dnac_get_device_health_filtered():
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    result = runner.invoke(
+        dnac_cli,
+        ["get", "health", "devices", "--health", "good", "--device-role", "access"],
+    )
+    assert result.exit_code == 0
+
+
+def test_dnac_get_device_health_tsv_output():
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    result = runner.invoke(dnac_cli, ["get", "health", "devices", "--output", "tsv"])
+    assert result.exit_code == 0
+
+
 def test_dnac_get_client_health():
     requests.packages.urllib3.disable_warnings()
     runner = CliRunner()
@@ -74,6 +236,48 @@ def test_dnac_get_client_health():
     assert result.exit_code == 0
 
 
+def test_dnac_get_client_health_by_site():
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    result = runner.invoke(dnac_cli, ["get", "health", "clients", "--by-site"])
+    assert result.exit_code == 0
+    assert "DNAC Client Health By Site" in result.output
+
+
+def test_dnac_record_health_trends(tmp_path):
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    history_db = str(tmp_path / "health.db")
+    result = runner.invoke(
+        dnac_cli, ["get", "health", "record", "--history-db", history_db]
+    )
+    assert result.exit_code == 0
+    assert "Recorded health for" in result.output
+    # Nothing changed between the snapshots, so only the first one stores values
+    result = runner.invoke(
+        dnac_cli,
+        ["get", "health", "watch", "--count", "1", "--history-db", history_db],
+    )
+    assert result.exit_code == 0
+    assert "0 changed" in result.output
+    result = runner.invoke(
+        dnac_cli,
+        [
+            "get",
+            "health",
+            "trends",
+            "--report",
+            "top-cpu",
+            "--since",
+            "1h",
+            "--history-db",
+            history_db,
+        ],
+    )
+    assert result.exit_code == 0
+    assert "Top CPU Utilization" in result.output
+
+
 def test_dnac_command_runner():
     requests.packages.urllib3.disable_warnings()
     runner = CliRunner()
@@ -85,6 +289,27 @@ def test_dnac_command_runner():
     assert result.exit_code == 0
 
 
+def test_dnac_command_runner_multiple_devices():
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    result = runner.invoke(
+        dnac_cli,
+        [
+            "command-runner",
+            "--device",
+            "spine1.abc.inc",
+            "--device",
+            "leaf1.abc.inc",
+            "--command",
+            "show version",
+            "--command",
+            "show clock",
+        ],
+    )
+    time.sleep(3)
+    assert result.exit_code == 0
+
+
 def test_dnac_get_licenses():
     requests.packages.urllib3.disable_warnings()
     runner = CliRunner()
@@ -96,6 +321,25 @@ def test_dnac_get_licenses():
     assert result.exit_code == 0
 
 
+def test_dnac_get_licenses_concurrent():
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    result = runner.invoke(
+        dnac_cli,
+        ["get", "licenses", "--workers", "4", "--timeout", "10"],
+    )
+    time.sleep(3)
+    assert result.exit_code == 0
+
+
+def test_dnac_get_licenses_plain_output():
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    result = runner.invoke(dnac_cli, ["get", "licenses", "--output", "plain"])
+    time.sleep(3)
+    assert result.exit_code == 0
+
+
 def test_dnac_get_device_licenses():
     requests.packages.urllib3.disable_warnings()
     runner = CliRunner()
@@ -107,6 +351,17 @@ def test_dnac_get_device_licenses():
     assert result.exit_code == 0
 
 
+def test_dnac_get_licenses_multiple_devices():
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    result = runner.invoke(
+        dnac_cli,
+        ["get", "licenses", "--device", "spine1.abc.inc", "--device", "leaf1.abc.inc"],
+    )
+    time.sleep(3)
+    assert result.exit_code == 0
+
+
 def test_dnac_generate_pyats_testbed():
     requests.packages.urllib3.disable_warnings()
     runner = CliRunner()
@@ -116,8 +371,39 @@ def test_dnac_generate_pyats_testbed():
     assert result.exit_code == 0
 
 
+def test_dnac_generate_pyats_testbed_shard_by_family():
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    result = runner.invoke(
+        dnac_cli,
+        ["generate", "pyats-testbed", "--shard-by", "family"],
+        input="admin\nadmin\ny\n",
+    )
+    assert result.exit_code == 0
+
+
 def test_dnac_generate_ansible_inventory():
     requests.packages.urllib3.disable_warnings()
     runner = CliRunner()
     result = runner.invoke(dnac_cli, ["generate", "ansible-inventory"])
     assert result.exit_code == 0
+
+
+def test_dnac_generate_ansible_inventory_controller_profile():
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    result = runner.invoke(
+        dnac_cli,
+        ["generate", "--controllers", "sandbox", "ansible-inventory"],
+        env={"DNAC_SANDBOX_URL": os.environ.get("DNAC_URL")},
+    )
+    assert result.exit_code == 0
+
+
+def test_dnac_generate_ansible_inventory_max_depth():
+    requests.packages.urllib3.disable_warnings()
+    runner = CliRunner()
+    result = runner.invoke(
+        dnac_cli, ["generate", "ansible-inventory", "--max-depth", "2"]
+    )
+    assert result.exit_code == 0
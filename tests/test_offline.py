@@ -0,0 +1,466 @@
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from unittest.mock import Mock
+import click
+import pytest
+from click.testing import CliRunner
+from dnac_sidekick.cli import dnac_cli
+from dnac_sidekick.device_commands.commands import get_devices_by_regex
+from dnac_sidekick.generate.commands import add_site_groups, render_testbed
+from dnac_sidekick.helpers.controllers import CONTROLLERS_KEY, iter_controllers
+from dnac_sidekick.health.commands import get_site_client_health
+from dnac_sidekick.health.history import HealthHistory
+from dnac_sidekick.helpers.cache import ResponseCache
+from dnac_sidekick.helpers.profiling import percentile
+from dnac_sidekick.helpers.records import Site, TopologyNode
+from dnac_sidekick.helpers.tokens import TokenCache
+from dnac_sidekick.inventory.index import INVENTORY_PATH
+from tests.mock_dnac import MockDnac
+
+"""
+Tests that run against the local mock DNAC (tests/mock_dnac.py) instead of the DevNet sandbox,
+so they can check behavior that needs control over DNAC's data (ex. devices changing between runs).
+"""
+
+# Libraries that are only needed once a command talks to DNAC or renders output
+HEAVY_MODULES = ("requests", "urllib3", "rich", "jinja2", "yaml", "dotenv")
+
+
+def import_times(statement: str) -> dict:
+    """
+    Run a statement in a fresh interpreter with 'python -X importtime'.
+    Returns the cumulative import time (in microseconds) of every module it imported.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # Format: "import time:       510 |      25514 |   click"
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        times[module.strip()] = int(cumulative)
+    return times
+
+
+@pytest.fixture(scope="module")
+def east_dnac():
+    with MockDnac(devices=40, prefix="east-") as dnac:
+        yield dnac
+
+
+@pytest.fixture(scope="module")
+def west_dnac():
+    with MockDnac(devices=30, prefix="west-") as dnac:
+        yield dnac
+
+
+@pytest.fixture
+def mock_env(monkeypatch, tmp_path):
+    """Point the CLI at a mock DNAC, using an empty cache (and token cache) and a scratch working directory"""
+
+    def configure(dnac: MockDnac, **profiles: MockDnac):
+        monkeypatch.setenv("DNAC_URL", dnac.url)
+        monkeypatch.setenv("DNAC_USER", "admin")
+        monkeypatch.setenv("DNAC_PASS", "admin")
+        monkeypatch.delenv("DNAC_TOKEN", raising=False)
+        monkeypatch.delenv("DNAC_CONTROLLERS", raising=False)
+        monkeypatch.setenv("DNAC_CACHE_DIR", str(tmp_path / "cache"))
+        for name, profile_dnac in profiles.items():
+            monkeypatch.setenv(f"DNAC_{name.upper()}_URL", profile_dnac.url)
+        monkeypatch.chdir(tmp_path)
+
+    return configure
+
+
+def test_get_devices_multiple_controllers(
+    east_dnac, west_dnac, mock_env, monkeypatch, tmp_path
+):
+    runner = CliRunner()
+    mock_env(east_dnac, east=east_dnac, west=west_dnac)
+    # Every run starts without cached tokens or inventory, so both controllers log in and write
+    # their caches at the same time
+    for run in range(5):
+        cache_dir = tmp_path / f"cache{run}"
+        monkeypatch.setenv("DNAC_CACHE_DIR", str(cache_dir))
+        result = runner.invoke(
+            dnac_cli, ["get", "--controllers", "east,west", "inventory", "devices"]
+        )
+        assert result.exit_code == 0, result.output
+        result = runner.invoke(
+            dnac_cli,
+            [
+                "get",
+                "--controllers",
+                "east,west",
+                "--offline",
+                "inventory",
+                "devices",
+                "--output",
+                "csv",
+            ],
+        )
+        assert result.exit_code == 0, result.output
+        rows = [line for line in result.output.splitlines() if line.count(",") == 4]
+        assert sum(row.startswith("east,east-dev") for row in rows) == 40
+        assert sum(row.startswith("west,west-dev") for row in rows) == 30
+        # Both tokens were cached
+        with open(cache_dir / "tokens.json") as infile:
+            assert len(json.load(infile)) == 2
+        assert not list(cache_dir.glob("*.tmp"))
+
+
+def test_token_cache_concurrent_saves(tmp_path):
+    token_cache = TokenCache(str(tmp_path))
+    threads = [
+        threading.Thread(
+            target=token_cache.save,
+            args=(f"https://dnac{idx}.abc.inc", "admin", f"token-{idx}"),
+        )
+        for idx in range(16)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for idx in range(16):
+        assert token_cache.get(f"https://dnac{idx}.abc.inc", "admin") == f"token-{idx}"
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_get_devices_incremental_sync(east_dnac, mock_env, tmp_path):
+    runner = CliRunner()
+    mock_env(east_dnac)
+    cache = ResponseCache(east_dnac.url, directory=str(tmp_path / "cache"))
+    sync_args = ["get", "--incremental", "--cache-ttl", "0", "inventory", "devices"]
+    result = runner.invoke(dnac_cli, ["get", "inventory", "devices"])
+    assert result.exit_code == 0, result.output
+    assert cache.pull_age(INVENTORY_PATH) is not None
+
+    # Nothing changed in DNAC, so the snapshot is synced without pulling any device
+    east_dnac.reset()
+    result = runner.invoke(dnac_cli, sync_args)
+    assert result.exit_code == 0, result.output
+    assert "0 added, 0 changed, 0 removed, 40 unchanged" in result.output
+    assert "GET /dna/intent/api/v1/network-device" not in east_dnac.stats()["endpoints"]
+
+    # A device whose cached hostname no longer matches DNAC is re-fetched
+    records = list(cache.read(INVENTORY_PATH))
+    hostname = records[0]["hostname"]
+    records[0]["hostname"] = "renamed"
+    list(cache.write(INVENTORY_PATH, records))
+    east_dnac.reset()
+    result = runner.invoke(dnac_cli, sync_args)
+    assert result.exit_code == 0, result.output
+    assert "0 added, 1 changed, 0 removed, 39 unchanged" in result.output
+    assert east_dnac.stats()["endpoints"]["GET /dna/intent/api/v1/network-device"] == 1
+    assert next(cache.read(INVENTORY_PATH))["hostname"] == hostname
+
+    # Syncing doesn't restart the snapshot's age, so fields syncs don't compare are eventually refreshed
+    records = list(cache.read(INVENTORY_PATH))
+    records[0]["reachabilityStatus"] = "Unreachable"
+    list(cache.write(INVENTORY_PATH, records))
+    day_ago = time.time() - 86400
+    os.utime(cache.pulled_path(INVENTORY_PATH), (day_ago, day_ago))
+    result = runner.invoke(dnac_cli, sync_args)
+    assert result.exit_code == 0, result.output
+    assert "Incremental sync" not in result.output
+    assert "1 miss(es), 0 incremental sync(s)" in result.output
+    assert next(cache.read(INVENTORY_PATH))["reachabilityStatus"] == "Reachable"
+    assert cache.pull_age(INVENTORY_PATH) < 60
+
+
+def test_site_client_health_missing_site():
+    client = Mock()
+    client.get.return_value = Mock(
+        status_code=200,
+        json=lambda: {"response": [{"siteId": "other-site", "scoreDetail": []}]},
+    )
+    scores, error = get_site_client_health(client, "requested-site", 0)
+    assert scores is None
+    assert "didn't return client health" in error
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 11))
+    assert percentile(values, 50) == 5
+    assert percentile(values, 95) == 10
+    assert percentile(values, 99) == 10
+    assert percentile(values, 0) == 1
+    assert percentile(list(range(1, 21)), 95) == 19
+    assert percentile([], 50) == 0
+
+
+def test_devices_by_regex_invalid_pattern():
+    with pytest.raises(click.BadParameter, match="not a valid regex"):
+        get_devices_by_regex(Mock(), "[")
+
+
+def test_get_licenses_streams_every_device(east_dnac, west_dnac, mock_env):
+    runner = CliRunner()
+    mock_env(east_dnac, east=east_dnac, west=west_dnac)
+    # Few workers, so the window of pending lookups fills up many times over
+    result = runner.invoke(
+        dnac_cli,
+        [
+            "get",
+            "--controllers",
+            "east,west",
+            "licenses",
+            "--workers",
+            "2",
+            "--output",
+            "csv",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    rows = [line for line in result.output.splitlines() if "network-advantage" in line]
+    assert [row.split(",")[0] for row in rows] == ["east"] * 40 + ["west"] * 30
+
+
+def test_iter_controllers_streams_items():
+    # Controllers with endless items can only be consumed if items are yielded as they're produced
+    ctx = Mock(meta={CONTROLLERS_KEY: {"east": "east-client", "west": "west-client"}})
+    stopped = []
+
+    def endless(client):
+        try:
+            for idx in itertools.count():
+                yield f"{client}-{idx}"
+        finally:
+            stopped.append(client)
+
+    items = iter_controllers(ctx, endless)
+    assert list(itertools.islice(items, 3)) == [
+        ("east", "east-client-0"),
+        ("east", "east-client-1"),
+        ("east", "east-client-2"),
+    ]
+    # Stopping early stops every controller's worker
+    items.close()
+    assert sorted(stopped) == ["east-client", "west-client"]
+
+
+def test_get_devices_unreachable_controller(east_dnac, mock_env, monkeypatch):
+    runner = CliRunner()
+    mock_env(east_dnac, east=east_dnac)
+    monkeypatch.setenv("DNAC_DOWN_URL", "http://127.0.0.1:1")
+    result = runner.invoke(
+        dnac_cli,
+        [
+            "get",
+            "--controllers",
+            "east,down",
+            "inventory",
+            "devices",
+            "--output",
+            "csv",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert sum(line.startswith("east,") for line in result.output.splitlines()) == 40
+    assert "Could not retrieve data from 1 controller(s):" in result.output
+    assert "  down: " in result.output
+
+
+def test_startup_skips_heavy_imports():
+    # The CLI is often run many times in a row, so --help shouldn't load command modules or heavy libraries
+    times = import_times(
+        "from dnac_sidekick.cli import dnac_cli; dnac_cli(['--help'], standalone_mode=False)"
+    )
+    loaded = sorted(
+        module
+        for module in times
+        if module.split(".")[0] in HEAVY_MODULES
+        or module.startswith("dnac_sidekick.")
+        and module.endswith(".commands")
+    )
+    assert loaded == []
+
+
+def test_command_runner_failed_task(east_dnac, mock_env):
+    runner = CliRunner()
+    mock_env(east_dnac)
+    # The 6th command goes in a second task per device batch, which fails in the mock DNAC
+    commands = [f"show {idx}" for idx in range(5)] + ["fail now"]
+    args = ["command-runner", "--device-regex", "^east-dev1"]
+    for cmd in commands:
+        args.extend(["--command", cmd])
+    result = runner.invoke(dnac_cli, args)
+    assert result.exit_code == 0, result.output
+    assert (
+        "===== east-dev1.abc.inc: fail now =====\nFAILURE: Command runner request failed"
+        in result.output
+    )
+    assert (
+        "===== east-dev1.abc.inc: show 4 =====\neast-dev1.abc.inc#show 4"
+        in result.output
+    )
+
+
+def test_command_runner_multiple_controllers(east_dnac, west_dnac, mock_env):
+    runner = CliRunner()
+    mock_env(east_dnac, east=east_dnac, west=west_dnac)
+    result = runner.invoke(
+        dnac_cli,
+        [
+            "command-runner",
+            "--controllers",
+            "east,west",
+            "--device-regex",
+            r"-dev2\.",
+            "--command",
+            "show clock",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    headers = [line for line in result.output.splitlines() if line.startswith("=====")]
+    assert headers == [
+        "===== east/east-dev2.abc.inc: show clock =====",
+        "===== west/west-dev2.abc.inc: show clock =====",
+    ]
+
+
+def test_command_runner_invalid_regex():
+    # Invalid patterns are rejected while options are parsed, before any DNAC settings are needed
+    result = CliRunner().invoke(
+        dnac_cli, ["command-runner", "--device-regex", "[", "--command", "show clock"]
+    )
+    assert result.exit_code == 2
+    assert "not a valid regex" in result.output
+
+
+def test_worst_sites_window(tmp_path):
+    history = HealthHistory(str(tmp_path / "health.db"))
+    now = time.time()
+    health = lambda name, location, score: {
+        "name": name,
+        "location": location,
+        "overallHealth": score,
+    }
+    history.record_devices(
+        "dnac",
+        [
+            health("a1", "Site A", 2),
+            health("a2", "Site A", 6),
+            health("b1", "Site B", 3),
+        ],
+        recorded_at=now - 2 * 86400,
+    )
+    # a1 recovered, and b1 was removed from DNAC
+    history.record_devices(
+        "dnac",
+        [health("a1", "Site A", 8), health("a2", "Site A", 6)],
+        recorded_at=now - 86400,
+    )
+    rows = [tuple(row) for row in history.worst_sites("dnac", since=6 * 3600)]
+    assert rows == [("Site A", 2, 7.0, 6)]
+    # a1's drop is only part of a window that reaches back before it recovered
+    rows = [tuple(row) for row in history.worst_sites("dnac", since=3 * 86400)]
+    assert rows == [("Site A", 2, 7.0, 2)]
+    history.close()
+
+
+def test_health_trends_without_credentials(monkeypatch, tmp_path):
+    # Only the controllers' URLs are needed to read the local history
+    for name in ("DNAC_USER", "DNAC_PASS", "DNAC_TOKEN", "DNAC_CONTROLLERS"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("DNAC_URL", "https://dnac.abc.inc")
+    monkeypatch.setenv("DNAC_EAST_URL", "https://dnac-east.abc.inc/")
+    db = str(tmp_path / "health.db")
+    history = HealthHistory(db)
+    device = {"name": "leaf1", "location": "Site A", "overallHealth": 4}
+    history.record_devices("https://dnac.abc.inc", [device])
+    history.record_devices("https://dnac-east.abc.inc", [{**device, "name": "leaf2"}])
+    history.close()
+    runner = CliRunner()
+    trends = ["health", "trends", "--report", "worst-sites", "--history-db", db]
+    result = runner.invoke(dnac_cli, ["get", *trends])
+    assert result.exit_code == 0, result.output
+    assert "Site A" in result.output
+    result = runner.invoke(dnac_cli, ["get", "--controllers", "east", *trends])
+    assert result.exit_code == 0, result.output
+    assert "east" in result.output and "Site A" in result.output
+
+
+def test_site_group_names_unique():
+    site = lambda site_id, name, parent_id="global": Site(
+        id=site_id, name=name, parent_id=parent_id, hierarchy=name
+    )
+    sites = {
+        "c": site("c", "bld_1_floor_1"),
+        "f": site("f", "floor_1"),
+        "a": site("a", "bld_1"),
+        # Prefixed with its building, this floor's name is already taken by the site above
+        "b": site("b", "floor_1", "a"),
+        # Top-level sites have no parent name to prefix
+        "g": site("g", "floor_1"),
+    }
+    devices = {
+        "d1": TopologyNode(id="d1", hostname="leaf1", ip="10.0.0.1", site_id="b")
+    }
+    inventory, group_names = {}, set()
+    add_site_groups(inventory, "", sites, devices, 0, group_names)
+    assert group_names == {
+        "bld_1_floor_1",
+        "floor_1",
+        "bld_1",
+        "bld_1_floor_1_2",
+        "floor_1_2",
+    }
+    floor = inventory["children"]["bld_1"]["children"]["bld_1_floor_1_2"]
+    assert floor["hosts"] == {"leaf1": {"ansible_host": "10.0.0.1"}}
+    assert inventory["children"]["bld_1_floor_1"]["hosts"] == {}
+
+
+def test_render_testbed_keeps_old_file_on_failure(tmp_path):
+    from jinja2 import Template
+
+    template = Template(
+        "user: {{ user }}\n{% for dev in device_data %}{{ dev }}\n{% endfor %}"
+    )
+    path = tmp_path / "testbed.yaml"
+    render_testbed(template, {"user": "admin"}, ["leaf1", "leaf2"], str(path))
+    assert path.read_text() == "user: admin\nleaf1\nleaf2\n"
+
+    def devices():
+        yield "leaf3"
+        raise click.ClickException("DNAC went away")
+
+    with pytest.raises(click.ClickException):
+        render_testbed(template, {"user": "admin"}, devices(), str(path))
+    # The previous testbed is untouched and no temporary file is left behind
+    assert path.read_text() == "user: admin\nleaf1\nleaf2\n"
+    assert os.listdir(tmp_path) == ["testbed.yaml"]
+
+
+def test_cache_freshness_honors_max_sync_age(tmp_path):
+    cache = ResponseCache(
+        "https://dnac.abc.inc", directory=str(tmp_path), max_sync_age=3600
+    )
+    fetch = lambda: [{"id": "pulled"}]
+    assert list(cache.records(INVENTORY_PATH, fetch, sync=lambda records: None))
+    assert list(cache.cached(INVENTORY_PATH)) == [{"id": "pulled"}]
+    # The last full pull was two hours ago, and a sync has refreshed the snapshot since
+    pulled_at = time.time() - 7200
+    os.utime(cache.pulled_path(INVENTORY_PATH), (pulled_at, pulled_at))
+    assert cache.cached(INVENTORY_PATH) is None
+    fetch = lambda: [{"id": "pulled again"}]
+    assert list(cache.records(INVENTORY_PATH, fetch, sync=lambda records: None)) == [
+        {"id": "pulled again"}
+    ]
+    # A full pull is used until it goes stale, however old it is compared to max_sync_age
+    cache.max_sync_age = 0
+    assert list(cache.cached(INVENTORY_PATH)) == [{"id": "pulled again"}]
+    cache.offline = True
+    cache.ttl = 0
+    assert list(cache.cached(INVENTORY_PATH)) == [{"id": "pulled again"}]
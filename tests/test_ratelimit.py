@@ -0,0 +1,147 @@
+import threading
+import time
+from email.utils import formatdate
+from unittest.mock import Mock
+from click.testing import CliRunner
+from dnac_sidekick.cli import dnac_cli
+from dnac_sidekick.helpers import ratelimit
+from dnac_sidekick.helpers.client import client_from_env
+from dnac_sidekick.helpers.ratelimit import (
+    DEFAULT_RATE_LIMITS,
+    MAX_RETRIES,
+    RequestScheduler,
+    parse_rate_limit,
+)
+
+"""
+Unit tests for the request scheduler in dnac_sidekick/helpers/ratelimit.py. Requests are sent through
+stub 'send' functions returning canned responses, so no DNAC (or mock DNAC) is needed.
+"""
+
+DEVICES_PATH = "/dna/intent/api/v1/network-device"
+SITES_PATH = "/dna/intent/api/v1/site"
+TASK_PATH = "/api/v1/task/1234"
+
+
+def response(status: int, headers: dict = None):
+    return Mock(status_code=status, headers=headers or {})
+
+
+def stub_send(*responses):
+    """A 'send' function returning the given responses in order, which counts how often it was called"""
+    remaining = list(responses)
+
+    def send():
+        send.calls += 1
+        return remaining.pop(0) if len(remaining) > 1 else remaining[0]
+
+    send.calls = 0
+    return send
+
+
+def record_pauses(scheduler: RequestScheduler, family: str) -> list:
+    """Record the pauses of a family's bucket instead of waiting them out"""
+    pauses = []
+    scheduler.buckets[family].pause = pauses.append
+    return pauses
+
+
+def test_retry_after_seconds():
+    scheduler = RequestScheduler()
+    pauses = record_pauses(scheduler, "intent")
+    send = stub_send(response(429, {"Retry-After": "7"}), response(200))
+    assert scheduler.send("GET", DEVICES_PATH, send).status_code == 200
+    assert send.calls == 2
+    assert pauses == [7]
+    assert scheduler.stats["intent"]["throttled"] == 1
+    assert scheduler.stats["intent"]["retries"] == 1
+
+
+def test_retry_after_http_date():
+    scheduler = RequestScheduler()
+    pauses = record_pauses(scheduler, "intent")
+    retry_at = formatdate(time.time() + 30, usegmt=True)
+    send = stub_send(response(429, {"Retry-After": retry_at}), response(200))
+    assert scheduler.send("GET", DEVICES_PATH, send).status_code == 200
+    assert len(pauses) == 1
+    # HTTP dates only have second precision
+    assert 28 <= pauses[0] <= 30
+
+
+def test_gives_up_after_max_retries(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(ratelimit.time, "sleep", sleeps.append)
+    scheduler = RequestScheduler()
+    send = stub_send(response(503, {"Retry-After": "1"}))
+    assert scheduler.send("GET", DEVICES_PATH, send).status_code == 503
+    assert send.calls == MAX_RETRIES + 1
+    assert sleeps == [1] * MAX_RETRIES
+    assert scheduler.stats["intent"]["retries"] == MAX_RETRIES
+    assert scheduler.stats["intent"]["failed"] == 1
+
+
+def test_post_not_retried_on_server_error(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(ratelimit.time, "sleep", sleeps.append)
+    scheduler = RequestScheduler()
+    send = stub_send(response(503), response(200))
+    assert scheduler.send("POST", DEVICES_PATH, send).status_code == 503
+    assert send.calls == 1
+    assert not sleeps
+    assert scheduler.stats["intent"]["retries"] == 0
+
+
+def test_throttling_pauses_endpoint_family():
+    scheduler = RequestScheduler({"intent": (100, 100), "task": (100, 100)})
+    # Let the test know once the throttled request has paused its family
+    bucket = scheduler.buckets["intent"]
+    paused = threading.Event()
+    pause = bucket.pause
+    bucket.pause = lambda seconds: (pause(seconds), paused.set())
+    throttled = threading.Thread(
+        target=scheduler.send,
+        args=(
+            "GET",
+            DEVICES_PATH,
+            stub_send(response(429, {"Retry-After": "0.5"}), response(200)),
+        ),
+    )
+    throttled.start()
+    assert paused.wait(5)
+
+    # Other families aren't affected
+    start = time.monotonic()
+    scheduler.send("GET", TASK_PATH, stub_send(response(200)))
+    assert time.monotonic() - start < 0.1
+    # Another endpoint in the same family waits out the pause
+    scheduler.send("GET", SITES_PATH, stub_send(response(200)))
+    assert time.monotonic() - start >= 0.4
+    throttled.join()
+
+
+def test_held_back_requests_reported(capsys):
+    scheduler = RequestScheduler({"intent": (50, 1)})
+    for _ in range(3):
+        scheduler.send("GET", DEVICES_PATH, stub_send(response(200)))
+    # The first request used the only token, so the others waited for the bucket to refill
+    assert scheduler.stats["intent"]["held"] == 2
+    assert scheduler.stats["intent"]["held_seconds"] > 0
+    scheduler.report()
+    assert "DNAC intent API: 2 of 3 request(s) held back" in capsys.readouterr().err
+
+
+def test_rate_limit_option(monkeypatch, tmp_path):
+    monkeypatch.setenv("DNAC_URL", "https://dnac.example.com")
+    monkeypatch.setenv("DNAC_TOKEN", "token")
+    monkeypatch.setenv("DNAC_CACHE_DIR", str(tmp_path))
+    monkeypatch.setenv("DNAC_RATE_LIMITS", "intent=10,task=2")
+    runner = CliRunner()
+    result = runner.invoke(dnac_cli, ["get", "--rate-limit", "fast", "licenses"])
+    assert result.exit_code == 2
+    assert "Invalid rate limit 'fast'" in result.output
+    client = client_from_env(None, parse_rate_limit("50/100"))
+    assert client.scheduler.buckets["intent"].rate == 50
+    assert client.scheduler.buckets["intent"].capacity == 100
+    # Other families keep their limits from DNAC_RATE_LIMITS (or the defaults)
+    assert client.scheduler.buckets["task"].rate == 2
+    assert client.scheduler.buckets["file"].rate == DEFAULT_RATE_LIMITS["file"][0]